@@ -3,50 +3,21 @@ DROP PROCEDURE IF EXISTS GetLicenseCountBySpeciesYear;
 CREATE PROCEDURE GetLicenseCountBySpeciesYear()
 /*
 call GetLicenseCountBySpeciesYear
+
+Reads pet_license_summary, which the loader keeps current, so the cost follows
+the number of species and years instead of the number of licenses.
+Every species and year in the data is listed, 0 where a species has no licenses that year.
 */
 BEGIN
-    DROP TABLE IF EXISTS myData;
-	CREATE TEMPORARY TABLE myData 
-	SELECT p.species AS species
-			, YEAR(license_issue_date) AS license_issue_date_year
-			, COUNT(p.license_number) AS pet_license_count
-	FROM pet_license p
-	GROUP BY species,YEAR(license_issue_date);
-	   
-	DROP TABLE IF EXISTS output;
-	CREATE TEMPORARY TABLE output 
-	SELECT species
-		, license_issue_date_year
-		, 0 as pet_license_count
-	FROM 
-		  ( SELECT       'Cat' AS species 
-			UNION SELECT 'Dog' 
-			UNION SELECT 'Goat' 
-			UNION SELECT 'Pig'
-			) AS myspecies 
-	CROSS JOIN  
-		  ( SELECT       '2003' AS license_issue_date_year 
-			UNION SELECT '2006'
-			UNION SELECT '2008'
-			UNION SELECT '2011'
-			UNION SELECT '2014'
-			UNION SELECT '2015'
-			UNION SELECT '2016'
-			UNION SELECT '2017'
-			UNION SELECT '2018'
-			UNION SELECT '2019'
-			) AS myyears
-	ORDER BY species, license_issue_date_year;
-
-	UPDATE output o, myData d
-	SET    o.pet_license_count  = d.pet_license_count
-	WHERE  o.species = d.species
-	AND    o.license_issue_date_year = d.license_issue_date_year;
-    
-    SELECT * FROM output;
-    
-    DROP TABLE IF EXISTS output;
-    DROP TABLE IF EXISTS myData;
+	SELECT s.species
+		, y.license_issue_date_year
+		, COALESCE(c.row_count, 0) AS pet_license_count
+	FROM (SELECT DISTINCT species FROM pet_license_summary WHERE row_count > 0) AS s
+	CROSS JOIN (SELECT DISTINCT license_issue_date_year FROM pet_license_summary WHERE row_count > 0) AS y
+	LEFT JOIN pet_license_summary c
+		ON  c.species = s.species
+		AND c.license_issue_date_year = y.license_issue_date_year
+	ORDER BY s.species, y.license_issue_date_year;
 END //
  
-DELIMITER ;
\ No newline at end of file
+DELIMITER ;
@@ -0,0 +1,11 @@
+USE rover;
+
+ALTER TABLE import_log
+    ADD COLUMN count_ms integer NULL,
+    ADD COLUMN fetch_ms integer NULL,
+    ADD COLUMN decode_ms integer NULL,
+    ADD COLUMN encode_ms integer NULL,
+    ADD COLUMN insert_ms integer NULL,
+    ADD COLUMN commit_ms integer NULL,
+    ADD COLUMN rows_per_sec integer NULL,
+    ADD COLUMN bytes bigint NULL;
@@ -0,0 +1,16 @@
+USE rover;
+
+CREATE TABLE IF NOT EXISTS import_checkpoint (
+    topic varchar(50) NOT NULL,
+    target_db varchar(50) NOT NULL,
+    target_table varchar(50) NOT NULL,
+    initialize tinyint NOT NULL,
+    filter_value varchar(50) NULL,
+    paging varchar(10) NOT NULL,
+    page_key varchar(100) NULL,
+    row_offset integer NOT NULL,
+    total_row_count integer NOT NULL,
+    status varchar(10) NOT NULL,
+    updated_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    primary key pk_import_checkpoint (topic)
+);
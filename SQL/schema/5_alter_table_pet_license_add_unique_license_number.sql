@@ -0,0 +1,11 @@
+USE rover;
+
+-- keep the most recently loaded row of each license before adding the key
+DELETE older
+FROM pet_license older
+JOIN pet_license newer
+    ON newer.license_number = older.license_number
+    AND newer.pet_license_id > older.pet_license_id;
+
+ALTER TABLE pet_license
+    ADD UNIQUE KEY uk_pet_license_license_number (license_number);
@@ -0,0 +1,10 @@
+USE rover;
+
+-- a topic can load several targets, each with its own checkpoint
+ALTER TABLE import_checkpoint
+    ADD COLUMN target_conn varchar(50) NOT NULL DEFAULT '' AFTER topic,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY pk_import_checkpoint (topic, target_conn);
+
+-- checkpoints written before this change are all for pet_license on MYSQL_TARGET_1
+UPDATE import_checkpoint SET target_conn = 'MYSQL_TARGET_1' WHERE target_conn = '';
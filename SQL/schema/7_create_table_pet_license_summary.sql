@@ -0,0 +1,20 @@
+USE rover;
+
+-- license counts per species and year, kept up to date by the loader as each chunk commits
+CREATE TABLE IF NOT EXISTS pet_license_summary (
+    species varchar(50) NOT NULL,
+    license_issue_date_year integer NOT NULL,
+    row_count integer NOT NULL,
+    primary key pk_pet_license_summary (species, license_issue_date_year)
+);
+
+-- the watermark (filter_sql MAX) and the summary recounts of reconcile read license_issue_date ranges
+ALTER TABLE pet_license
+    ADD INDEX ix_pet_license_license_issue_date (license_issue_date);
+
+-- count what is loaded already, later chunks keep it current
+DELETE FROM pet_license_summary;
+INSERT INTO pet_license_summary (species, license_issue_date_year, row_count)
+SELECT species, YEAR(license_issue_date), COUNT(*)
+FROM pet_license
+GROUP BY species, YEAR(license_issue_date);
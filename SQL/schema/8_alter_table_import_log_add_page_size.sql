@@ -0,0 +1,4 @@
+USE rover;
+
+ALTER TABLE import_log
+    ADD COLUMN page_size integer NULL;
@@ -0,0 +1,14 @@
+-- run against the database of a postgres TARGET_CONN, ex. psql -d financedb
+
+CREATE TABLE IF NOT EXISTS pet_license (
+    pet_license_id serial,
+	license_issue_date timestamp NOT NULL,
+	license_number varchar(20) NOT NULL,
+	animal_s_name varchar(50) NULL,
+	species varchar(50) NOT NULL,
+	primary_breed varchar(50) NOT NULL,
+	secondary_breed varchar(50) NULL,
+	zip_code varchar(10) NULL,
+    CONSTRAINT pk_pet_license PRIMARY KEY (pet_license_id),
+    CONSTRAINT uk_pet_license_license_number UNIQUE (license_number)
+);
@@ -0,0 +1,16 @@
+-- run against the database of a postgres TARGET_CONN, ex. psql -d financedb
+
+CREATE TABLE IF NOT EXISTS pet_license_summary (
+    species varchar(50) NOT NULL,
+    license_issue_date_year integer NOT NULL,
+    row_count integer NOT NULL,
+    CONSTRAINT pk_pet_license_summary PRIMARY KEY (species, license_issue_date_year)
+);
+
+CREATE INDEX IF NOT EXISTS ix_pet_license_license_issue_date ON pet_license (license_issue_date);
+
+DELETE FROM pet_license_summary;
+INSERT INTO pet_license_summary (species, license_issue_date_year, row_count)
+SELECT species, EXTRACT(YEAR FROM license_issue_date), COUNT(*)
+FROM pet_license
+GROUP BY 1, 2;
@@ -5,5 +5,11 @@ CREATE USER IF NOT EXISTS 'importuser'@'%' IDENTIFIED BY 'IluvY0u2';
 GRANT INSERT ON rover.* TO 'importuser'@'%';
 GRANT SELECT ON rover.pet_license TO 'importuser'@'%';
 GRANT DROP ON rover.* TO 'importuser'@'%';
+GRANT UPDATE, DELETE ON rover.pet_license TO 'importuser'@'%';
+GRANT SELECT, UPDATE, DELETE ON rover.import_checkpoint TO 'importuser'@'%';
+-- initialize_mode 'swap' loads pet_license_initialize, builds its indexes and renames it over pet_license
+GRANT CREATE, ALTER ON rover.* TO 'importuser'@'%';
+GRANT CREATE, SELECT, UPDATE, DELETE ON rover.pet_license_initialize TO 'importuser'@'%';
+GRANT SELECT, UPDATE, DELETE ON rover.pet_license_summary TO 'importuser'@'%';
 
 FLUSH PRIVILEGES;
\ No newline at end of file
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+"""
+@package bench_pipeline
+
+ End-to-end benchmark of GatherAndStore.run against a local SODA stand-in.
+
+ Serves a synthetic pet_license dataset (or an NDJSON fixture) from
+ soda_standin.py, then runs a full --initialize import once per load mode,
+ each in its own process, and reports rows/s, the stage times recorded by
+ the run's PipelineMetrics and peak memory.
+
+ The target is a real MySQL table: by default pet_license_bench in the
+ MYSQL_TARGET_1 database, created LIKE pet_license when missing.
+ It is truncated by every run, never point this at a table you need.
+
+ Usage: bench_pipeline.py [-h] [-n ROWS] [--fixture FIXTURE] [--modes MODES]
+                          [--paging PAGING] [--target_conn TARGET_CONN]
+                          [--target_table TARGET_TABLE]
+                          [--error_rate ERROR_RATE] [--slow_rate SLOW_RATE]
+                          [--slow_seconds SLOW_SECONDS]
+
+ --error_rate and --slow_rate inject 429/5xx errors and slow responses into
+ the stand-in, to measure the cost of the source client's retries.
+"""
+import argparse
+import copy
+import multiprocessing
+import resource
+import time
+from Queue import Empty
+
+import settings
+from gather_and_store import GatherAndStore
+from metrics import PipelineMetrics
+from row_codec import split_columns
+from soda_standin import Faults, SodaStandin, SyntheticDataset, FixtureDataset
+
+BENCH_TOPIC = 'pet_license_bench'
+
+
+def bench_settings(domain, options, load_mode):
+    """
+    A copy of the settings module with a benchmark topic pulling from the stand-in
+    """
+    bench = type('BenchSettings', (object,), {})()
+    for name in dir(settings):
+        if name.isupper():
+            setattr(bench, name, copy.deepcopy(getattr(settings, name)))
+
+    topic = dict(settings.IMPORT_TOPICS['pet_license'])
+    topic.update({
+        'topic_name': BENCH_TOPIC,
+        'source_url': domain,
+        'source_scheme': 'http',
+        'target_conn': options.target_conn,
+        'target_table': options.target_table,
+        'load_mode': load_mode,
+        'paging': options.paging
+    })
+    # the bench table is not counted in pet_license's summary
+    topic.pop('summary_table', None)
+    if [1 for name in split_columns(options.target_conn)\
+            if bench.TARGET_CONN[name].get('target_type') == 'postgres']:
+        # COPY only reads back escaped back slashes and quotes
+        topic['serializer_settings'] = {'escapes': frozenset(['\\', '"'])}
+    bench.IMPORT_TOPICS = {BENCH_TOPIC: topic}
+    # every mode pulls from the stand-in, not from pages an earlier mode cached
+    bench.MISC['page_cache_max_mb'] = 0
+    return bench
+
+
+def run_mode(domain, options, load_mode, results):
+    """
+    Run one full import in this process and put its measurements on results
+    """
+    run_options = argparse.Namespace(import_topic=BENCH_TOPIC, initialize=True, resume=False, reconcile=False,\
+        replay=False, stage=False, load_staged=None, log_file=None)
+    gather = GatherAndStore(bench_settings(domain, options, load_mode), run_options)
+    for writer in gather.writers:
+        writer.client.create_table_like(options.target_table, 'pet_license')
+
+    start = time.time()
+    error = None
+    try:
+        gather.run()
+    except SystemExit:
+        pass
+    except Exception, e:
+        error = str(e)
+
+    results.put({
+        'mode': load_mode,
+        'seconds': time.time() - start,
+        'stages': gather.metrics.totals,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'error': error
+    })
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='benchmark GatherAndStore end to end against a local SODA stand-in')
+    PARSER.add_argument("-n", "--rows", type=int, default=10000, help="synthetic dataset rows, ex. 10000 to 10000000")
+    PARSER.add_argument("--fixture", help="serve this NDJSON fixture file (see fixtures.py) instead of synthetic rows")
+    PARSER.add_argument("--modes", default="bulk,batch,row", help="comma separated load modes to run")
+    PARSER.add_argument("--paging", default="keyset", help="keyset or offset")
+    PARSER.add_argument("--target_conn", default="MYSQL_TARGET_1", help="TARGET_CONN entry to load into")
+    PARSER.add_argument("--target_table", default="pet_license_bench", help="table to truncate and load")
+    PARSER.add_argument("--error_rate", type=float, default=0.0, help="share of source requests answered with 429/5xx")
+    PARSER.add_argument("--slow_rate", type=float, default=0.0, help="share of source requests answered slowly")
+    PARSER.add_argument("--slow_seconds", type=float, default=0.0, help="delay of the slow responses")
+    OPTIONS = PARSER.parse_args()
+
+    DATASET = FixtureDataset(OPTIONS.fixture) if OPTIONS.fixture else SyntheticDataset(OPTIONS.rows)
+    FAULTS = None
+    if OPTIONS.error_rate or OPTIONS.slow_rate:
+        FAULTS = Faults(OPTIONS.error_rate, slow_rate=OPTIONS.slow_rate, slow_seconds=OPTIONS.slow_seconds,\
+            retry_after=1)
+    SERVER = SodaStandin(DATASET, faults=FAULTS).start()
+    print "SODA stand-in serving %s rows on %s" % (DATASET.count, SERVER.domain())
+
+    RESULTS = multiprocessing.Queue()
+    print ("%-6s %10s %12s" + " %9s" * len(PipelineMetrics.STAGES) + " %12s") % tuple(['mode', 'seconds', 'rows/s']\
+        + ['%s s' % stage for stage in PipelineMetrics.STAGES] + ['peak RSS MB'])
+    try:
+        for MODE in [mode.strip() for mode in OPTIONS.modes.split(',') if mode.strip()]:
+            # one process per mode so peak RSS is per mode
+            WORKER = multiprocessing.Process(target=run_mode, args=(SERVER.domain(), OPTIONS, MODE, RESULTS))
+            WORKER.start()
+            WORKER.join()
+            try:
+                RESULT = RESULTS.get(timeout=1)
+            except Empty:
+                print "%-6s FAILED with exit code %s" % (MODE, WORKER.exitcode)
+                continue
+
+            if RESULT['error']:
+                print "%-6s FAILED: %s" % (MODE, RESULT['error'])
+                continue
+            print ("%-6s %10.2f %12.0f" + " %9.2f" * len(PipelineMetrics.STAGES) + " %12.1f") % tuple([MODE,\
+                RESULT['seconds'], DATASET.count / RESULT['seconds']] + [RESULT['stages'][stage]\
+                for stage in PipelineMetrics.STAGES] + [RESULT['peak_rss_kb'] / 1024.0])
+    finally:
+        SERVER.stop()
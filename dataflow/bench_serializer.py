@@ -0,0 +1,69 @@
+#!/usr/bin/python
+"""
+@package bench_serializer
+
+ Micro-benchmark of CsvSerializer over synthetic pet_license rows.
+ Compares serialize (one row at a time) with serialize_rows (many rows
+ written straight to a buffer) and reports rows/s and MB/s.
+
+ Usage: bench_serializer.py [-h] [-n ROWS] [-r REPEAT]
+"""
+import argparse
+import time
+from cStringIO import StringIO
+
+import settings
+from csv_serializer import CsvSerializer
+from fixtures import pet_license_tuples
+
+
+def per_row(serializer, rows):
+    """
+    The pre serialize_rows path: one serialize call and one write per row
+    """
+    out = StringIO()
+    for row in rows:
+        out.write(serializer.serialize(row))
+    return out.getvalue()
+
+
+def batched(serializer, rows):
+    """
+    serialize_rows into a single buffer
+    """
+    out = StringIO()
+    serializer.serialize_rows(rows, out)
+    return out.getvalue()
+
+
+def measure(function, serializer, rows, repeat):
+    """
+    Returns the best wall time of repeat runs and the output of the last one
+    """
+    best, output = None, None
+    for _ in range(repeat):
+        start = time.time()
+        output = function(serializer, rows)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='benchmark CsvSerializer on pet_license rows')
+    PARSER.add_argument("-n", "--rows", type=int, default=100000, help="number of synthetic rows")
+    PARSER.add_argument("-r", "--repeat", type=int, default=3, help="runs per implementation, best is kept")
+    OPTIONS = PARSER.parse_args()
+
+    SERIALIZER = CsvSerializer(**settings.SERIALIZER_SETTINGS)
+    ROWS = list(pet_license_tuples(OPTIONS.rows))
+
+    RESULTS = []
+    for name, function in [('serialize', per_row), ('serialize_rows', batched)]:
+        elapsed, output = measure(function, SERIALIZER, ROWS, OPTIONS.repeat)
+        RESULTS.append(output)
+        print "%-15s %8.3f s %12.0f rows/s %8.2f MB/s" % (name, elapsed,\
+            len(ROWS) / elapsed, len(output) / elapsed / (1024 * 1024))
+
+    if RESULTS[0] != RESULTS[1]:
+        print "ERROR: serialize and serialize_rows outputs differ"
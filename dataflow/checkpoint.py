@@ -0,0 +1,75 @@
+"""
+Utilities to checkpoint paged imports so they can be resumed
+"""
+
+class ImportCheckpoint:
+    """
+    Progress of a topic's paged import into one target, one row per topic
+    and target connection in the checkpoint table.
+    The row is saved after each chunk is committed to the target, so a resumed
+    import starts after the last committed chunk. With upserts, a chunk written
+    again after a crash between its commit and its checkpoint is harmless.
+    """
+    COLUMNS = ['topic', 'target_conn', 'target_db', 'target_table', 'initialize', 'filter_value',\
+        'paging', 'page_key', 'row_offset', 'total_row_count', 'status']
+
+    def __init__(self, client, table, topic, target_conn, target_db, target_table):
+        """
+            @param client - MySQLWrapper for the database holding the checkpoint table
+            @param table - checkpoint table
+            @param topic - import topic
+            @param target_conn - TARGET_CONN entry of the target
+            @param target_db - target database, a checkpoint only resumes into the same table
+            @param target_table - target table
+        """
+        self.client = client
+        self.table = table
+        self.topic = topic
+        self.target_conn = target_conn
+        self.target_db = target_db
+        self.target_table = target_table
+
+    def load(self):
+        """
+        Returns the unfinished checkpoint of the topic's target as a dict, or None
+        """
+        rows = self.client.execute("SELECT %s FROM %s WHERE topic = %%s AND target_conn = %%s"\
+            " AND status = 'running'" % (','.join(self.COLUMNS), self.table), ret=True,\
+            args=(self.topic, self.target_conn))
+        if not rows:
+            return None
+        checkpoint = dict(zip(self.COLUMNS, rows[0]))
+        if (checkpoint['target_db'], checkpoint['target_table']) != (self.target_db, self.target_table):
+            raise ValueError("checkpoint of %s on %s is for %s.%s, not %s.%s" % (self.topic, self.target_conn,\
+                checkpoint['target_db'], checkpoint['target_table'], self.target_db, self.target_table))
+        checkpoint['initialize'] = bool(checkpoint['initialize'])
+        return checkpoint
+
+    def start(self, initialize, filter_value, paging, total_row_count):
+        """
+        Record the start of a paged import, replacing the last checkpoint of the topic's target
+            @param initialize - whether the import started by truncating the target
+            @param filter_value - value of the incremental filter, None when initializing
+            @param paging - keyset or offset
+            @param total_row_count - rows reported by the COUNT query
+        """
+        values = [self.topic, self.target_conn, self.target_db, self.target_table, int(bool(initialize)),\
+            None if filter_value is None else str(filter_value), paging, None, 0, total_row_count, 'running']
+        self.client.execute("REPLACE INTO %s (%s) VALUES (%s)" % (self.table, ','.join(self.COLUMNS),\
+            ','.join(['%s'] * len(self.COLUMNS))), args=values)
+
+    def save(self, row_offset, page_key):
+        """
+        Record a committed chunk
+            @param row_offset - rows written so far, the offset of the next page
+            @param page_key - paging key of the last row written, the next page starts after it
+        """
+        self.client.execute("UPDATE %s SET row_offset = %%s, page_key = %%s WHERE topic = %%s"\
+            " AND target_conn = %%s" % self.table, args=(row_offset, page_key, self.topic, self.target_conn))
+
+    def finish(self):
+        """
+        Mark the import complete, so it is not resumed
+        """
+        self.client.execute("UPDATE %s SET status = 'complete' WHERE topic = %%s AND target_conn = %%s"\
+            % self.table, args=(self.topic, self.target_conn))
@@ -2,12 +2,18 @@
 """
 Utilities to encode and serialize
 """
+import logging
+import os
 import re
+import sys
+import tempfile
+from StringIO import StringIO
 
 class EscapedNewlineFilter:
     """
     Filter input for CSV reader.
-    This removes null and escaped newline
+    This removes null and joins lines split by escaped newlines, so each
+    item is a whole record
     """
     def __init__(self, file):
         self.file = file
@@ -22,12 +28,29 @@ class EscapedNewlineFilter:
         self.close()
 
     def next(self):
-        l = self.file.next()
-        l = l.replace("\0", "")
-        while len(l) > 1 and l[-2] == '\\' and (len(l) == 2 or l[-3] != '\\'):
-            # Do not trim '\\' and '\n'.
-            l = l + self.file.next()
-        return l
+        l = self.file.next().replace("\0", "")
+        if not self.continues(l):
+            return l
+        # a long record is collected in a list and joined once
+        parts = [l]
+        while self.continues(l):
+            try:
+                l = self.file.next().replace("\0", "")
+            except StopIteration:
+                # the file ends with an escaped newline
+                break
+            parts.append(l)
+        return ''.join(parts)
+
+    def continues(self, l):
+        """
+        Whether a line ends with a newline escaped by an odd number of back slashes
+        """
+        if not l.endswith('\n'):
+            return False
+        # Do not join after '\\' and '\n', an escaped back slash ends the record.
+        return (len(l) - 1 - len(l[:-1].rstrip('\\'))) % 2 == 1
+
     def close(self):
         self.file.close()
 
@@ -49,6 +72,7 @@ class CsvSerializer:
     QUOTABLE = frozenset([' ', '\t', ',', '\\', "'", '"', '\r', '\n'])
     QUOTABLE_PATTERN = re.compile(r"""[ ,\t\\'"\r\n]""")
     REMOVABLE = ['\0']
+    NON_ASCII_PATTERN = re.compile('[\x80-\xff]')
     VALIDATION_PATTERN = re.compile(
         # Detect invalid utf-8 encoding beyond 4 bytes sequence. Also detect \xef\xbf\xbf (U+FFFF) and
         # surrogate \xed\xa0\x80 to \xed\xbf\xbf or \ud800 to \udfff.
@@ -66,6 +90,10 @@ class CsvSerializer:
         self.escapes_removable_pattern = re.compile('[%s]' % ''.join(['\\\\' if e == '\\' else e for e in self.escapes] + ['\0']))
         self.validation_pattern = self.VALIDATION_16_PATTERN if utf16_only else self.VALIDATION_PATTERN
         self.quotes = quotes
+        # (char, replacement) pairs applied with str.replace by serialize_rows,
+        # back slash first so the added back slashes are not escaped again
+        self.escape_table = [('\0', '')] + sorted(
+            [(e, '\\' + e) for e in self.escapes if e != '\0'], key=lambda pair: pair[0] != '\\')
 
     def escape_column(self, column):
         """
@@ -96,21 +124,93 @@ class CsvSerializer:
         escaped = [self.escape_column(column) for column in row]
         return self.separator.join(escaped) + '\n'
 
+    def serialize_rows(self, rows, out):
+        """
+        Writes the CSV lines for many rows straight into a file-like buffer.
+        Same output as serialize, but escaping uses the precomputed escape_table
+        instead of a regex callback per escaped character.
+            @param rows - iterable of rows (lists or tuples of columns)
+            @param out - file-like object with a write method
+            @return number of rows written
+        """
+        null_value = self.null_value
+        separator = self.separator
+        quotes = self.quotes
+        escape_table = self.escape_table
+        needs_quote = self.QUOTABLE_PATTERN.search
+        needs_escape = self.escapes_removable_pattern.search
+        sanitize = self.sanitize if self.utf8_sanitize else None
+        write = out.write
+
+        count = 0
+        for row in rows:
+            fields = []
+            for column in row:
+                if column is None:
+                    fields.append(null_value)
+                    continue
+                if column.__class__ is not str:
+                    if not isinstance(column, unicode):
+                        fields.append(str(column))
+                        continue
+                    column = column.encode('utf-8')
+                if sanitize:
+                    column = sanitize(column)
+
+                quote = needs_quote(column)
+                if needs_escape(column):
+                    for char, replacement in escape_table:
+                        if char in column:
+                            column = column.replace(char, replacement)
+                if quote:
+                    column = quotes + column + quotes
+                fields.append(column)
+            write(separator.join(fields) + '\n')
+            count += 1
+        return count
+
+    def mysql_load_options(self):
+        """
+        Returns the LOAD DATA field and line options that read back
+        exactly what serialize writes with this serializer's settings
+        """
+        def literal(chars):
+            return chars.replace('\\', '\\\\').replace("'", "\\'")
+
+        return "FIELDS TERMINATED BY '%s' OPTIONALLY ENCLOSED BY '%s' ESCAPED BY '%s'"\
+            " LINES TERMINATED BY '\\n'" % (literal(self.separator), literal(self.quotes),\
+            '\\\\' if '\\' in self.escapes else '')
+
+    def postgres_copy_options(self):
+        """
+        Returns the COPY options that read back exactly what serialize writes.
+        COPY's CSV format only knows back slash escapes before the quote and the
+        back slash itself, so other escapes are refused: their columns are quoted
+        anyway and need no escaping, ex. escapes=['\\', '"'].
+        """
+        def literal(chars):
+            return "E'" + chars.replace('\\', '\\\\').replace("'", "''") + "'"
+
+        if '\\' not in self.escapes or self.quotes not in self.escapes\
+                or [e for e in self.escapes if e not in ('\\', self.quotes)]:
+            raise ValueError("COPY cannot read back escapes %s, use ['\\\\', %r]"\
+                % (sorted(self.escapes), self.quotes))
+        return "FORMAT csv, DELIMITER %s, QUOTE %s, ESCAPE %s, NULL %s" % (literal(self.separator),\
+            literal(self.quotes), literal('\\'), literal(self.null_value))
+
     def sanitize(self, in_chars):
         """
-        Sanitize input for invalid utf8
+        Sanitize input for invalid utf8 in a single pass: invalid bytes are
+        dropped by the decoder and rejected code points by one regex pass.
+        Pure ASCII input is returned untouched.
         """
         if not in_chars or not self.utf8_sanitize:
             return in_chars
-        try:
-            result, count = re.subn(self.validation_pattern, '', in_chars.decode('utf-8'))
-            if count:
-                result = result.encode('utf-8')
-            else:
-                result = in_chars
-        except UnicodeError, e:
-            result = self.sanitize(in_chars[:e.start] + in_chars[e.end:])
-        return result
+        if isinstance(in_chars, unicode):
+            return self.validation_pattern.sub(u'', in_chars)
+        if not self.NON_ASCII_PATTERN.search(in_chars):
+            return in_chars
+        return self.validation_pattern.sub(u'', in_chars.decode('utf-8', 'ignore')).encode('utf-8')
 
 # Unit test stuff
 class Test():
@@ -213,6 +313,10 @@ class Test():
             # Incomplete utf-8
             [['\xe5\x87\xb8-\xe5\x87'], '\xe5\x87\xb8-\n'],
             [['\xe5\x87\xb8-\xe5'], '\xe5\x87\xb8-\n']]
+        garbage_cases = [
+            # Long runs of invalid bytes used to recurse once per byte.
+            [['\xff' * 5000 + 'a' + '\x90' * 5000], 'a\n'],
+            [['\xe5\x8d\x90' + '\xc3' * 5000], '\xe5\x8d\x90\n']]
 
         for case in escape_cases:
             result = CsvSerializer(False).serialize(case[0])
@@ -226,13 +330,29 @@ class Test():
         for case in utf16_cases:
             result = CsvSerializer(True, utf16_only=True).serialize(case[0])
             self.verify(result, case)
+        for case in garbage_cases:
+            result = CsvSerializer(True).serialize(case[0])
+            self.verify(result, case)
+        # serialize_rows must write exactly what serialize returns
+        for serializer, cases in [(CsvSerializer(False), escape_cases),
+                                  (CsvSerializer(True), utf8_cases + null_cases + garbage_cases),
+                                  (CsvSerializer(True, utf16_only=True), utf16_cases)]:
+            buf = StringIO()
+            serializer.serialize_rows([case[0] for case in cases], buf)
+            self.verify(buf.getvalue(), [cases, ''.join([case[1] for case in cases])])
 
     def test_escaped_newline_filter(self):
         cases = [
             # Note 'a\x5c\nb\n' will lead to ['a\\\n', 'b\n'] without this filter.
             [['a\n', '\x5c\x5c\n', 'a\x5c\nb\n'], ['a\n', '\x5c\x5c\n', 'a\x5c\nb\n']],
             # Test end of a file without newline.
-            [['a\n', 'a\x5c\nb'], ['a\n', 'a\x5c\nb']]]
+            [['a\n', 'a\x5c\nb'], ['a\n', 'a\x5c\nb']],
+            # An escaped back slash before an escaped newline, and a back slash not before a newline.
+            [['a\x5c\x5c\x5c\n', 'b\n', 'c\x5cd'], ['a\x5c\x5c\x5c\nb\n', 'c\x5cd']],
+            # A record of many escaped newlines, and a file ending with an escaped newline.
+            [['a\x5c\n'] * 1000 + ['b\n', 'c\x5c\n'], [''.join(['a\x5c\n'] * 1000) + 'b\n', 'c\x5c\n']],
+            # Nulls are removed from every line of a record.
+            [['a\0\x5c\n', 'b\0\n'], ['a\x5c\nb\n']]]
         for case in cases:
             buf = StringIO()
             for l in case[0]:
@@ -242,6 +362,53 @@ class Test():
                 result = [l for l in f]
             self.verify(result, case)
 
+    def test_postgres_copy_options(self):
+        serializer = CsvSerializer(False, null_value='\x5cN', escapes=['\x5c', '"'])
+        self.verify(serializer.postgres_copy_options(), ['postgres escapes',\
+            "FORMAT csv, DELIMITER E',', QUOTE E'\"', ESCAPE E'\x5c\x5c', NULL E'\x5c\x5cN'"])
+        try:
+            CsvSerializer(False, escapes=['\x5c', '"', '\n']).postgres_copy_options()
+            print "Error: input: escaped new lines expected ValueError"
+        except ValueError:
+            pass
+
+    def test_postgres_round_trip(self, conn):
+        """
+        Bulk load serialized rows into a scratch table of a Postgres database
+        with the COPY options of the serializer and read them back
+            @param conn - host, port, user, password and db of the database
+        """
+        from postgres_wrapper import PostgresWrapper
+        client = PostgresWrapper(logging.getLogger('csv_serializer'), silent_mode=True, **conn)
+        table = 'csv_serializer_round_trip'
+        serializer = CsvSerializer(True, null_value='\x5cN', escapes=['\x5c', '"'])
+        values = ['plain', 'a "quoted" word', '"', '""', "it's", '\x5c', 'back\x5cslash', 'trailing\x5c',\
+            '\x5c"', '\x5cN', 'new\nline', 'escaped\x5c\nnewline', 'cr\r\nlf', 'tab\there', 'comma, here',\
+            ' lead and trail ', '', None, 'caf\xc3\xa9']
+        rows = [(number, value) for number, value in enumerate(values)]
+        path = None
+        client.execute("DROP TABLE IF EXISTS %s" % table)
+        client.execute("CREATE TABLE %s (number integer PRIMARY KEY, value text)" % table)
+        try:
+            with tempfile.NamedTemporaryFile(delete=False) as out:
+                path = out.name
+                serializer.serialize_rows(rows, out)
+            client.bulk_load(path, table, ['number', 'value'], serializer.postgres_copy_options())
+            result = [tuple(row) for row in client.execute("SELECT number, value FROM %s ORDER BY number" % table,\
+                ret=True)]
+            self.verify(result, ['postgres round trip', rows])
+        finally:
+            if path:
+                os.remove(path)
+            client.execute("DROP TABLE IF EXISTS %s" % table)
+            client.close()
+
 if __name__ == '__main__':
     Test().test_csv_serializer()
     Test().test_escaped_newline_filter()
+    Test().test_postgres_copy_options()
+    # with a scratch Postgres database, ex. 'host=localhost port=5432 db=test user=postgres password=secret'
+    if len(sys.argv) > 1:
+        conn = dict([item.split('=', 1) for item in sys.argv[1].split()])
+        conn['port'] = int(conn.get('port', 5432))
+        Test().test_postgres_round_trip(dict({'password': ''}, **conn))
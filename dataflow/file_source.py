@@ -0,0 +1,154 @@
+"""
+Utilities to read the rows of a local CSV or NDJSON export in parallel
+"""
+import csv
+import json
+import mmap
+import os
+import re
+from cStringIO import StringIO
+
+from csv_serializer import EscapedNewlineFilter
+
+# stands in for NULL fields while the csv module reads a record, it reads \N as N
+NULL_TOKEN = '\x1e'
+
+
+def file_format(path, source_format=None):
+    """
+    Returns 'csv' or 'ndjson', from source_format or the file extension
+    """
+    source_format = source_format or ('ndjson' if os.path.splitext(path)[1].lower() in ('.ndjson', '.json')\
+        else 'csv')
+    if source_format not in ('csv', 'ndjson'):
+        raise ValueError("source_format of %s is %s, not csv or ndjson" % (path, source_format))
+    return source_format
+
+
+def record_end(data, position, escape='\\'):
+    """
+    Returns the position after the first record end at or after position: a
+    newline not escaped by an odd number of escape characters, or the end of data.
+    NDJSON has no escaped newlines, JSON escapes them as \\n.
+    """
+    while True:
+        newline = data.find('\n', position)
+        if newline < 0:
+            return len(data)
+        escapes = 0
+        while escape and newline - escapes > 0 and data[newline - escapes - 1] == escape:
+            escapes += 1
+        if escapes % 2 == 0:
+            return newline + 1
+        position = newline + 1
+
+
+class FileSource:
+    """
+    A local CSV or NDJSON file, memory-mapped and split into spans of about
+    span_bytes that end on record boundaries, so each span can be parsed on
+    its own (see parse_span) by a pool of processes.
+
+    CSV files are read in the dialect CsvSerializer writes: a header row of
+    field names, values quoted where needed, back slashes escaping quotes,
+    back slashes and newlines (a record continues after an escaped newline),
+    and null_value for NULL. NDJSON files hold a JSON object per line.
+    """
+    def __init__(self, path, source_format=None, span_bytes=16 * 1024 * 1024, separator=',', quotes='"',\
+            null_value='\\N'):
+        """
+            @param path - the file
+            @param source_format - csv or ndjson, None to tell by the extension
+            @param span_bytes - bytes of a span, the records of one span are written as a chunk
+        """
+        self.path = path
+        self.format = file_format(path, source_format)
+        self.span_bytes = max(1, span_bytes)
+        self.dialect = {'delimiter': separator, 'quotechar': quotes, 'escapechar': '\\', 'doublequote': False}
+        self.null_value = null_value
+        self.size = os.path.getsize(path)
+        self.fields = None
+        self.data_start = 0
+        if self.format == 'csv' and self.size:
+            with open(path, 'rb') as source_file:
+                header = EscapedNewlineFilter(source_file).next()
+            self.fields = csv.reader([header], **self.dialect).next()
+            self.data_start = len(header)
+
+    def spans(self):
+        """
+        Returns [(start, end)] byte ranges of the records, in file order
+        """
+        if self.size <= self.data_start:
+            return []
+        escape = '\\' if self.format == 'csv' else None
+        spans = []
+        with open(self.path, 'rb') as source_file:
+            data = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                start = self.data_start
+                while start < self.size:
+                    end = record_end(data, min(start + self.span_bytes, self.size) - 1, escape)
+                    spans.append((start, end))
+                    start = end
+            finally:
+                data.close()
+        return spans
+
+    def parse_args(self, span, column_mapping=None):
+        """
+        Returns the arguments of parse_span for a span
+            @param column_mapping - the topic's (source field, target column, type), rows are
+                keyed by target column with it, by source field without it
+        """
+        names = None
+        if column_mapping:
+            names = [(field, column) for field, column, _ in column_mapping]
+            if self.fields is not None:
+                missing = [field for field, _ in names if field not in self.fields]
+                if missing:
+                    raise ValueError("%s has no fields %s" % (self.path, ','.join(missing)))
+        return (self.path, span[0], span[1], self.format, self.fields, names, self.dialect, self.null_value)
+
+
+def parse_span(path, start, end, source_format, fields, names, dialect, null_value):
+    """
+    Returns the rows of bytes start to end of a file, as dicts like the SODA
+    API returns, NULL fields left out. Runs in a pool process, so it takes and
+    returns only picklable values.
+        @param fields - field names of a CSV header
+        @param names - (source field, row key) of the fields to keep, None to keep every field
+    """
+    with open(path, 'rb') as source_file:
+        data = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            text = data[start:end]
+        finally:
+            data.close()
+
+    rows = []
+    if source_format == 'ndjson':
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if names:
+                record = dict([(key, record[field]) for field, key in names if record.get(field) is not None])
+            rows.append(record)
+        return rows
+
+    null_pattern = None
+    if null_value:
+        separator = re.escape(dialect['delimiter'])
+        # an unquoted field that is exactly null_value
+        null_pattern = re.compile(r"(?<![^%s])%s(?![^%s\r\n])" % (separator, re.escape(null_value), separator))
+    keys = [(fields.index(field), key) for field, key in names] if names else list(enumerate(fields))
+    records = EscapedNewlineFilter(StringIO(text))
+    if null_pattern:
+        records = (null_pattern.sub(NULL_TOKEN, record) for record in records)
+    for values in csv.reader(records, **dialect):
+        if not values:
+            continue
+        rows.append(dict([(key, values[index]) for index, key in keys\
+            if index < len(values) and values[index] != NULL_TOKEN]))
+    return rows
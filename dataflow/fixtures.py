@@ -0,0 +1,90 @@
+#!/usr/bin/python
+"""
+@package fixtures
+
+ Synthetic pet_license-shaped rows for benchmarks
+
+ Rows look like what the SODA API returns for dataset jguv-t9rb:
+ a dict of strings, with keys left out where the source value is NULL.
+ Run as a script to write a fixture file of NDJSON rows.
+
+ Usage: fixtures.py [-h] -n ROWS -o OUTPUT [--seed SEED]
+"""
+import argparse
+import json
+import random
+
+PET_LICENSE_COLUMNS = ['license_issue_date', 'license_number', 'animal_s_name',
+                       'species', 'primary_breed', 'secondary_breed', 'zip_code']
+
+SPECIES = [('Dog', 60), ('Cat', 38), ('Goat', 1), ('Pig', 1)]
+BREEDS = {
+    'Dog': ['Retriever, Labrador', 'Terrier', 'Chihuahua, Short Coat', 'German Shepherd',
+            'Poodle, Standard', 'Australian Shepherd', 'Mixed Breed, Medium (up to 44 lbs fully grown)'],
+    'Cat': ['Domestic Shorthair', 'Domestic Longhair', 'American Shorthair', 'Siamese', 'Maine Coon'],
+    'Goat': ['Miniature', 'Nubian', 'Alpine'],
+    'Pig': ['Pot-Bellied', 'Kunekune']
+}
+NAMES = ['Lucy', 'Charlie', 'Bella', 'Max', 'Luna', 'Oliver', 'Daisy', 'Milo', 'Penny', 'Leo',
+         'Mr. "Boots"', "O'Malley", 'Zo\xc3\xab', 'Jalape\xc3\xb1o', 'Sir Barks\\a Lot', 'Ch\xc3\xa9rie']
+
+
+SPECIES_CHOICES = []
+for _species, _weight in SPECIES:
+    SPECIES_CHOICES.extend([_species] * _weight)
+
+
+def pet_license_row(number, seed=0):
+    """
+    Returns row number of a synthetic pet_license dataset. Each row depends only
+    on (number, seed), so a stand-in server can produce any page without
+    holding the dataset. Rows are sorted by :id.
+        @param number - row number, 0 based
+        @param seed - random seed, the same seed gives the same rows
+    """
+    rand = random.Random(seed * 1000003 + number)
+    species = rand.choice(SPECIES_CHOICES)
+    row = {
+        ':id': 'row-%08x' % number,
+        'license_issue_date': '%04d-%02d-%02dT00:00:00.000' % (rand.choice([2003, 2006, 2008,\
+            2011, 2014, 2015, 2016, 2017, 2018, 2019]), rand.randint(1, 12), rand.randint(1, 28)),
+        'license_number': '%s%06d' % (rand.choice(['S', 'A', '']), number),
+        'species': species,
+        'primary_breed': rand.choice(BREEDS[species]),
+        'zip_code': '98%03d' % rand.randint(100, 199)
+    }
+    if rand.random() < 0.95:
+        row['animal_s_name'] = unicode(rand.choice(NAMES), 'utf-8')
+    if rand.random() < 0.4:
+        row['secondary_breed'] = rand.choice(BREEDS[species])
+    return row
+
+
+def pet_license_rows(count, seed=0):
+    """
+    Generate count rows of pet_license-shaped source data
+        @param count - number of rows
+        @param seed - random seed, the same seed gives the same rows
+    """
+    for number in xrange(count):
+        yield pet_license_row(number, seed)
+
+
+def pet_license_tuples(count, seed=0):
+    """
+    Generate the same rows as pet_license_rows as tuples ordered like PET_LICENSE_COLUMNS
+    """
+    for row in pet_license_rows(count, seed):
+        yield tuple([row.get(column) for column in PET_LICENSE_COLUMNS])
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='write synthetic pet_license rows as NDJSON')
+    PARSER.add_argument("-n", "--rows", type=int, required=True, help="number of rows, ex. 10000 to 10000000")
+    PARSER.add_argument("-o", "--output", required=True, help="fixture file to write")
+    PARSER.add_argument("--seed", type=int, default=0, help="random seed")
+    OPTIONS = PARSER.parse_args()
+
+    with open(OPTIONS.output, 'w') as fixture:
+        for ROW in pet_license_rows(OPTIONS.rows, OPTIONS.seed):
+            fixture.write(json.dumps(ROW) + '\n')
@@ -7,34 +7,80 @@
 
 
 
- Usage: gather_and_store.py [-h] -t IMPORT_TOPIC [--initialize]
+ Usage: gather_and_store.py [-h] (-t IMPORT_TOPIC | --all)
+                            [--initialize | --resume | --reconcile]
+                            [--log_file LOG_FILE]
 
  optional arguments:
    -h, --help            show this help message and exit
    -t IMPORT_TOPIC, --import_topic IMPORT_TOPIC
-                         Specify data import topic, ex. pet_license
+                         Specify data import topic, ex. pet_license, or a comma
+                         separated list of topics to run concurrently
+   --all                 Run every enabled import topic concurrently
    --initialize          To import ALL data from scratch or truncate target and
                          start over, add --initialize
+   --resume              Continue the topic's unfinished paged import after its
+                         last committed chunk, add --resume
+   --reconcile           To compare the source and target month by month and
+                         replace the months that differ, add --reconcile
+   --log_file LOG_FILE   Log to this file instead of the console. Concurrent
+                         topics always log to gather_and_store_<topic>.log
+                         in LOGGING['directory']
 """
 import argparse
+import datetime
+import json
 import logging
-from sodapy import Socrata
+import multiprocessing
+import os
+import re
+import resource
+import tempfile
+import threading
+import time
 
 import settings
 from settings import LOGGING
-from mysql_wrapper import MySQLWrapper
 from csv_serializer import CsvSerializer
+from file_source import FileSource, parse_span
+from page_prefetcher import PagePrefetcher, read_ahead
+from page_sizer import PageSizer
+from row_codec import RowCodec, soql_projection, split_columns
+from socrata_client import SocrataClient
+from import_log_writer import ImportLogWriter
+from metrics import PipelineMetrics
+from page_cache import CacheMiss, PageCache
+from staging import SegmentReader, SegmentWriter, latest_snapshot
+from summary import SummaryDelta, SummaryTable
+from target_writer import Chunk, TargetWriter
 
 class GatherAndStore():
     """
     Main class of module gather_and_store
 
     @function init - handles keyboard interrupt
+    @function init_page_cache - open the page cache and look up the dataset version
+    @function new_page_sizer - choose the page sizes of the run, adapting them to the source
+    @function new_codec - compile the row codec for a target table
     @function log_msg -accepts message and writes to file or console
-    @function socrata_pull - pull from socrata endpoint and write rows
-    @function write_rows - wrapper to loop rows and call write_row
-    @function write_row - write a single row to target
-    @function write_import_log - write to database import log
+    @function socrata_pull - pull from socrata endpoint and write rows, or stage them
+    @function load_staged - write the pages of a staged snapshot to the targets
+    @function file_pull - load a local CSV or NDJSON export, parsed on a process pool
+    @function start_initialize - truncate the targets or start loading staging copies of them
+    @function finish_initialize - validate the staging copies and swap them in
+    @function fetch_page - run one SoQL query, timing the request and the JSON decode
+    @function offset_pages - generate pages with limit/offset, ordered by the paging key
+    @function key_pages - generate pages that continue after the last seen paging key
+    @function source_field - the source field a target column is pulled from
+    @function page_query - build the SoQL query for one page
+    @function reconcile - replace the partitions whose source and target aggregates differ
+    @function month_replacer - stream the source rows of months into a target transaction
+    @function source_partitions - per-month aggregates of the source, via SoQL group by
+    @function target_partitions - per-month aggregates of the target table
+    @function write_rows - encode a chunk of rows once and queue it for every target
+    @function finish_writes - wait for every target to write the queued chunks
+    @function write_import_log - queue a row per target for the database import log
+    @function write_metrics_summary - write the stage timings of the run for monitoring
     @function run - logic to conduct the pull and storage of a dataset
     """
     def __init__(self, settings, options):
@@ -43,38 +89,124 @@ class GatherAndStore():
 
         self.import_topic = self.options.import_topic
         self.initialize_data = self.options.initialize
+        self.resume = self.options.resume
+        self.reconcile_data = self.options.reconcile
+        self.replay = self.options.replay
+        self.stage = self.options.stage
+        self.staged_snapshot = self.options.load_staged
+        self.log_file = self.options.log_file
 
         self.topic_info = self.settings.IMPORT_TOPICS[self.import_topic]
-        self.source_type = self.topic_info["source_type"]
+        # 'socrata' pulls from the dataset's SODA endpoint, 'file' loads the local export at source_path
+        self.source_type = self.topic_info.get("source_type", "socrata")
+        if self.source_type not in ('socrata', 'file'):
+            raise ValueError("source_type of %s is %s, not socrata or file" % (self.import_topic, self.source_type))
         self.target_type = self.topic_info["target_type"]
-        self.target_conn_name = self.topic_info["target_conn"]
+        # one TARGET_CONN entry, or a list of them to load the same rows into
+        self.target_conn_names = self.topic_info["target_conn"]
+        if isinstance(self.target_conn_names, basestring):
+            self.target_conn_names = split_columns(self.target_conn_names)
         self.target_table = self.topic_info["target_table"]
-        self.target_string_columns = self.topic_info["target_string_columns"].split(',')
-        self.target_date_columns = self.topic_info["target_date_columns"].split(',')
-        self.dataset_name = self.topic_info["dataset_name"]
+        self.target_string_columns = split_columns(self.topic_info.get("target_string_columns"))
+        self.target_date_columns = split_columns(self.topic_info.get("target_date_columns"))
+        self.target_integer_columns = split_columns(self.topic_info.get("target_integer_columns"))
+        # a file source logs its path as the dataset
+        self.dataset_name = self.topic_info["source_path"] if self.source_type == 'file'\
+            else self.topic_info["dataset_name"]
+        self.target_columns = split_columns(self.topic_info.get("target_columns"))\
+            or self.target_date_columns + self.target_string_columns
+        # (source field, target column, type) of each column; pulls select only these fields
+        self.column_mapping = self.topic_info.get("column_mapping")
+        self.projection = ['*']
+        self.source_fields = {}
+        if self.column_mapping:
+            self.projection = soql_projection(self.column_mapping)
+            self.target_columns = [column for _, column, _ in self.column_mapping]
+            self.target_date_columns = [column for _, column, kind in self.column_mapping if kind == 'date']
+            self.target_integer_columns = [column for _, column, kind in self.column_mapping if kind == 'integer']
+            self.target_string_columns = [column for _, column, kind in self.column_mapping if kind == 'string']
+            self.source_fields = dict([(column, field) for field, column, _ in self.column_mapping])
+        self.load_mode = self.topic_info.get("load_mode", "row")
+        self.paging = self.topic_info.get("paging", "offset")
+        self.paging_key = self.topic_info.get("paging_key", ":id")
+        self.upsert_key = split_columns(self.topic_info.get("upsert_key"))
+        self.partition_column = self.topic_info.get("partition_column")
+        self.reconcile_columns = split_columns(self.topic_info.get("reconcile_columns"))
+        # row counts per summary_column and year of summary_date_column, kept up to date by every chunk
+        self.summary = None
+        if self.topic_info.get("summary_table"):
+            self.summary = SummaryTable(self.topic_info["summary_table"], self.topic_info["summary_column"],\
+                self.topic_info["summary_date_column"], self.target_columns, upsert_key=self.upsert_key)
+        # 'truncate' the target tables for --initialize, or 'swap' in a freshly loaded copy
+        self.initialize_mode = self.topic_info.get("initialize_mode", "truncate")
+        if self.initialize_mode not in ('truncate', 'swap'):
+            raise ValueError("initialize_mode of %s is %s, not truncate or swap" % (self.import_topic,\
+                self.initialize_mode))
 
         self.tmp_dir = self.settings.MISC['tmp_dir']
         self.import_log_table = self.settings.MISC['import_log_table']
         self.pull_row_limit = self.settings.MISC['pull_row_limit']
-        self.import_logging_sql = self.settings.SQL_CMDS["import_log_sql"]
-
-        self.SERIALIZER_SETTINGS = self.settings.SERIALIZER_SETTINGS
-        self.TARGET_CONNECTION = self.settings.TARGET_CONN[self.target_conn_name]
+        self.fetch_concurrency = self.settings.MISC.get('fetch_concurrency', 1)
+        self.fetch_queue_depth = self.settings.MISC.get('fetch_queue_depth', 1)
+        self.target_queue_depth = self.settings.MISC.get('target_queue_depth', 2)
+        # pages start at pull_row_limit rows and adapt within these bounds, a fixed size without them
+        self.page_size_min = self.settings.MISC.get('page_size_min', self.pull_row_limit)
+        self.page_size_max = self.settings.MISC.get('page_size_max', self.pull_row_limit)
+        self.page_target_seconds = self.settings.MISC.get('page_target_seconds', 2)
+        self.page_memory_bytes = int(self.settings.MISC.get('page_memory_mb', 0) * 1024 * 1024)
+        self.import_log_columns = split_columns(self.settings.MISC['import_log_columns'])
+        self.metrics_dir = self.settings.MISC.get('metrics_dir')
+        self.checkpoint_table = self.settings.MISC.get('checkpoint_table', 'import_checkpoint')
+        self.page_cache_dir = self.settings.MISC.get('page_cache_dir')\
+            or os.path.join(self.tmp_dir, 'page_cache')
+        self.page_cache_bytes = int(self.settings.MISC.get('page_cache_max_mb', 0) * 1024 * 1024)
+        self.page_cache_ttl = self.settings.MISC.get('page_cache_ttl_hours', 24) * 3600
+        self.staging_dir = self.settings.MISC.get('staging_dir') or os.path.join(self.tmp_dir, 'staging')
+        self.staging_segment_bytes = int(self.settings.MISC.get('staging_segment_mb', 256) * 1024 * 1024)
+        self.staging_keep = self.settings.MISC.get('staging_keep', 2)
+        self.file_span_bytes = int(self.settings.MISC.get('file_span_mb', 16) * 1024 * 1024)
+        self.file_processes = self.settings.MISC.get('file_processes') or multiprocessing.cpu_count()
+
+        if self.stage and (self.resume or self.reconcile_data):
+            raise ValueError("--stage only stages a new pull, not --resume or --reconcile")
+        if self.staged_snapshot and (self.initialize_data or self.resume or self.reconcile_data or self.replay):
+            raise ValueError("--load_staged loads a snapshot as it was staged, without other modes")
+        if self.source_type == 'file':
+            if self.resume or self.reconcile_data or self.replay or self.stage or self.staged_snapshot:
+                raise ValueError("topic %s loads a file, only with or without --initialize" % self.import_topic)
+            if not self.initialize_data and not self.upsert_key:
+                raise ValueError("topic %s loads its whole file, without --initialize it needs an upsert_key"\
+                    % self.import_topic)
+        # an incremental pull starts from the target furthest behind and a resume from the
+        # chunk it was writing, the other targets are sent rows they hold again
+        if len(self.target_conn_names) > 1 and (not self.initialize_data or self.resume) and not self.upsert_key:
+            raise ValueError("topic %s writes to %s targets, without --initialize it needs an upsert_key"\
+                % (self.import_topic, len(self.target_conn_names)))
+
+        # a topic can override serializer settings, ex. the escapes a postgres COPY reads back
+        self.SERIALIZER_SETTINGS = dict(self.settings.SERIALIZER_SETTINGS,\
+            **self.topic_info.get('serializer_settings', {}))
         self.IMPORT_LOGGING = self.settings.TARGET_CONN['IMPORT_LOGGING']
 
+        # target_host and target_db are filled in per target
         self.implog_row_values = {
             'source_file': self.dataset_name,
-            'target_host': self.TARGET_CONNECTION['host'],
-            'target_db': self.TARGET_CONNECTION['db'],
             'target_table': self.target_table,
             'total_row_count': 0,
             'chunk_row_count': 0,
             'comments': ''
             }
 
-        self.source_curs = []
-        self.target_conn = {}
         self.logging_conn = {}
+        self.writers = []
+        self.implog_writer = None
+        self.page_cache = None
+        self.dataset_version = None
+        self.page_sizer = None
+        self.socrata_client = None
+        self.file_pool = None
+        self.stager = None
+        self.metrics = PipelineMetrics()
 
         self.logger = logging.getLogger('gather_and_store')
 
@@ -88,24 +220,13 @@ class GatherAndStore():
         ## Initialize the serializer
         self.serializer = CsvSerializer(**self.SERIALIZER_SETTINGS)
 
-        # target connection info
-        self.target_conn['host'] = self.TARGET_CONNECTION['host']
-        self.target_conn['port'] = self.TARGET_CONNECTION['port']
-        self.target_conn['user'] = self.TARGET_CONNECTION['user']
-        self.target_conn['password'] = self.TARGET_CONNECTION['password']
-        self.target_conn['db'] = self.TARGET_CONNECTION['db']
+        ## Compile the row codec, rows are encoded once for every target
+        self.codec = self.new_codec(self.target_table)
 
-        ## establish a database client for target
-        try:
-            # use different connection method based upon target_type
-            if self.target_type == 'mysql':
-                self.target_client = MySQLWrapper(self.logger, **self.target_conn)
-            else:
-                self.logger.exception("Could not find connection method for target_type %s"\
-                    % self.target_type, **LOGGING)
-        except Exception:
-            self.logger.exception("Could not initialize connection for target_conn %s"\
-                % self.topic_info["target_conn"], **LOGGING)
+        ## fork the processes that parse a file topic before any thread or connection
+        ## is started, the children would get copies of their locks and sockets
+        if self.source_type == 'file':
+            self.file_pool = multiprocessing.Pool(self.file_processes)
 
         # import logging connection info
         self.logging_conn['host'] = self.IMPORT_LOGGING['host']
@@ -114,18 +235,111 @@ class GatherAndStore():
         self.logging_conn['password'] = self.IMPORT_LOGGING['password']
         self.logging_conn['db'] = self.IMPORT_LOGGING['db']
 
-        ## establish a database client for import logging
-        try:
-            self.implog_client = MySQLWrapper(self.logger, **self.logging_conn)
-        except Exception:
-            self.logger.exception("Could not initialize connection for the"\
-                " import logging db connection.")
+        ## start the background writer for import logging,
+        ## it opens its own connection from the pool
+        self.implog_writer = ImportLogWriter(self.logger, self.logging_conn,\
+            self.import_log_table, self.import_log_columns,\
+            flush_interval=self.settings.MISC.get('import_log_flush_seconds', 5),\
+            flush_size=self.settings.MISC.get('import_log_flush_rows', 100))
+        self.implog_writer.start()
+
+        ## a writer thread per target, each with its own connection from the pool
+        for conn_name in self.target_conn_names:
+            try:
+                self.writers.append(TargetWriter(self, conn_name, self.target_queue_depth))
+            except Exception:
+                self.logger.exception("Could not initialize connection for target_conn %s" % conn_name)
+                raise
+        for writer in self.writers:
+            writer.start()
 
         ## establish a socrata client
+        if self.source_type == 'socrata':
+            try:
+                self.socrata_client = self.new_socrata_client()
+            except Exception:
+                self.logger.exception("Could not initialize socrata client")
+
+        ## pages are cached per dataset version, replay only reads the cache
+        if self.page_cache_bytes and self.socrata_client:
+            self.init_page_cache()
+        elif self.replay:
+            raise ValueError("--replay needs the page cache, set MISC['page_cache_max_mb']")
+        self.page_sizer = self.new_page_sizer()
+
+
+    def init_page_cache(self):
+        """
+        Open the page cache and look up the dataset version its entries are keyed by:
+        the source's rowsUpdatedAt, or with --replay the version last cached
+        """
+        self.page_cache = PageCache(self.page_cache_dir, self.page_cache_bytes, self.page_cache_ttl)
+        if self.replay:
+            self.dataset_version = self.page_cache.load_version(self.dataset_name)
+            if self.dataset_version is None:
+                raise CacheMiss("no pages of %s were cached to replay" % self.dataset_name)
+            self.log_msg("Replaying version %s of %s from the page cache."\
+                % (self.dataset_version, self.dataset_name))
+            return
+
         try:
-            self.socrata_client = Socrata(self.topic_info["source_url"], None)
+            metadata = self.socrata_client.get("/api/views/%s.json" % self.dataset_name)
+            self.dataset_version = json.loads(metadata)['rowsUpdatedAt']
         except Exception:
-            self.logger.exception("Could not initialize socrata client")
+            # without a version a cached page could be stale
+            self.logger.exception("Could not look up the version of %s, not caching pages" % self.dataset_name)
+            self.page_cache = None
+            return
+        self.page_cache.save_version(self.dataset_name, self.dataset_version)
+
+
+    def new_page_sizer(self):
+        """
+        Returns the PageSizer of this run's pages. Pages fetched ahead and the
+        one being written are held at once; --replay requests the pages with
+        the sizes they were cached with.
+        """
+        pages_in_flight = 1
+        if self.fetch_concurrency > 1:
+            pages_in_flight += max(self.fetch_queue_depth, self.fetch_concurrency)
+        planned = None
+        if self.replay:
+            planned = self.page_cache.load_page_sizes(self.dataset_name, self.dataset_version)
+        return PageSizer(self.pull_row_limit, self.page_size_min, self.page_size_max, self.page_target_seconds,\
+            memory_bytes=self.page_memory_bytes or None, pages_in_flight=pages_in_flight, planned=planned)
+
+
+    def new_codec(self, table, dialect=None):
+        """
+        Returns the topic's row codec for a target table
+            @param table - target table, optionally qualified with the db
+            @param dialect - TargetClient of the target, None to only encode rows
+        """
+        return RowCodec(table, self.target_columns, date_columns=self.target_date_columns,\
+            integer_columns=self.target_integer_columns, sanitize=self.serializer.sanitize,\
+            upsert_key=self.upsert_key, dialect=dialect)
+
+
+    def target_names(self):
+        """
+        Returns the topic's targets for log messages
+        """
+        return ', '.join([writer.label for writer in self.writers])
+
+
+    def new_socrata_client(self):
+        """
+        Returns a new client for the topic's socrata endpoint
+        """
+        # plain http is only for local stand-ins, see soda_standin.py
+        return SocrataClient(self.logger, self.topic_info["source_url"],\
+            app_token=self.topic_info.get("source_app_token", self.settings.MISC.get('socrata_app_token')),\
+            scheme=self.topic_info.get("source_scheme", "https"),\
+            connect_timeout=self.settings.MISC.get('source_connect_timeout', 10),\
+            read_timeout=self.settings.MISC.get('source_read_timeout', 120),\
+            retry_attempts=self.settings.MISC.get('source_retry_attempts', 5),\
+            backoff_base=self.settings.MISC.get('source_backoff_seconds', 1.0),\
+            backoff_max=self.settings.MISC.get('source_backoff_max_seconds', 60))
 
 
     def log_msg(self, msg):
@@ -133,13 +347,11 @@ class GatherAndStore():
         Logs a message to log_file (if exists)
         or (if no log file in args) prints to console
             @param msg - message to be logged or displayed
-
-                if self.log_file:
-                    self.logger.info(msg)
-                else:
-                    print "INFO: " + msg
         """
-        print "INFO: " + msg
+        if self.log_file:
+            self.logger.info(msg)
+        else:
+            print "INFO: " + msg
 
 
     def socrata_pull(self):
@@ -148,38 +360,63 @@ class GatherAndStore():
         """
         row_count = 0
         query = "select COUNT(*)"
-
-        if self.initialize_data:
+        filter_column_value = None
+
+        checkpoint = None
+        if self.resume:
+            checkpoint = self.resume_checkpoint()
+
+        if checkpoint:
+            # pull what the interrupted import was pulling, without truncating
+            self.initialize_data = checkpoint['initialize']
+            filter_column_value = checkpoint['filter_value']
+            if self.initialize_data:
+                self.start_initialize(resume=True)
+            else:
+                query = query + '\n' + self.topic_info['filter_soql'] % filter_column_value
+        elif self.initialize_data:
             self.log_msg("We are initializing the data which"\
                 + " means we will be pulling EVERYTHING!")
 
-            self.target_client.execute("truncate table %s;" % self.target_table)
+            # a staged pull initializes the targets when it is loaded
+            if not self.stage:
+                self.start_initialize()
         else:
-            result = self.target_client.execute(self.topic_info['filter_sql'], ret=True)[0][0]
-
-            if not result:
-                self.logger.exception("WARMING!!! Target table is empty.  "\
-                   + "Please use --initialize to initialize the data.")
-                exit(0)
-
-            if self.topic_info['filter_sql_result_datatype'] == "datetime":
-                filter_column_value = result.strftime("%Y-%m-%d")
-            elif self.topic_info['filter_sql_result_datatype'] == "integer":
-                filter_column_value = int(result)
-            else:
-                filter_column_value = result
+            # pull once from the target that is furthest behind,
+            # the others upsert the rows they already have
+            filter_values = []
+            for writer in self.writers:
+                result = writer.client.watermark(self.topic_info['filter_sql'],\
+                    self.topic_info['filter_sql_result_datatype'])
+
+                if not result:
+                    self.logger.exception("WARMING!!! Target table %s is empty.  " % writer.label\
+                       + "Please use --initialize to initialize the data.")
+                    exit(0)
+                filter_values.append(result)
+            filter_column_value = min(filter_values)
 
             # limit the query by filter
             query = query + '\n' + self.topic_info['filter_soql'] % filter_column_value
 
+        # rows with the same upsert_key are merged into one, so a swap checks
+        # the staging copy against the distinct keys (SoQL counts a single field)
+        key_count = None
+        if self.initialize_data and self.initialize_mode == 'swap' and len(self.upsert_key) == 1:
+            query = query + ", count(distinct %s) as key_count"\
+                % self.source_fields.get(self.upsert_key[0], self.upsert_key[0])
+
         # get a row count for the dataset you want
         # determines if we do paging or just pull
         # the whole thing at once
         try:
-            row_count = self.socrata_client.get(self.dataset_name, query=query)[0].get("COUNT")
+            counts = self.fetch_page(self.socrata_client, query, stage='count')[0][0]
+            row_count = counts.get("COUNT")
+            if counts.get("key_count") is not None:
+                key_count = int(counts["key_count"])
         except Exception:
             self.logger.exception("Could not pull dataset (%s) count with socrata client %s" \
-                % (self.dataset_name, self.topic_info["source_url"]), **LOGGING)
+                % (self.dataset_name, self.topic_info["source_url"]))
 
         self.implog_row_values['total_row_count'] = row_count
 
@@ -192,140 +429,743 @@ class GatherAndStore():
                 % (self.dataset_name, row_count))
 
         # start building the basic query
-        base_query = "select *"
+        filter_soql = None
         if not self.initialize_data:
-            base_query = base_query + '\n' + self.topic_info['filter_soql'] % filter_column_value
+            filter_soql = self.topic_info['filter_soql'] % filter_column_value
+
+        if self.stage:
+            # pages go to segment files instead of the targets, see load_staged
+            self.stager = SegmentWriter(self.staging_dir, self.import_topic, {'dataset_name': self.dataset_name,\
+                'initialize': self.initialize_data, 'filter_value': filter_column_value, 'paging': self.paging,\
+                'paging_key': self.paging_key, 'total_row_count': int(row_count), 'key_count': key_count},\
+                self.staging_segment_bytes)
+            self.log_msg("Staging the pull in %s." % self.stager.directory)
 
         # Do we have to page results?
         # OR is our row count small enough to pull in a single call?
-        if int(row_count) > self.pull_row_limit:
-            self.log_msg("Paging results in chunks of %s rows." % self.pull_row_limit)
-
-            base_query = base_query + '\n' + 'limit %s' % self.pull_row_limit
+        # A resumed import keeps paging where it stopped.
+        if int(row_count) > self.pull_row_limit or checkpoint:
+            self.log_msg("Paging results in chunks of %s rows ordered by %s (%s paging)." \
+                % (self.pull_row_limit if self.page_sizer.fixed() else "%s-%s" % (self.page_size_min,\
+                self.page_size_max), self.paging_key, self.paging))
 
             # log the beginning of the import batch
-            self.implog_row_values['comments'] = "STARTING import from %s to %s.%s ..." \
-                % (self.dataset_name, self.target_conn['db'], self.target_table)
+            self.implog_row_values['comments'] = "%s import from %s to %s ..." \
+                % ("RESUMING" if checkpoint else "STARTING", self.dataset_name, self.target_names())
             self.write_import_log()
 
-            offset = 0
-            query = base_query
+            start_offset, start_key = 0, None
+            if checkpoint:
+                start_offset, start_key = checkpoint['row_offset'], checkpoint['page_key']
+            elif not self.stage:
+                for writer in self.writers:
+                    writer.checkpoint.start(self.initialize_data, filter_column_value, self.paging, int(row_count))
+
+            if self.paging == 'keyset':
+                pages = self.key_pages(filter_soql, after_key=start_key, offset=start_offset)
+                if self.fetch_concurrency > 1:
+                    # each page needs the last key of the one before,
+                    # so fetch a single page stream ahead of the writer
+                    pages = read_ahead(pages, self.fetch_queue_depth)
+            else:
+                pages = self.offset_pages(filter_soql, int(row_count), start_offset=start_offset)
+
+            for offset, page_key, licenses, page_stats in pages:
+                # queue the rows in the page, each target checkpoints once it wrote them
+                self.write_rows(licenses, offset=offset, page_key=page_key, page_stats=page_stats,\
+                    checkpoint=True)
+                # release the page before the next one is fetched
+                licenses = None
+
+            self.finish_writes()
+            if not self.stage:
+                if self.initialize_data:
+                    self.finish_initialize(int(row_count), key_count)
+                for writer in self.writers:
+                    writer.checkpoint.finish()
+        else:
+            # no need to page, just bring over what's returned
+            self.log_msg("Pull all rows without paging. RowCount: %s " % row_count)
 
-            while offset < int(row_count):
-                licenses = self.socrata_client.get(self.dataset_name, query=query)
-                for row in licenses:
-                    self.source_curs.append(row.copy())
+            base_query = "select %s" % ', '.join(self.projection)
+            if filter_soql:
+                base_query = base_query + '\n' + filter_soql
 
-                row_cnt_in_cursor = len(self.source_curs)
+            # write the rows as they were returned
+            licenses, page_stats = self.fetch_page(self.socrata_client, base_query)
+            self.write_rows(licenses, page_stats=page_stats)
+            licenses = None
+            self.finish_writes()
+            if self.initialize_data and not self.stage:
+                self.finish_initialize(int(row_count), key_count)
 
-                # write the rows in the list
-                self.write_rows(offset=offset)
+        self.log_msg("Peak RSS for this pull: %s KB" \
+            % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
 
-                offset = offset + row_cnt_in_cursor
-                query = base_query + '\n' + 'offset %s' % offset
-        else:
-            # no need to page, just bring over what's returned
-            self.log_msg("Pull all rows without paging. RowCount: %s " % row_count)
+        if self.stager:
+            self.stager.finish()
+            self.stager.remove_older(self.staging_keep)
+            self.implog_row_values['comments'] = "SUCCESS!! STAGED %s rows from %s in %s ..." \
+                % (row_count, self.dataset_name, self.stager.directory)
+            self.write_import_log(self.metrics.run_values())
+            return
 
-            licenses = self.socrata_client.get(self.dataset_name, query=base_query)
-            for row in licenses:
-                self.source_curs.append(row.copy())
+        # log the end of the import batch with the totals of the run
+        self.implog_row_values['comments'] = "SUCCESS!! COMPLETED import from %s to %s ..." \
+            % (self.dataset_name, self.target_names())
+        self.write_import_log(self.metrics.run_values())
 
-            # write the rows in the list
-            self.write_rows()
 
-        # log the beginning of the import batch
-        self.implog_row_values['comments'] = "SUCCESS!! COMPLETED import from %s to %s.%s ..." \
-            % (self.dataset_name, self.target_conn['db'], self.target_table)
+    def load_staged(self):
+        """
+        Load a snapshot of the topic staged with --stage into the targets, page by
+        page as it was pulled, truncating first if the pull was an --initialize.
+        A snapshot still being staged is loaded as its pages are committed.
+        """
+        directory = self.staged_snapshot
+        if directory == 'latest':
+            directory = latest_snapshot(self.staging_dir, self.import_topic)
+            if not directory:
+                raise ValueError("no staged snapshot of %s in %s" % (self.import_topic, self.staging_dir))
+        reader = SegmentReader(directory)
+        if reader.manifest['topic'] != self.import_topic:
+            raise ValueError("snapshot %s was staged for topic %s" % (directory, reader.manifest['topic']))
+
+        self.implog_row_values['total_row_count'] = reader.manifest['total_row_count']
+        self.log_msg("Loading %s rows of %s staged in %s." % (reader.manifest['total_row_count'],\
+            self.dataset_name, directory))
+        if reader.manifest['initialize']:
+            self.start_initialize()
+
+        self.implog_row_values['comments'] = "STARTING load of %s staged in %s to %s ..." \
+            % (self.dataset_name, directory, self.target_names())
         self.write_import_log()
 
+        for offset, page_key, licenses, page_stats in reader.pages(self.metrics):
+            self.write_rows(licenses, offset=offset, page_key=page_key, page_stats=page_stats)
+            licenses = None
+        self.finish_writes()
+        if reader.manifest['initialize']:
+            self.finish_initialize(reader.manifest['total_row_count'], reader.manifest.get('key_count'))
 
+        self.implog_row_values['comments'] = "SUCCESS!! COMPLETED load of %s staged in %s to %s ..." \
+            % (self.dataset_name, directory, self.target_names())
+        self.write_import_log(self.metrics.run_values())
 
-    def write_rows(self, offset=0):
+
+    def file_pull(self):
         """
-        Write the rows to target from list self.source_curs and clear the list
-        @Param offset - used to inform logging message about location in cursor
+        Load the topic's source_path, a local CSV or NDJSON export, into the targets.
+        The file is memory-mapped and split into spans at record boundaries, the
+        spans parsed on a pool of file_processes processes and written in file
+        order, a chunk per span. With --initialize the targets are emptied (or
+        swapped) first, otherwise the rows are upserted.
         """
-        self.log_msg("Sending %s rows to target." % len(self.source_curs))
-        for row in self.source_curs:
-            self.write_row(row)
+        # source_csv overrides the CSV dialect, ex. {'separator': '\t'}
+        source = FileSource(self.topic_info['source_path'], self.topic_info.get('source_format'),\
+            self.file_span_bytes, **self.topic_info.get('source_csv', {}))
+        spans = source.spans()
+        # checks the column mapping against the CSV header before any process starts
+        tasks = [source.parse_args(span, self.column_mapping) for span in spans]
+        self.log_msg("Loading %s (%s, %s bytes) in %s chunks on %s processes."\
+            % (source.path, source.format, source.size, len(spans), self.file_processes))
+        if self.initialize_data:
+            self.log_msg("We are initializing the data which means we will be loading EVERYTHING!")
+            self.start_initialize()
 
-        self.log_msg("Successfully wrote %s rows to target." % len(self.source_curs))
-        self.implog_row_values['chunk_row_count'] = len(self.source_curs)
+        self.implog_row_values['comments'] = "STARTING load of %s to %s ..." % (source.path, self.target_names())
+        self.write_import_log()
 
-        if self.source_curs:
-            comments = "Chunk import (offset=%s): %s rows for %s." % (offset,\
-               len(self.source_curs), self.dataset_name)
+        def parse(task):
+            start = time.time()
+            rows = self.file_pool.apply(parse_span, task)
+            # the parse is booked as decode, the file read is part of it
+            return rows, self.metrics.page_stats(0.0, time.time() - start, task[2] - task[1])
 
-            self.implog_row_values['comments'] = comments
-            self.write_import_log()
+        row_count = 0
+        # at most two spans per process wait for the writer
+        for licenses, page_stats in PagePrefetcher(parse, tasks, self.file_processes, self.file_processes * 2):
+            self.write_rows(licenses, offset=row_count, page_stats=page_stats)
+            row_count += len(licenses)
+            licenses = None
+        self.finish_writes()
+        if self.initialize_data:
+            self.finish_initialize(row_count)
 
-        self.source_curs = []
+        self.implog_row_values['total_row_count'] = row_count
+        self.implog_row_values['comments'] = "SUCCESS!! COMPLETED load of %s rows from %s to %s ..." \
+            % (row_count, source.path, self.target_names())
+        self.write_import_log(self.metrics.run_values())
 
 
-    def write_row(self, row):
+    def start_initialize(self, resume=False):
         """
-        Write a single row of data
-            @param row: The row (with key:value) from the source table to be written
+        Prepare the targets for an --initialize: truncate them, or with initialize_mode
+        'swap' have each writer load a staging copy, see TargetWriter.start_swap
+            @param resume - continue an interrupted initialize, keeping what it loaded
+        """
+        for writer in self.writers:
+            if self.initialize_mode == 'swap':
+                writer.start_swap(resume=resume)
+            elif not resume:
+                writer.client.execute("truncate table %s;" % self.target_table)
+                if self.summary:
+                    writer.client.execute("truncate table %s;" % self.summary.table)
+
+
+    def finish_initialize(self, row_count, key_count=None):
         """
-        key_list, value_list = [], []
-        for key, value in row.iteritems():
-            key_list.append(str(key))
-            if value is None:
-                # how to deal with NULL dates?
-                if key in self.target_date_columns:
-                    value = '"00-00-00 00:00:00"' ## Stupid NULL NONE EMPTY ... Thing
+        With initialize_mode 'swap', check every staging copy holds the rows
+        the source counted, then build its indexes and swap it in
+            @param row_count - rows the source counted for the initialize
+            @param key_count - distinct upsert_key values the source counted, None if not counted
+        """
+        if self.initialize_mode != 'swap':
+            return
+        for writer in self.writers:
+            writer.check_swap(row_count, key_count)
+        for writer in self.writers:
+            writer.swap_in()
+
+
+    def resume_checkpoint(self):
+        """
+        Load the unfinished checkpoints of the topic's targets. Targets that
+        finished the interrupted import are left out of this run, the others
+        skip the chunks they already wrote.
+            @return the checkpoint to resume the pull from (the target furthest behind), or None
+        """
+        checkpoints = [(writer, writer.checkpoint.load()) for writer in self.writers]
+        checkpoints = [(writer, checkpoint) for writer, checkpoint in checkpoints if checkpoint]
+        if not checkpoints:
+            self.log_msg("No unfinished import of %s to resume, starting a new one."\
+                % self.import_topic)
+            return None
+
+        for writer in [writer for writer in self.writers if writer not in dict(checkpoints)]:
+            self.log_msg("%s finished the interrupted import, leaving it out." % writer.label)
+            writer.finish()
+            writer.close()
+            self.writers.remove(writer)
+
+        for writer, checkpoint in checkpoints:
+            if checkpoint['paging'] != self.paging:
+                raise ValueError("cannot resume a %s paged import with %s paging"\
+                    % (checkpoint['paging'], self.paging))
+            if (checkpoint['initialize'], checkpoint['filter_value']) !=\
+                    (checkpoints[0][1]['initialize'], checkpoints[0][1]['filter_value']):
+                raise ValueError("the unfinished imports of %s into %s and %s pulled different rows"\
+                    % (self.import_topic, checkpoints[0][0].label, writer.label))
+            writer.resume_offset = checkpoint['row_offset']
+
+        checkpoint = min([checkpoint for _, checkpoint in checkpoints], key=lambda c: c['row_offset'])
+        self.log_msg("Resuming the %s import started %s, after %s rows (%s=%s)."\
+            % (checkpoint['paging'], "with --initialize" if checkpoint['initialize']\
+            else "after %s" % checkpoint['filter_value'], checkpoint['row_offset'],\
+            self.paging_key, checkpoint['page_key']))
+        return checkpoint
+
+
+    def fetch_page(self, client, query, stage=None, page_size=None):
+        """
+        Run a SoQL query against the topic's dataset, or read its response from
+        the page cache. The request (up to the last byte of the response) and
+        the JSON decode are timed separately.
+            @param client - SocrataClient, retries throttled and failed requests
+            @param query - SoQL query
+            @param stage - metrics stage to book the whole request to, ex. count
+            @param page_size - row limit of the query, for pages chosen by the page sizer
+            @return (rows, page stats for write_rows)
+        """
+        start = time.time()
+        body = None
+        cached = False
+        if self.page_cache:
+            body = self.page_cache.get(self.dataset_name, self.dataset_version, query)
+            cached = body is not None
+            if body is None and self.replay:
+                raise CacheMiss("a page of %s is not cached, run without --replay:\n%s"\
+                    % (self.dataset_name, query))
+        if body is None:
+            body = client.get("/resource/%s.json" % self.dataset_name, params={'$query': query})
+            if self.page_cache:
+                self.page_cache.put(self.dataset_name, self.dataset_version, query, body)
+        fetched = time.time()
+        rows = json.loads(body)
+        if page_size and not cached:
+            # cached pages say nothing about the source's latency
+            self.page_sizer.observe(page_size, rows, fetched - start)
+        return rows, self.metrics.page_stats(fetched - start, time.time() - fetched,\
+            len(body), stage=stage, page_size=page_size)
+
+
+
+    def reconcile(self):
+        """
+        Compare the row count and the min/max of the reconcile columns of every
+        month of partition_column between source and each target, re-pull the
+        months that differ and replace them in each target in a single transaction,
+        streaming their pages into it. A month that differs in several targets is
+        pulled for each of them. The cost follows the amount of changed data, not
+        the dataset size, and only a page of it is held in memory.
+        """
+        if not self.partition_column:
+            raise ValueError("topic %s has no partition_column to reconcile by" % self.import_topic)
+
+        source, source_rows = self.source_partitions()
+        target_months = []
+        for writer in self.writers:
+            target = self.target_partitions(writer)
+            months = sorted([month for month in set(source) | set(target) if source.get(month) != target.get(month)])
+            self.log_msg("Reconciling %s into %s: %s source and %s target months, %s differ."\
+                % (self.dataset_name, writer.label, len(source), len(target), len(months)))
+            target_months.append((writer, target, months))
+
+        pull_months = sorted(set([month for _, _, months in target_months for month in months]))
+        self.implog_row_values['total_row_count'] = sum([source_rows[month] for month in pull_months\
+            if month in source_rows])
+        if pull_months:
+            self.implog_row_values['comments'] = "STARTING reconcile of %s months from %s to %s ..." \
+                % (len(pull_months), self.dataset_name, self.target_names())
+            self.write_import_log()
+
+            # each target replaces its months in one transaction, the rows are
+            # streamed into it a page at a time instead of held in memory
+            self.metrics.start_chunk()
+            replaced = []
+            row_count = 0
+            for writer, target, months in target_months:
+                if not months:
+                    continue
+                written = {}
+                queries = [self.month_replacer(writer, months, source_rows, written)]
+                if self.summary:
+                    # recount the years of the replaced months, or all of them when
+                    # the summary counts by another date than the partitions
+                    years = None
+                    if self.summary.date_column == self.partition_column:
+                        years = sorted(set([int(month[:4]) for month in months]))
+                    queries.extend(self.summary.refresh_queries(writer.client, writer.codec.table, years))
+                writer.client.transaction(queries)
+                for month in months:
+                    replaced.append((writer, month, written[month], target.get(month, (0,))[0]))
+                row_count += sum(written.values())
+            chunk_metrics = self.metrics.end_chunk(row_count)
+
+            for writer, month, month_rows, target_rows in replaced:
+                self.implog_row_values['chunk_row_count'] = month_rows
+                self.implog_row_values['comments'] = "Reconciled %s=%s: replaced %s target rows with %s source rows."\
+                    % (self.partition_column, month, target_rows, month_rows)
+                self.implog_writer.write(writer.import_log_record(self.implog_row_values))
+            self.implog_row_values['chunk_row_count'] = row_count
+            self.implog_row_values['comments'] = "Replaced %s months, %s rows for %s." \
+                % (len(pull_months), row_count, self.dataset_name)
+            self.write_import_log(chunk_metrics)
+
+        self.implog_row_values['comments'] = "SUCCESS!! COMPLETED reconcile from %s to %s ..." \
+            % (self.dataset_name, self.target_names())
+        self.write_import_log(self.metrics.run_values())
+
+
+    def month_replacer(self, writer, months, source_rows, written):
+        """
+        Returns a function for TargetClient.transaction that deletes each month
+        from the target and inserts the month's source rows page by page. A
+        retried transaction pulls the months again. The insert stage of the
+        transaction includes the time spent waiting for the pages.
+            @param writer - TargetWriter of the target
+            @param months - 'YYYY-MM' months to replace
+            @param source_rows - {'YYYY-MM': row count} of the source, see source_partitions
+            @param written - dict filled with {'YYYY-MM': rows inserted}
+        """
+        partition_field = self.source_field(self.partition_column)
+
+        def replace(cursor):
+            written.clear()
+            for month in months:
+                start = datetime.date(int(month[:4]), int(month[5:7]), 1)
+                end = (start + datetime.timedelta(days=32)).replace(day=1)
+                cursor.execute("DELETE FROM %s WHERE %s >= %%s AND %s < %%s" % (writer.codec.table,\
+                    self.partition_column, self.partition_column), (str(start), str(end)))
+                written[month] = 0
+                if month not in source_rows:
+                    continue
+                filter_soql = "where %s >= '%s' and %s < '%s'" % (partition_field, start, partition_field, end)
+                if self.paging == 'keyset':
+                    pages = self.key_pages(filter_soql)
                 else:
-                    value = "DEFAULT"
+                    pages = self.offset_pages(filter_soql, source_rows[month])
+                for _, _, licenses, page_stats in pages:
+                    self.metrics.add_chunk_page(page_stats)
+                    rows = list(self.metrics.timed_iter('encode', self.codec.encode_rows(licenses)))
+                    licenses = None
+                    for query in writer.client.insert_statements(writer.codec.table, writer.codec.columns,\
+                            rows, on_duplicate=writer.codec.on_duplicate):
+                        cursor.execute(*query)
+                    written[month] += len(rows)
+        return replace
+
+
+    def source_partitions(self):
+        """
+        Returns {'YYYY-MM': (row count, min and max of each reconcile column)}
+        for the source, with the values encoded like the target stores them,
+        and {'YYYY-MM': row count} of the rows to pull. The target keeps a row
+        per upsert_key, so with a single-column upsert_key the first count is
+        of the distinct keys of the month.
+        """
+        converters = dict(self.codec.fields)
+        select = ["date_trunc_ym(%s) as partition_month" % self.source_field(self.partition_column),\
+            "count(*) as row_count"]
+        if len(self.upsert_key) == 1:
+            select.append("count(distinct %s) as key_count" % self.source_field(self.upsert_key[0]))
+        for column in self.reconcile_columns:
+            field = self.source_field(column)
+            select.extend(["min(%s) as min_%s" % (field, column), "max(%s) as max_%s" % (field, column)])
+        query = "select %s\ngroup by partition_month\norder by partition_month\nlimit 100000" % ', '.join(select)
+
+        partitions, row_counts = {}, {}
+        for row in self.fetch_page(self.socrata_client, query, stage='count')[0]:
+            if not row.get('partition_month'):
+                self.logger.warning("%s source rows have no %s and are not reconciled"\
+                    % (row['row_count'], self.partition_column))
+                continue
+            row_counts[row['partition_month'][:7]] = int(row['row_count'])
+            values = [int(row.get('key_count', row['row_count']))]
+            for column in self.reconcile_columns:
+                convert = converters.get(column, self.codec.to_string)
+                values.extend([convert(row.get('min_' + column)), convert(row.get('max_' + column))])
+            partitions[row['partition_month'][:7]] = tuple(values)
+        return partitions, row_counts
+
+
+    def target_partitions(self, writer):
+        """
+        Returns {'YYYY-MM': (row count, min and max of each reconcile column)}
+        for the target table, comparable with source_partitions
+            @param writer - TargetWriter of the target
+        """
+        select = [writer.client.month_expression(self.partition_column), "COUNT(*)"]
+        for column in self.reconcile_columns:
+            select.extend(["MIN(%s)" % column, "MAX(%s)" % column])
+        rows = writer.client.execute("SELECT %s FROM %s WHERE %s IS NOT NULL GROUP BY 1"\
+            % (', '.join(select), writer.codec.table, self.partition_column), ret=True)
+
+        partitions = {}
+        for row in rows:
+            values = [int(row[1])]
+            for value in row[2:]:
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                elif isinstance(value, datetime.date):
+                    value = value.strftime("%Y-%m-%d %H:%M:%S")
+                values.append(value)
+            partitions[row[0]] = tuple(values)
+        return partitions
+
+
+    def source_field(self, column):
+        """
+        Returns the source field of a target column, the column itself without a column mapping
+        """
+        return self.source_fields.get(column, column)
 
-                value_list.append(str(value))
-            else:
-                # encode special chars for mysql insert
-                if key in self.target_string_columns:
-                    value = self.serializer.sanitize(value)
 
-                value = self.serializer.sanitize(value)
+    def page_query(self, filter_soql, after_key=None, offset=None, limit=None):
+        """
+        Build the SoQL query for a single page, ordered by the paging key
+        so that page boundaries are stable
+            @param filter_soql - the topic's incremental filter or None
+            @param after_key - only return rows with a paging key greater than this
+            @param offset - number of rows to skip
+            @param limit - rows in the page, pull_row_limit by default
+        """
+        conditions = []
+        if filter_soql:
+            conditions.append(re.sub(r'(?i)^\s*where\s+', '', filter_soql))
+        if after_key is not None:
+            conditions.append("%s > '%s'" % (self.paging_key, after_key.replace("'", "''")))
+
+        # system fields like :id are only returned when selected,
+        # and with a column mapping the paging key may not be one of the columns
+        select = self.projection
+        if self.paging_key.startswith(':') or (self.column_mapping and self.paging_key not in self.target_columns):
+            select = [self.paging_key] + select
+        query = "select %s" % ', '.join(select)
+        if conditions:
+            query = query + '\n' + 'where ' + ' and '.join(['(%s)' % c for c in conditions])
+        query = query + '\n' + 'order by %s' % self.paging_key
+        query = query + '\n' + 'limit %s' % (limit or self.pull_row_limit)
+        if offset:
+            query = query + '\n' + 'offset %s' % offset
+        return query
+
+
+    def offset_pages(self, filter_soql, row_count, start_offset=0):
+        """
+        Generate (offset, None, rows, page stats) pages using limit/offset.
+        Page ranges come from the COUNT query, so with fetch_concurrency > 1
+        the pages are fetched on a thread pool ahead of the writer.
+        Each page costs the server O(offset). Page sizes come from the page
+        sizer as the pages are requested.
+            @param filter_soql - the topic's incremental filter or None
+            @param row_count - number of rows reported by the COUNT query
+            @param start_offset - offset of the first page, when resuming
+        """
+        def page_ranges():
+            offset = start_offset
+            while offset < row_count:
+                limit = self.page_sizer.size()
+                yield offset, limit
+                offset += limit
+
+        if self.fetch_concurrency > 1:
+            fetch_local = threading.local()
 
-                # this seeks a single backslash, but because
-                # this is python, we must escape the backslash
-                value = str(value).replace("\\", "\\\\")
-                # escaping a double quote for mysql string encoding
-                value = str(value).replace('"', '\\"')
-                value_list.append('"' + str(value) + '"')
-        key_str = ','.join(key_list)
-        value_str = ','.join(value_list)
+            def fetch(page_range):
+                # every fetch thread gets its own client
+                if not hasattr(fetch_local, 'client'):
+                    fetch_local.client = self.new_socrata_client()
+                offset, limit = page_range
+                return (offset, None) + self.fetch_page(fetch_local.client,\
+                    self.page_query(filter_soql, offset=offset, limit=limit), page_size=limit)
 
-        # write the row to the target table
-        self.target_client.execute("INSERT INTO %s.%s (%s) VALUES (%s)" \
-            % (self.target_conn['db'], self.target_table, key_str, value_str))
+            return PagePrefetcher(fetch, page_ranges(), self.fetch_concurrency, self.fetch_queue_depth)
 
+        return ((offset, None) + self.fetch_page(self.socrata_client,\
+            self.page_query(filter_soql, offset=offset, limit=limit), page_size=limit)\
+            for offset, limit in page_ranges())
 
-    def write_import_log(self):
+
+    def key_pages(self, filter_soql, after_key=None, offset=0):
         """
-        Write a single row to the import log
+        Generate (offset, page_key, rows, page stats) pages with keyset pagination: each page
+        continues with 'where paging_key > last_seen', so deep pages cost the same
+        as the first. The paging key must be unique, :id is by default.
+            @param filter_soql - the topic's incremental filter or None
+            @param after_key - paging key to start after, when resuming
+            @param offset - rows already written, when resuming
         """
-        self.implog_client.execute(self.import_logging_sql % (self.implog_row_values))
+        last_key = after_key
+        while True:
+            limit = self.page_sizer.size()
+            licenses, page_stats = self.fetch_page(self.socrata_client,\
+                self.page_query(filter_soql, after_key=last_key, limit=limit), page_size=limit)
+            if not licenses:
+                return
+
+            yield offset, last_key, licenses, page_stats
+
+            offset = offset + len(licenses)
+            if len(licenses) < limit:
+                return
+            last_key = licenses[-1][self.paging_key]
+
+
+    def write_rows(self, rows, offset=0, page_key=None, page_stats=None, checkpoint=False):
+        """
+        Encode a chunk of rows once and queue it for every target; waits only
+        while a target's queue is full. For bulk loads the rows are serialized
+        to a file under tmp_dir as they are encoded, otherwise to a list of tuples.
+        @Param rows - list of rows (with key:value) as returned by the source
+        @Param offset - used to inform logging message about location in cursor
+        @Param page_key - paging key the chunk started after, for keyset paging
+        @Param page_stats - fetch stats of the page the rows came from, see fetch_page
+        @Param checkpoint - whether targets checkpoint after writing the chunk
+        """
+        row_count = len(rows)
+        if self.stager:
+            self.metrics.start_chunk(page_stats)
+            with self.metrics.stage('encode'):
+                self.stager.append(offset, page_key, rows)
+            self.metrics.end_chunk(row_count)
+            self.log_msg("Staged %s rows." % row_count)
+            return
+
+        self.log_msg("Sending %s rows to %s target(s)." % (row_count, len(self.writers)))
+
+        comments = "Chunk import (offset=%s): %s rows for %s." % (offset,\
+           row_count, self.dataset_name)
+        if page_key is not None:
+            comments = "Chunk import (offset=%s, after %s=%s): %s rows for %s." % (offset,\
+               self.paging_key, page_key, row_count, self.dataset_name)
+        chunk = Chunk(offset, page_key, rows[-1].get(self.paging_key) if rows else None,\
+            row_count, comments, checkpoint=checkpoint)
+
+        self.metrics.start_chunk(page_stats)
+        encoded = self.codec.encode_rows(rows)
+        if self.summary:
+            chunk.summary = SummaryDelta()
+            encoded = self.summary.tally(encoded, chunk.summary)
+        if self.load_mode == 'bulk':
+            chunk_file = tempfile.NamedTemporaryFile(dir=self.tmp_dir,\
+                prefix=self.import_topic + '_', suffix='.csv', delete=False)
+            chunk.path = chunk_file.name
+            with chunk_file, self.metrics.stage('encode'):
+                self.serializer.serialize_rows(encoded, chunk_file)
+        else:
+            chunk.rows = list(self.metrics.timed_iter('encode', encoded))
+        # the writers add their insert and commit times to the fetch and encode times
+        chunk.stats = self.metrics.hand_off_chunk()
+
+        # the chunk is released (and its file removed) once every target wrote it
+        chunk.acquire()
+        try:
+            for writer in self.writers:
+                writer.put(chunk)
+        finally:
+            chunk.release()
+
+        # stop pulling once no target is writing
+        if not [writer for writer in self.writers if not writer.error]:
+            self.finish_writes()
+
+
+    def finish_writes(self):
+        """
+        Wait for every target to write its queued chunks
+            @raise the first error a target stopped writing with
+        """
+        errors = [(writer, writer.finish()) for writer in self.writers]
+        errors = [(writer, error) for writer, error in errors if error]
+        for writer, error in errors:
+            self.logger.error("Writes to %s failed: %s" % (writer.label, error))
+        if errors:
+            raise errors[0][1]
+
+
+    def write_import_log(self, metric_values=None):
+        """
+        Queue a row per target for the import log, written in the background
+            @param metric_values - stage timing columns for the row, see PipelineMetrics.log_values
+        """
+        record = self.implog_row_values
+        if metric_values:
+            record = dict(record, **metric_values)
+        for writer in self.writers:
+            self.implog_writer.write(writer.import_log_record(record))
+
+
+    def write_metrics_summary(self, succeeded):
+        """
+        Log the slowest stage of the run and write the stage timings
+        to MISC['metrics_dir'] as a Prometheus textfile and JSON
+            @param succeeded - whether the run completed
+        """
+        stage, share = self.metrics.bottleneck()
+        self.log_msg("Stage seconds: %s. Slowest stage: %s (%.0f%%)." % (', '.join(['%s=%.2f'\
+            % (name, self.metrics.totals[name]) for name in self.metrics.STAGES]), stage, share * 100))
+        if self.page_cache:
+            self.log_msg("%s." % self.page_cache.summary())
+        if not self.metrics_dir:
+            return
+        try:
+            self.metrics.write_summary(self.metrics_dir, self.import_topic, succeeded)
+        except Exception:
+            self.logger.exception("Could not write the metrics summary to %s" % self.metrics_dir)
 
 
     def run(self):
         """
         Runs the methods in the class in the following order:
-            socrata_pull -> write_rows (wrapper loop) -> write_row
+            socrata_pull -> write_rows (encode once) -> TargetWriter per target -> write_row / bulk_load / batch_insert
+        or with --reconcile:
+            reconcile -> source_partitions / target_partitions -> key_pages / offset_pages
+        or for a topic with source_type 'file':
+            file_pull -> FileSource.spans -> parse_span on a process pool -> write_rows
         """
         self.log_msg("Starting module GatherAndStore... ")
-        self.socrata_pull()
+        succeeded = False
+        try:
+            if self.reconcile_data:
+                self.reconcile()
+            elif self.staged_snapshot:
+                self.load_staged()
+            elif self.source_type == 'file':
+                self.file_pull()
+            else:
+                self.socrata_pull()
+            succeeded = True
+        except SystemExit:
+            # nothing to pull
+            succeeded = True
+            raise
+        except Exception, e:
+            self.implog_row_values['comments'] = ("FAILED import from %s to %s: %s" \
+                % (self.dataset_name, self.target_names(), e))[:500]
+            self.write_import_log(self.metrics.run_values())
+            if self.stager:
+                self.stager.finish('failed')
+            raise
+        finally:
+            self.write_metrics_summary(succeeded)
+            if self.page_cache and self.page_sizer.chosen and not self.replay:
+                # a replay requests the cached pages with the same sizes
+                self.page_cache.save_page_sizes(self.dataset_name, self.dataset_version, self.page_sizer.chosen)
+            # stop the writers, flush the import log and hand the connections back to the pool
+            for writer in self.writers:
+                writer.finish()
+                writer.close()
+            self.implog_writer.close()
+            if self.socrata_client:
+                self.socrata_client.close()
+            if self.file_pool:
+                self.file_pool.terminate()
+                self.file_pool.join()
         self.log_msg("Module GatherAndStore successfully completed!")
 
 
+def init_logging(log_file):
+    """
+    Send the log records of this process to log_file, formatted as in settings.LOGGING
+    """
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(logging.Formatter(LOGGING['format']))
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOGGING['level'])
+
+
 ## Entry point
 if __name__ == '__main__':
     # check command line
     PARSER = argparse.ArgumentParser(description='import data from SOURCE and write to TARGET')
-    PARSER.add_argument("-t", "--import_topic", required=True,\
-        help="Specify data import topic, ex. pet_license")
-    PARSER.add_argument("--initialize", default=False, action='store_true', required=False,\
+    TOPICS = PARSER.add_mutually_exclusive_group(required=True)
+    TOPICS.add_argument("-t", "--import_topic",\
+        help="Specify data import topic, ex. pet_license, or a comma separated list of topics to run concurrently")
+    TOPICS.add_argument("--all", default=False, action='store_true',\
+        help="Run every enabled import topic concurrently")
+    MODES = PARSER.add_mutually_exclusive_group()
+    MODES.add_argument("--initialize", default=False, action='store_true', required=False,\
         help="To import ALL data from scratch or truncate target and start over, add --initialize")
+    MODES.add_argument("--resume", default=False, action='store_true', required=False,\
+        help="Continue the topic's unfinished paged import after its last committed chunk, add --resume")
+    MODES.add_argument("--reconcile", default=False, action='store_true', required=False,\
+        help="To compare the source and target month by month and replace the months that differ, add --reconcile")
+    PARSER.add_argument("--replay", default=False, action='store_true', required=False,\
+        help="Reload the target from the page cache only, without contacting the source. Every page of"\
+        " the run must be cached by an earlier run with the same queries, ex. an --initialize that failed")
+    STAGING = PARSER.add_mutually_exclusive_group()
+    STAGING.add_argument("--stage", default=False, action='store_true', required=False,\
+        help="Fetch the pages into a snapshot in MISC['staging_dir'] instead of writing the targets,"\
+        " for --load_staged to load. Combines with --initialize")
+    STAGING.add_argument("--load_staged", nargs='?', const='latest', default=None, required=False,\
+        metavar='SNAPSHOT', help="Load the topic's latest staged snapshot, or the SNAPSHOT directory,"\
+        " into the targets. A snapshot still being staged is loaded as its pages arrive")
+    PARSER.add_argument("--log_file", required=False,\
+        help="Log to this file instead of the console. Concurrent topics always log to"\
+        " gather_and_store_<topic>.log in LOGGING['directory']")
     OPTIONS = PARSER.parse_args()
 
+    if OPTIONS.all or ',' in OPTIONS.import_topic:
+        # run the topics in a process each and exit with their aggregated status
+        from topic_runner import TopicRunner
+        # topics with 'enabled': False only run when named, ex. placeholders
+        exit(TopicRunner(settings, OPTIONS, sorted([topic for topic, info in settings.IMPORT_TOPICS.items()\
+            if info.get('enabled', True)]) if OPTIONS.all else split_columns(OPTIONS.import_topic)).run())
+
+    if OPTIONS.log_file:
+        init_logging(OPTIONS.log_file)
+
     # call run()
     GatherAndStore(settings, OPTIONS).run()
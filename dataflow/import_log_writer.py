@@ -0,0 +1,124 @@
+"""
+Utilities to write the import log off the hot path
+"""
+import threading
+import time
+
+from mysql_wrapper import MySQLWrapper
+
+class ImportLogWriter(threading.Thread):
+    """
+    Buffers import_log records and writes them from a background thread
+    as parameterized multi-row inserts, every flush_interval seconds or
+    as soon as flush_size records are waiting. close() stops the thread
+    and writes what is left.
+
+    The connection is retried with the backoff of the target clients, and
+    a batch whose insert failed is kept for the next flush. Records that
+    could not be written by close() are logged as an error.
+    """
+    def __init__(self, logger, conn, table, columns, flush_interval=5, flush_size=100):
+        """
+            @param logger - logger for failed flushes
+            @param conn - connection settings (host, port, user, password, db)
+            @param table - import log table
+            @param columns - import log columns, records are dicts with these keys
+            @param flush_interval - seconds between flushes
+            @param flush_size - number of waiting records that triggers a flush
+        """
+        threading.Thread.__init__(self, name='import_log_writer')
+        self.daemon = True
+        self.logger = logger
+        self.conn = conn
+        self.table = table
+        self.columns = columns
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+
+        self.client = None
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = False
+        # once the connection is given up records are only counted
+        self.given_up = False
+        self.lost = 0
+
+    def write(self, record):
+        """
+        Queue a record; the values are copied so the caller may reuse the dict
+            @param record - dict of column values, missing columns are written as NULL
+        """
+        with self.lock:
+            if self.given_up:
+                self.lost += 1
+                return
+            self.buffer.append(tuple([record.get(column) for column in self.columns]))
+            if len(self.buffer) >= self.flush_size:
+                self.wakeup.set()
+
+    def run(self):
+        # the connection is only ever used from this thread
+        self.client = self.connect()
+        if not self.client:
+            with self.lock:
+                self.given_up = True
+                self.lost, self.buffer = len(self.buffer), []
+            return
+        try:
+            while not self.stopping:
+                self.wakeup.wait(self.flush_interval)
+                self.wakeup.clear()
+                self.flush()
+            self.flush()
+        finally:
+            self.client.close()
+
+    def connect(self):
+        """
+        Returns a connection to the import log db, or None once
+        MySQLWrapper.MAX_RETRY_ATTEMPTS retries failed
+        """
+        failure = 0
+        while True:
+            try:
+                return MySQLWrapper(self.logger, silent_mode=True, **self.conn)
+            except Exception, e:
+                failure += 1
+                if failure > MySQLWrapper.MAX_RETRY_ATTEMPTS:
+                    self.logger.exception("Could not initialize connection for the"\
+                        " import logging db connection.")
+                    return None
+                wait = min(MySQLWrapper.BACKOFF_BASE * 2 ** (failure - 1), MySQLWrapper.BACKOFF_MAX)
+                self.logger.warning("Could not connect to the import logging db (attempt %s),"\
+                    " retrying in %.1fs: %s" % (failure, wait, e))
+                time.sleep(wait)
+
+    def flush(self):
+        """
+        Write every waiting record with one multi-row insert
+        """
+        with self.lock:
+            records, self.buffer = self.buffer, []
+        if not records:
+            return
+        try:
+            self.client.insert_many(self.table, self.columns, records)
+        except Exception:
+            self.logger.exception("Could not write %s import log records to %s, keeping them for the next flush"\
+                % (len(records), self.table))
+            with self.lock:
+                self.buffer[:0] = records
+
+    def close(self):
+        """
+        Stop the thread after a final flush of the waiting records
+        """
+        self.stopping = True
+        self.wakeup.set()
+        if self.is_alive():
+            self.join()
+        with self.lock:
+            unwritten = self.lost + len(self.buffer)
+        if unwritten:
+            self.logger.error("%s import log records were not written to %s" % (unwritten, self.table))
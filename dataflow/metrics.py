@@ -0,0 +1,205 @@
+"""
+Utilities to time the pipeline stages and report them
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+class PipelineMetrics:
+    """
+    Seconds per stage and byte/row counters, both per chunk and for the run.
+
+    Stages:
+        count - the COUNT query
+        fetch - page HTTP requests, up to the last byte of the body
+        decode - JSON decoding of the pages
+        encode - row codec, sanitizing and serializing
+        insert - statements executed on the target
+        commit - commits on the target
+
+    Pages can be fetched on other threads, so fetch and decode are measured
+    per page (see page_stats) and added to the chunk that writes the page.
+    Every thread can time one chunk at a time (ex. a writer thread per
+    target); the other stages are added to the chunk of the thread timing them.
+    A chunk also reports the row limit its page was requested with, as page_size.
+    """
+    STAGES = ['count', 'fetch', 'decode', 'encode', 'insert', 'commit']
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.totals = dict([(stage, 0.0) for stage in self.STAGES])
+        self.rows = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.local = threading.local()
+
+    def add(self, stage, seconds):
+        """
+        Add time to a stage, for the run and for the current chunk
+        """
+        with self.lock:
+            self.totals[stage] += seconds
+        chunk = getattr(self.local, 'chunk', None)
+        if chunk is not None:
+            chunk[stage] += seconds
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Time a block of code as a stage
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.time() - start)
+
+    def timed_iter(self, stage, iterable):
+        """
+        Generate the items of iterable, timing the work done to produce each one as stage
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.time() - start)
+                return
+            self.add(stage, time.time() - start)
+            yield item
+
+    def page_stats(self, fetch_seconds, decode_seconds, byte_count, stage=None, page_size=None):
+        """
+        Add a fetched page to the run totals and return its stats for start_chunk
+            @param stage - stage to book the whole request to instead of fetch and decode, ex. count
+            @param page_size - row limit the page was requested with, if any
+        """
+        with self.lock:
+            if stage:
+                self.totals[stage] += fetch_seconds + decode_seconds
+            else:
+                self.totals['fetch'] += fetch_seconds
+                self.totals['decode'] += decode_seconds
+                self.bytes += byte_count
+        stats = {'fetch': fetch_seconds, 'decode': decode_seconds, 'bytes': byte_count}
+        if page_size:
+            stats['page_size'] = page_size
+        return stats
+
+    def start_chunk(self, page_stats=None):
+        """
+        Start timing a chunk; stages timed on this thread are added to it until end_chunk
+            @param page_stats - stats of the page the chunk was fetched as (see page_stats)
+                or of the work already done on the chunk (see hand_off_chunk), if any
+        """
+        chunk = dict([(stage, 0.0) for stage in self.STAGES])
+        chunk['bytes'] = 0
+        chunk['page_size'] = None
+        self.local.chunk = chunk
+        if page_stats:
+            self.add_chunk_page(page_stats)
+
+    def add_chunk_page(self, page_stats):
+        """
+        Add the stage times and bytes of a page to this thread's chunk
+        """
+        chunk = self.local.chunk
+        for name, value in page_stats.iteritems():
+            if name == 'page_size':
+                # the largest page the chunk was fetched with
+                chunk[name] = max(chunk[name], value)
+            else:
+                chunk[name] += value
+
+    def hand_off_chunk(self):
+        """
+        Stop timing this thread's chunk without counting it
+            @return its stage times and bytes so far, for start_chunk on the thread that finishes it
+        """
+        chunk, self.local.chunk = self.local.chunk, None
+        return dict([(name, value) for name, value in chunk.iteritems() if value])
+
+    def end_chunk(self, row_count):
+        """
+        Stop timing this thread's chunk
+            @return dict of the import_log metric columns for the chunk
+        """
+        chunk, self.local.chunk = self.local.chunk, None
+        with self.lock:
+            self.rows += row_count
+            self.chunks += 1
+        # pages are fetched ahead on other threads, so a chunk's rate is
+        # measured over the time spent on its own stages
+        values = self.log_values(chunk, row_count, chunk['bytes'],\
+            sum([chunk[stage] for stage in self.STAGES]))
+        values['page_size'] = chunk['page_size']
+        return values
+
+    def run_values(self):
+        """
+        Returns the import_log metric columns for the whole run
+        """
+        return self.log_values(self.totals, self.rows, self.bytes, time.time() - self.started)
+
+    def log_values(self, stage_seconds, row_count, byte_count, seconds):
+        values = dict([('%s_ms' % stage, int(stage_seconds[stage] * 1000)) for stage in self.STAGES])
+        values['rows_per_sec'] = int(row_count / seconds) if seconds > 0 else None
+        values['bytes'] = byte_count
+        return values
+
+    def bottleneck(self):
+        """
+        Returns (stage, share of the staged time) of the slowest stage
+        """
+        staged = sum(self.totals.values())
+        stage = max(self.STAGES, key=lambda name: self.totals[name])
+        return stage, (self.totals[stage] / staged if staged else 0.0)
+
+    def summary(self, topic, succeeded):
+        return {
+            'topic': topic,
+            'succeeded': succeeded,
+            'run_seconds': time.time() - self.started,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'chunks': self.chunks,
+            'stage_seconds': dict(self.totals)
+        }
+
+    def write_summary(self, directory, topic, succeeded):
+        """
+        Write the run summary as a Prometheus textfile (for the node exporter
+        textfile collector) and as JSON, replacing the files of the last run
+            @return paths of the files written
+        """
+        summary = self.summary(topic, succeeded)
+        labels = 'topic="%s"' % topic
+        lines = [
+            '# HELP gather_and_store_stage_seconds Time spent in each pipeline stage during the last run.',
+            '# TYPE gather_and_store_stage_seconds gauge']
+        for stage in self.STAGES:
+            lines.append('gather_and_store_stage_seconds{%s,stage="%s"} %f' % (labels, stage, self.totals[stage]))
+        for name, value, description in [
+                ('run_seconds', summary['run_seconds'], 'Wall time of the last run.'),
+                ('rows', summary['rows'], 'Rows written by the last run.'),
+                ('bytes', summary['bytes'], 'Response bytes fetched by the last run.'),
+                ('chunks', summary['chunks'], 'Chunks written by the last run.'),
+                ('success', int(succeeded), '1 if the last run succeeded.'),
+                ('last_run_timestamp_seconds', time.time(), 'When the last run ended.')]:
+            lines.append('# HELP gather_and_store_%s %s' % (name, description))
+            lines.append('# TYPE gather_and_store_%s gauge' % name)
+            lines.append('gather_and_store_%s{%s} %s' % (name, labels, value))
+
+        paths = []
+        for extension, content in [('prom', '\n'.join(lines) + '\n'), ('json', json.dumps(summary, indent=2))]:
+            path = os.path.join(directory, 'gather_and_store_%s.%s' % (topic, extension))
+            # write then rename so a collector never reads half a file
+            with open(path + '.tmp', 'w') as summary_file:
+                summary_file.write(content)
+            os.rename(path + '.tmp', path)
+            paths.append(path)
+        return paths
@@ -5,65 +5,134 @@ from warnings import filterwarnings
 
 import MySQLdb
 
-class MySQLWrapper:
-
-    MAX_RETRY_ATTEMPTS = 5
-
-    def __init__(self, logger, host, port, user, password, db, autocommit=False, silent_mode=False):
-        self.logger = logger
-        self.host = host
-        self.port = port
-        self.user = user
-        self.password = password
-        self.db = db
-        self.conn = None
-        self.failure = 0
-        self.autocommit = autocommit
-        self.silent_mode = silent_mode
-        self.init()
-
-    def init(self):
-        if self.conn:
-            self.close()
-        self.conn = MySQLdb.connect(host=self.host, db=self.db, user=self.user, port=self.port, passwd=self.password)
-        self.logger.info("conn instance is %s" % str(self.conn))
-        self.conn.autocommit = self.autocommit
-
-    def transaction(self, queries):
-        if self.autocommit:
-            self.logger.error("no transaction with autocommit")
-            return
-        try:
-            cursor = self.conn.cursor()
-            for query in queries:
-                cursor.execute(query)
-        except:
-            self.logger.exception("queries %s failed" % (' '.join(queries)))
-            self.close()
-            self.init()
-
-    def execute(self, query, ret=False):
-        while True:
-            try:
-                cursor = self.conn.cursor()
-                cursor.execute(query)
-                if self.silent_mode != True:
-                    self.logger.info("query:%s" % query)
-                if not self.autocommit:
-                    self.conn.commit()
-                # Reset failure counter as the execution succeeded.
-                self.failure = 0
-
-                if ret:
-                    return cursor.fetchall()
-                else:
-                    return
-            except Exception, e:
-                self.failure += 1
-                self.logger.exception("query %s failed" % (query))
-                if self.failure > self.MAX_RETRY_ATTEMPTS:
-                    raise e
-                self.init()
-
-    def close(self):
-        self.conn.close()
+from target_client import ConnectionPool, POOL, TargetClient
+
+class MySQLWrapper(TargetClient):
+    """
+    MySQL target client, bulk loads with LOAD DATA LOCAL INFILE
+    """
+    # ER_CON_COUNT_ERROR, ER_SERVER_SHUTDOWN, ER_LOCK_WAIT_TIMEOUT, ER_LOCK_DEADLOCK
+    RETRY_ERRORS = frozenset([1040, 1053, 1205, 1213])
+
+    def __init__(self, logger, host, port, user, password, db, autocommit=False, silent_mode=False, local_infile=False):
+        self.packet_limit = None
+        TargetClient.__init__(self, logger, host, port, user, password, db, autocommit=autocommit,\
+            silent_mode=silent_mode, local_infile=local_infile)
+
+    def connect(self):
+        conn = MySQLdb.connect(host=self.host, db=self.db, user=self.user, port=self.port, passwd=self.password,
+                               charset='utf8', local_infile=int(self.local_infile))
+        self.logger.info("conn instance is %s" % str(conn))
+        return conn
+
+    def set_autocommit(self, conn, autocommit):
+        conn.autocommit(autocommit)
+
+    def retryable(self, e):
+        """
+        Lost or refused connections (client errors 2000 and up), too many
+        connections, a server shutting down, lock wait timeouts and deadlocks
+        """
+        if not isinstance(e, MySQLdb.OperationalError):
+            return False
+        code = e.args[0] if e.args and isinstance(e.args[0], int) else 0
+        return code >= 2000 or code in self.RETRY_ERRORS
+
+    def max_allowed_packet(self):
+        """
+        Returns the server max_allowed_packet, looked up once per wrapper
+        """
+        if not self.packet_limit:
+            self.packet_limit = int(self.execute("SELECT @@max_allowed_packet", ret=True)[0][0])
+        return self.packet_limit
+
+    def max_statement_size(self):
+        return self.max_allowed_packet()
+
+    def qualified_table(self, table):
+        return "%s.%s" % (self.db, table)
+
+    def upsert_clause(self, columns, upsert_key):
+        """
+        Returns the ON DUPLICATE KEY UPDATE clause for upsert_key
+        """
+        return "ON DUPLICATE KEY UPDATE " + ','.join(['%s=VALUES(%s)' % (column, column)\
+            for column in columns if column not in upsert_key] or ['%s=%s' % (upsert_key[0], upsert_key[0])])
+
+    def increment_clause(self, table, key, counter):
+        return "ON DUPLICATE KEY UPDATE %s=%s+VALUES(%s)" % (counter, counter, counter)
+
+    def literal(self, value):
+        if value is None:
+            return 'DEFAULT'
+        if isinstance(value, (int, long)):
+            return str(value)
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    def month_expression(self, column):
+        return "DATE_FORMAT(%s, '%%Y-%%m')" % column
+
+    def create_table_like(self, table, template):
+        self.execute("CREATE TABLE IF NOT EXISTS %s LIKE %s" % (table, template))
+
+    def secondary_indexes(self, table):
+        rows = self.execute("SELECT index_name, column_name, sub_part, index_type FROM information_schema.statistics"\
+            " WHERE table_schema = %s AND table_name = %s AND non_unique = 1 ORDER BY index_name, seq_in_index",\
+            ret=True, args=(self.db, table))
+        indexes = []
+        for name, column, sub_part, index_type in rows:
+            if not indexes or indexes[-1][0] != name:
+                indexes.append((name, index_type, []))
+            indexes[-1][2].append('`%s`%s' % (column, '(%s)' % sub_part if sub_part else ''))
+        return [(name, '%sINDEX `%s` (%s)' % (index_type + ' ' if index_type in ('FULLTEXT', 'SPATIAL') else '',\
+            name, ','.join(parts))) for name, index_type, parts in indexes]
+
+    def drop_indexes(self, table, names):
+        if names:
+            self.execute("ALTER TABLE %s %s" % (table, ', '.join(['DROP INDEX `%s`' % name for name in names])))
+
+    def create_indexes(self, table, indexes):
+        """
+        Add the indexes in one ALTER TABLE, so the table is sorted into them once
+        """
+        if indexes:
+            self.execute("ALTER TABLE %s %s" % (table, ', '.join(['ADD ' + definition for _, definition in indexes])))
+
+    def copy_grants(self, source, table):
+        # table privileges are granted by name, the swapped in table gets the old one's
+        pass
+
+    def swap_tables(self, table, staging, retired):
+        self.drop_table(retired)
+        self.execute("RENAME TABLE %s TO %s, %s TO %s" % (table, retired, staging, table))
+        self.drop_table(retired)
+
+    def load_options(self, serializer):
+        return serializer.mysql_load_options()
+
+    def bulk_load(self, path, table, columns, options, upsert_key=None, before=None, after=None):
+        """
+        LOAD DATA the file; with an upsert key, rows already in the target are replaced
+        """
+        self.load_data(path, table, columns, options, replace=bool(upsert_key), before=before, after=after)
+
+    def load_data(self, path, table, columns, options, replace=False, before=None, after=None):
+        """
+        Bulk load a local file with LOAD DATA LOCAL INFILE
+            @param path - file written by CsvSerializer
+            @param table - target table, optionally qualified with the db
+            @param columns - target columns in the order they appear in the file
+            @param options - FIELDS/LINES clause matching the file format
+            @param replace - replace rows with the same unique key instead of keeping the old ones
+            @param before - queries to run in the load's transaction before it, as for transaction
+            @param after - queries to run in the load's transaction after it
+        """
+        if not self.local_infile:
+            raise ValueError("LOAD DATA LOCAL INFILE requires local_infile=True")
+        query = "LOAD DATA LOCAL INFILE '%s' %sINTO TABLE %s %s (%s)"\
+            % (path.replace('\\', '\\\\').replace("'", "\\'"), 'REPLACE ' if replace else '',
+               table, options, ','.join(columns))
+        if before or after:
+            self.transaction(list(before or []) + [query] + list(after or []))
+        else:
+            self.execute(query)
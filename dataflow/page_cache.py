@@ -0,0 +1,210 @@
+"""
+Utilities to keep source pages on local disk
+"""
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+class CacheMiss(Exception):
+    """
+    A page replay needed is not in the cache
+    """
+    pass
+
+
+class PageCache:
+    """
+    Content-addressed cache of source responses under a directory, shared by
+    the topics and fetch threads of a host. An entry is the gzipped response
+    body, named by the sha1 of dataset, dataset version and query text, so a
+    new version of the dataset never reads old pages.
+
+    Entries older than ttl seconds are not read. When the entries take more
+    than max_bytes, the least recently read ones are removed; reading an entry
+    sets its access time, creating it sets its modification time.
+    Writes go through a temporary file and a rename, so readers never see
+    a partial entry.
+    """
+    SUFFIX = '.json.gz'
+
+    def __init__(self, directory, max_bytes, ttl, compress_level=6):
+        """
+            @param directory - cache directory, created if missing
+            @param max_bytes - size of the entries to keep, compressed
+            @param ttl - seconds an entry is valid for
+            @param compress_level - gzip level, 1 (fast) to 9 (small)
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compress_level = compress_level
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by another process meanwhile
+                if not os.path.isdir(directory):
+                    raise
+        self.version_dir = os.path.join(directory, 'versions')
+        if not os.path.isdir(self.version_dir):
+            try:
+                os.makedirs(self.version_dir)
+            except OSError:
+                if not os.path.isdir(self.version_dir):
+                    raise
+        # {path: [access time, modification time, size]} of the entries on disk,
+        # kept up to date by this process; entries other processes remove are skipped
+        self.index = dict([(path, [accessed, modified, size])\
+            for path, accessed, modified, size in self.entries()])
+        self.evict()
+
+    def path(self, dataset, version, query):
+        """
+        Returns the file of an entry
+        """
+        key = hashlib.sha1('\n'.join([dataset, str(version), query.encode('utf-8')\
+            if isinstance(query, unicode) else query])).hexdigest()
+        return os.path.join(self.directory, key[:2], key + self.SUFFIX)
+
+    def get(self, dataset, version, query):
+        """
+        Returns the cached response body, or None
+        """
+        path = self.path(dataset, version, query)
+        try:
+            created = os.stat(path).st_mtime
+            if time.time() - created > self.ttl:
+                self.miss()
+                return None
+            with gzip.open(path, 'rb') as entry:
+                body = entry.read()
+            accessed = time.time()
+            os.utime(path, (accessed, created))
+        except (IOError, OSError):
+            # missing, or removed by another process's eviction
+            self.miss()
+            return None
+        with self.lock:
+            self.hits += 1
+            if path in self.index:
+                self.index[path][0] = accessed
+        return body
+
+    def put(self, dataset, version, query, body):
+        """
+        Store a response body, then evict down to max_bytes
+        """
+        path = self.path(dataset, version, query)
+        entry_dir = os.path.dirname(path)
+        if not os.path.isdir(entry_dir):
+            try:
+                os.makedirs(entry_dir)
+            except OSError:
+                if not os.path.isdir(entry_dir):
+                    raise
+        handle, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.compress_level) as entry:
+                    entry.write(body)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        now = time.time()
+        with self.lock:
+            self.index[path] = [now, now, os.path.getsize(path)]
+        self.evict()
+
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def entries(self):
+        """
+        Generate (path, access time, modification time, size) of the entries on disk
+        """
+        for root, _, files in os.walk(self.directory):
+            if root == self.version_dir:
+                continue
+            for name in files:
+                if not name.endswith(self.SUFFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_atime, stat.st_mtime, stat.st_size
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently read ones until
+        the entries take at most max_bytes
+        """
+        with self.lock:
+            now = time.time()
+            total = sum([size for _, _, size in self.index.values()])
+            if total <= self.max_bytes and not [1 for _, modified, _ in self.index.values()\
+                    if now - modified > self.ttl]:
+                return
+            for accessed, path in sorted([(entry[0], path) for path, entry in self.index.items()]):
+                _, modified, size = self.index[path]
+                if total <= self.max_bytes and now - modified <= self.ttl:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                del self.index[path]
+                total -= size
+
+    def save_version(self, dataset, version):
+        """
+        Record the dataset version pages were last cached for, the one replay reads
+        """
+        handle, tmp_path = tempfile.mkstemp(dir=self.version_dir, suffix='.tmp')
+        with os.fdopen(handle, 'w') as version_file:
+            version_file.write(str(version))
+        os.rename(tmp_path, os.path.join(self.version_dir, dataset))
+
+    def load_version(self, dataset):
+        """
+        Returns the dataset version pages were last cached for, or None
+        """
+        try:
+            with open(os.path.join(self.version_dir, dataset)) as version_file:
+                return version_file.read().strip()
+        except IOError:
+            return None
+
+    def save_page_sizes(self, dataset, version, sizes):
+        """
+        Record the page sizes a pull of the dataset version was made with, in page order,
+        so replay requests the same pages
+        """
+        handle, tmp_path = tempfile.mkstemp(dir=self.version_dir, suffix='.tmp')
+        with os.fdopen(handle, 'w') as sizes_file:
+            json.dump({'version': version, 'sizes': sizes}, sizes_file)
+        os.rename(tmp_path, os.path.join(self.version_dir, dataset + '.page_sizes'))
+
+    def load_page_sizes(self, dataset, version):
+        """
+        Returns the page sizes the last pull of the dataset version was made with, or None
+        """
+        try:
+            with open(os.path.join(self.version_dir, dataset + '.page_sizes')) as sizes_file:
+                recorded = json.load(sizes_file)
+        except (IOError, ValueError):
+            return None
+        return recorded['sizes'] if str(recorded['version']) == str(version) else None
+
+    def summary(self):
+        return "%s page cache hits, %s misses" % (self.hits, self.misses)
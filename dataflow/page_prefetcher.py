@@ -0,0 +1,115 @@
+"""
+Utilities to fetch pages ahead of the writer
+"""
+import sys
+import threading
+from collections import deque
+from Queue import Full, Queue
+
+class PagePrefetcher:
+    """
+    Runs a fetch function for a list of independent tasks (ex. page offsets)
+    on a small pool of threads while the caller writes the pages it already has.
+    Pages are yielded in task order and at most queue_depth pages are held
+    ahead of the writer.
+    """
+    def __init__(self, fetch, tasks, concurrency, queue_depth):
+        self.fetch = fetch
+        self.tasks = iter(tasks)
+        self.concurrency = max(1, concurrency)
+        self.queue_depth = max(queue_depth, self.concurrency)
+        self.work = Queue()
+
+    def __iter__(self):
+        for _ in range(self.concurrency):
+            worker = threading.Thread(target=self.worker)
+            worker.daemon = True
+            worker.start()
+
+        # one single-item slot per task, drained in task order
+        pending = deque()
+        try:
+            while True:
+                while len(pending) < self.queue_depth:
+                    task = next(self.tasks, None)
+                    if task is None:
+                        break
+                    slot = Queue(1)
+                    self.work.put((task, slot))
+                    pending.append(slot)
+
+                if not pending:
+                    return
+
+                succeeded, result = pending.popleft().get()
+                if not succeeded:
+                    raise result[0], result[1], result[2]
+                yield result
+        finally:
+            for _ in range(self.concurrency):
+                self.work.put(None)
+
+    def worker(self):
+        """
+        Fetch tasks until a None task says stop
+        """
+        while True:
+            item = self.work.get()
+            if item is None:
+                return
+            task, slot = item
+            try:
+                slot.put((True, self.fetch(task)))
+            except Exception:
+                slot.put((False, sys.exc_info()))
+
+
+def read_ahead(pages, queue_depth):
+    """
+    Drain an iterator of pages on a background thread into a bounded queue.
+    Used where each page depends on the one before it (ex. keyset paging),
+    so the next fetch overlaps with writing the current page.
+        @param pages - iterator of pages
+        @param queue_depth - most pages held ahead of the caller
+    """
+    buffered = Queue(max(1, queue_depth))
+    stopped = threading.Event()
+
+    def put(item):
+        # a caller that stopped early leaves the queue full, give up instead of blocking for good
+        while not stopped.is_set():
+            try:
+                buffered.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for page in pages:
+                if not put((True, page)):
+                    break
+            else:
+                put((True, None))
+        except Exception:
+            put((False, sys.exc_info()))
+        finally:
+            # release the iterator (and the connection it fetches with) with the thread
+            if hasattr(pages, 'close'):
+                pages.close()
+
+    thread = threading.Thread(target=producer)
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            succeeded, page = buffered.get()
+            if not succeeded:
+                raise page[0], page[1], page[2]
+            if page is None:
+                return
+            yield page
+    finally:
+        stopped.set()
@@ -0,0 +1,117 @@
+"""
+Utilities to size source pages by measured throughput and memory
+"""
+import sys
+import threading
+
+# a bigger page has to fetch at least this share of the rows/s of the smaller one to keep growing
+GROWTH_TOLERANCE = 0.95
+
+
+def row_bytes(rows):
+    """
+    Returns the estimated bytes a decoded source row holds in memory,
+    from a few rows of a page. Field names are shared by the rows of a page.
+    """
+    sample = [rows[0], rows[len(rows) / 2], rows[-1]]
+    return sum([sys.getsizeof(row) + sum([sys.getsizeof(value) for value in row.itervalues()])\
+        for row in sample]) / len(sample)
+
+
+class PageSizer:
+    """
+    Chooses the row limit of each source page, starting from initial.
+
+    Every fetched page is observed: a page slower than twice target_seconds
+    halves the size; a full page faster than target_seconds doubles it, as
+    long as the rows/s keep up with the smaller size, otherwise the size
+    steps back and grows no further. The size is
+    kept within min_rows and max_rows, and small enough that the decoded
+    pages in flight (fetched ahead or being written) fit in memory_bytes.
+
+    With min_rows equal to max_rows the size is fixed. Sizes are handed out
+    in page order, so a planned list of sizes (ex. the ones a cached pull
+    was made with) replays the same pages.
+    """
+    def __init__(self, initial, min_rows, max_rows, target_seconds, memory_bytes=None, pages_in_flight=1,\
+            planned=None):
+        """
+            @param initial - rows of the first page
+            @param min_rows - smallest page
+            @param max_rows - largest page
+            @param target_seconds - fetch time of a page to grow towards
+            @param memory_bytes - decoded pages in flight are kept under this, None for no ceiling
+            @param pages_in_flight - pages held in memory at a time, ex. by the prefetcher
+            @param planned - sizes to hand out instead of choosing them, ex. for --replay
+        """
+        self.min_rows = max(1, min_rows)
+        self.max_rows = max(self.min_rows, max_rows)
+        self.target_seconds = target_seconds
+        self.memory_bytes = memory_bytes
+        self.pages_in_flight = max(1, pages_in_flight)
+        self.planned = list(planned) if planned is not None else None
+        self.current = min(max(initial, self.min_rows), self.max_rows)
+        self.ceiling = self.max_rows
+        self.row_bytes = None
+        # (size, rows/s) of the size the current one grew from
+        self.smaller = None
+        self.rates = {}
+        self.chosen = []
+        self.lock = threading.Lock()
+
+    def fixed(self):
+        return self.planned is not None or self.min_rows == self.max_rows
+
+    def size(self):
+        """
+        Returns the row limit of the next page
+        """
+        with self.lock:
+            if self.planned is not None:
+                size = self.planned.pop(0) if self.planned else self.current
+            else:
+                size = self.current
+            self.chosen.append(size)
+            return size
+
+    def observe(self, limit, rows, fetch_seconds):
+        """
+        Adjust the size to a fetched page
+            @param limit - row limit the page was requested with
+            @param rows - the page's decoded rows
+            @param fetch_seconds - time of the request, up to the last byte of the response
+        """
+        if self.fixed() or not rows:
+            return
+        page_bytes = row_bytes(rows)
+        with self.lock:
+            self.row_bytes = page_bytes if self.row_bytes is None else (self.row_bytes + page_bytes) / 2
+            self.current = min(self.current, self.memory_rows())
+            if fetch_seconds > self.target_seconds * 2:
+                self.current = max(self.min_rows, min(self.current, limit / 2))
+                self.smaller = None
+                return
+            # pages fetched ahead at an older size, and the short last page, say little about the current size
+            if limit != self.current or len(rows) < limit or fetch_seconds <= 0:
+                return
+            rate = len(rows) / fetch_seconds
+            self.rates[limit] = (self.rates[limit] + rate) / 2 if limit in self.rates else rate
+            if fetch_seconds >= self.target_seconds:
+                return
+            if self.smaller and self.rates[limit] < self.smaller[1] * GROWTH_TOLERANCE:
+                # the bigger page did not pay off, go back and stay there
+                self.ceiling = self.current = self.smaller[0]
+                self.smaller = None
+                return
+            grown = min(limit * 2, self.ceiling, self.max_rows, self.memory_rows())
+            if grown > limit:
+                self.smaller = (limit, self.rates[limit])
+                self.current = grown
+
+    def memory_rows(self):
+        """
+        Returns the largest size whose pages in flight fit in memory_bytes
+        """
+        if not self.memory_bytes or not self.row_bytes:
+            return self.max_rows
+        return max(self.min_rows, self.memory_bytes / self.pages_in_flight / self.row_bytes)
@@ -0,0 +1,154 @@
+"""
+Utilities to make PostgreSQL calls
+"""
+try:
+    import psycopg2
+except ImportError:
+    # only needed by topics with a postgres target
+    psycopg2 = None
+
+from target_client import TargetClient
+
+class PostgresWrapper(TargetClient):
+    """
+    PostgreSQL target client, bulk loads stream the file with COPY ... FROM STDIN.
+    Tables are not qualified with the db (the connection's database), the
+    search_path of the user decides the schema.
+    """
+    # bytes read from the file per COPY message
+    COPY_BUFFER_SIZE = 1 << 20
+    # Postgres has no packet limit, this only bounds a single multi-row INSERT
+    MAX_STATEMENT_SIZE = 16 << 20
+
+    def __init__(self, logger, host, port, user, password, db, autocommit=False, silent_mode=False, local_infile=False):
+        if psycopg2 is None:
+            raise ValueError("postgres targets need psycopg2, pip install -r requirements.txt (psycopg2-binary)")
+        TargetClient.__init__(self, logger, host, port, user, password, db, autocommit=autocommit,\
+            silent_mode=silent_mode, local_infile=local_infile)
+
+    def connect(self):
+        conn = psycopg2.connect(host=self.host, dbname=self.db, user=self.user, port=self.port,\
+            password=self.password)
+        conn.set_client_encoding('UTF8')
+        self.logger.info("conn instance is %s" % str(conn))
+        return conn
+
+    def set_autocommit(self, conn, autocommit):
+        conn.autocommit = autocommit
+
+    def retryable(self, e):
+        """
+        Lost connections, serialization failures and deadlocks, server shutdowns
+        """
+        return isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError))
+
+    def max_statement_size(self):
+        return self.MAX_STATEMENT_SIZE
+
+    def qualified_table(self, table):
+        return table
+
+    def upsert_clause(self, columns, upsert_key):
+        """
+        Returns the ON CONFLICT clause for upsert_key, which needs a unique index on it
+        """
+        updates = [column for column in columns if column not in upsert_key]
+        if not updates:
+            return "ON CONFLICT (%s) DO NOTHING" % ','.join(upsert_key)
+        return "ON CONFLICT (%s) DO UPDATE SET " % ','.join(upsert_key)\
+            + ','.join(['%s=EXCLUDED.%s' % (column, column) for column in updates])
+
+    def increment_clause(self, table, key, counter):
+        return "ON CONFLICT (%s) DO UPDATE SET %s=%s.%s+EXCLUDED.%s" % (','.join(key), counter, table,\
+            counter, counter)
+
+    def literal(self, value):
+        if value is None:
+            return 'DEFAULT'
+        if isinstance(value, (int, long)):
+            return str(value)
+        return "E'" + value.replace('\\', '\\\\').replace("'", "''") + "'"
+
+    def month_expression(self, column):
+        return "to_char(%s, 'YYYY-MM')" % column
+
+    def create_table_like(self, table, template):
+        self.execute("CREATE TABLE IF NOT EXISTS %s (LIKE %s INCLUDING ALL)" % (table, template))
+
+    def secondary_indexes(self, table):
+        rows = self.execute("SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema()"\
+            " AND tablename = %s AND indexdef NOT LIKE 'CREATE UNIQUE %%' ORDER BY indexname",\
+            ret=True, args=(table,))
+        # CREATE INDEX name ON schema.table USING method (columns) [WHERE ...], without the table
+        return [(name, definition[definition.index(' USING ') + 1:]) for name, definition in rows]
+
+    def drop_indexes(self, table, names):
+        if names:
+            self.transaction(['DROP INDEX "%s"' % name for name in names])
+
+    def create_indexes(self, table, indexes):
+        """
+        Build the indexes, named by Postgres since index names are unique per schema
+        """
+        for _, definition in indexes:
+            self.execute("CREATE INDEX ON %s %s" % (table, definition))
+
+    def copy_grants(self, source, table):
+        # privileges belong to the table, not its name
+        rows = self.execute("SELECT grantee, privilege_type FROM information_schema.table_privileges"\
+            " WHERE table_schema = current_schema() AND table_name = %s", ret=True, args=(source,))
+        grants = ["GRANT %s ON %s TO %s" % (privilege, table, grantee if grantee == 'PUBLIC'\
+            else '"%s"' % grantee.replace('"', '""')) for grantee, privilege in rows]
+        if grants:
+            self.transaction(grants)
+
+    def swap_tables(self, table, staging, retired):
+        """
+        Rename both tables in one transaction. Serial columns of a table created
+        LIKE the target use the target's sequences, which are handed over to the
+        new table first so dropping the old one keeps them.
+        """
+        self.drop_table(retired)
+        sequences = self.execute("SELECT s.relname, a.attname FROM pg_depend d"\
+            " JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'"\
+            " JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid"\
+            " WHERE d.refobjid = %s::regclass AND d.deptype = 'a'", ret=True, args=(table,))
+        self.transaction(["ALTER TABLE %s RENAME TO %s" % (table, retired),\
+            "ALTER TABLE %s RENAME TO %s" % (staging, table)]\
+            + ['ALTER SEQUENCE "%s" OWNED BY %s.%s' % (sequence, table, column) for sequence, column in sequences])
+        self.drop_table(retired)
+
+    def load_options(self, serializer):
+        return serializer.postgres_copy_options()
+
+    def bulk_load(self, path, table, columns, options, upsert_key=None, before=None, after=None):
+        """
+        Stream the file into the table with COPY FROM STDIN in one transaction.
+        With an upsert key the file is copied into a temporary table first and
+        merged with INSERT ... ON CONFLICT, the last row of a key in the file wins.
+        """
+        column_list = ','.join(columns)
+
+        def copy_into(copy_table):
+            def copy(cursor):
+                with open(path, 'rb') as stream:
+                    cursor.copy_expert("COPY %s (%s) FROM STDIN WITH (%s)" % (copy_table, column_list, options),\
+                        stream, size=self.COPY_BUFFER_SIZE)
+            return copy
+
+        before, after = list(before or []), list(after or [])
+        if not upsert_key:
+            self.transaction(before + [copy_into(table)] + after)
+            return
+
+        # a key may appear twice in a file, ON CONFLICT can only update a row once per statement
+        staging = 'import_staging'
+        key_list = ','.join(upsert_key)
+        self.transaction(before + [
+            "CREATE TEMPORARY TABLE %s ON COMMIT DROP AS SELECT %s FROM %s WITH NO DATA"\
+                % (staging, column_list, table),
+            "ALTER TABLE %s ADD COLUMN import_row BIGSERIAL" % staging,
+            copy_into(staging),
+            "INSERT INTO %s (%s) SELECT DISTINCT ON (%s) %s FROM %s ORDER BY %s, import_row DESC %s"\
+                % (table, column_list, key_list, column_list, staging, key_list,\
+                self.upsert_clause(columns, upsert_key))] + after)
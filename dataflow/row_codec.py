@@ -0,0 +1,141 @@
+"""
+Utilities to encode source rows for a target table
+"""
+
+def split_columns(columns):
+    """
+    Split a comma separated settings string into a list of column names
+    """
+    if not columns:
+        return []
+    return [column.strip() for column in columns.split(',') if column.strip()]
+
+
+# SoQL type the source field of each column type is cast to
+SOQL_CASTS = {
+    'string': 'text',
+    'date': 'floating_timestamp',
+    'integer': 'number'
+}
+
+
+def soql_projection(column_mapping):
+    """
+    Returns the SoQL select list of a column mapping: each source field cast
+    to the SoQL type of its column and named like its target column, so the
+    rows come back keyed by target column
+        @param column_mapping - list of (source field, target column, type), type one of SOQL_CASTS
+    """
+    select = []
+    for field, column, column_type in column_mapping:
+        if column_type not in SOQL_CASTS:
+            raise ValueError("column %s has type %s, not one of %s"\
+                % (column, column_type, ', '.join(sorted(SOQL_CASTS))))
+        select.append("%s::%s as %s" % (field, SOQL_CASTS[column_type], column))
+    return select
+
+
+class RowCodec:
+    """
+    Encodes source rows (dicts with key:value) into tuples for one topic.
+    The column order, the converter of each column and the INSERT template
+    are worked out once, so encoding a row is a single pass over the columns.
+
+    Columns not listed as date or integer columns are strings.
+    A missing or None value stays None: NULL for batch inserts and bulk
+    loads, DEFAULT in a single-row INSERT.
+
+    With upsert_key, rows that collide with an existing row on that unique
+    key update it: see on_duplicate. The upsert clause and the literals of
+    insert_statement are written in the dialect of a target client.
+    """
+    def __init__(self, table, columns, date_columns=None, integer_columns=None, sanitize=None, upsert_key=None,\
+            dialect=None):
+        """
+            @param table - target table, optionally qualified with the db
+            @param columns - target columns, in the order they are written
+            @param date_columns - columns holding datetimes
+            @param integer_columns - columns holding integers
+            @param sanitize - function cleaning up string values, ex. CsvSerializer.sanitize
+            @param upsert_key - columns of the target's unique key to upsert on, if any
+            @param dialect - TargetClient of the target, needed for on_duplicate and insert_statement
+        """
+        if not columns:
+            raise ValueError("a row codec for %s needs at least one column" % table)
+        self.table = table
+        self.columns = list(columns)
+        self.sanitize = sanitize
+        self.dialect = dialect
+
+        date_columns = frozenset(date_columns or [])
+        integer_columns = frozenset(integer_columns or [])
+        self.fields = []
+        for column in self.columns:
+            if column in date_columns:
+                self.fields.append((column, self.to_datetime))
+            elif column in integer_columns:
+                self.fields.append((column, self.to_integer))
+            else:
+                self.fields.append((column, self.to_string))
+
+        self.upsert_key = list(upsert_key or [])
+        missing = [column for column in self.upsert_key if column not in self.columns]
+        if missing:
+            raise ValueError("upsert key columns %s are not written to %s" % (','.join(missing), table))
+
+        # the upsert clause, None without an upsert key
+        self.on_duplicate = None
+        if self.upsert_key and dialect:
+            self.on_duplicate = dialect.upsert_clause(self.columns, self.upsert_key)
+
+        self.insert_template = "INSERT INTO %s (%s) VALUES (%%s)" % (table, ','.join(self.columns))
+        if self.on_duplicate:
+            self.insert_template = self.insert_template + ' ' + self.on_duplicate
+
+    def to_datetime(self, value):
+        """
+        Socrata floating timestamps (2019-01-31T00:00:00.000) to 'YYYY-MM-DD HH:MM:SS'
+        """
+        if value is None:
+            return None
+        return str(value)[:19].replace('T', ' ')
+
+    def to_integer(self, value):
+        if value is None or value == '':
+            return None
+        return int(value)
+
+    def to_string(self, value):
+        if value is None:
+            return None
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif not isinstance(value, str):
+            value = str(value)
+        if self.sanitize:
+            value = self.sanitize(value)
+        return value
+
+    def encode(self, row):
+        """
+        Returns the values of a row as a tuple ordered like columns
+        """
+        get = row.get
+        return tuple([convert(get(column)) for column, convert in self.fields])
+
+    def encode_rows(self, rows):
+        """
+        Generate the encoded tuple of each row
+        """
+        fields = self.fields
+        for row in rows:
+            get = row.get
+            yield tuple([convert(get(column)) for column, convert in fields])
+
+    def insert_statement(self, values):
+        """
+        Returns a single-row INSERT for encoded values, with the values
+        inlined as literals of the dialect
+        """
+        literal = self.dialect.literal
+        return self.insert_template % ','.join([literal(value) for value in values])
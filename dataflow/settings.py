@@ -25,8 +25,9 @@ TARGET_CONN = {
         'password': "<%= scope.lookupvar('auth_h::mysql::importuser') %>"
     },
     'POSTGRES_TARGET_1': {
+        'target_type': 'postgres',
         'host': 'roverpostgres.cmabkwtwf8dr.us-west-2.rds.amazonaws.com',
-        'port': 3306,
+        'port': 5432,
         'db': 'financedb',
         'user': 'importuser',
         'password': "<%= scope.lookupvar('auth_h::mysql::importuser') %>"
@@ -50,28 +51,54 @@ IMPORT_TOPICS = {
         'target_type': 'mysql',
         'target_conn': 'MYSQL_TARGET_1',
         'target_table': 'pet_license',
-        'target_string_columns': 'pet_license_number, animal_s_name, species, primary_breed, secondary_breed, zip_code',
-        'target_date_columns': 'license_issue_date',
-        'filter_soql': "where license_issue_date > '%s'",
+        # (source field, target column, type), pulls select and cast only these fields;
+        # without it target_columns and target_*_columns name the fields of select *
+        'column_mapping': [
+            ('license_issue_date', 'license_issue_date', 'date'),
+            ('license_number', 'license_number', 'string'),
+            ('animal_s_name', 'animal_s_name', 'string'),
+            ('species', 'species', 'string'),
+            ('primary_breed', 'primary_breed', 'string'),
+            ('secondary_breed', 'secondary_breed', 'string'),
+            ('zip_code', 'zip_code', 'string')
+        ],
+        'load_mode': 'bulk',
+        'paging': 'keyset',
+        'paging_key': ':id',
+        'upsert_key': 'license_number',
+        # --initialize loads a copy of the table and swaps it in, readers never see it empty
+        'initialize_mode': 'swap',
+        # license counts per species and year for the dashboard, updated with every chunk
+        'summary_table': 'pet_license_summary',
+        'summary_column': 'species',
+        'summary_date_column': 'license_issue_date',
+        'partition_column': 'license_issue_date',
+        'reconcile_columns': 'license_number',
+        'filter_soql': "where license_issue_date >= '%s'",
         'filter_sql': "SELECT MAX(license_issue_date) FROM pet_license;",
         'filter_sql_result_datatype': "datetime"
     },
     'example_topic2': {
         'topic_name':'fake_pet_tax',
+        # a placeholder, --all skips it
+        'enabled': False,
         'source_type': 'socrata',
         'source_url': 'data.seattle.gov',
         'dataset_name': 'xyza-f8tt',
         'target_type': 'postgres',
-        'target': 'POSTGRES_TARGET_1',
+        'target_conn': 'POSTGRES_TARGET_1',
         'target_table': 'tax_collected',
-        'target_columns': 'col1, col2'
+        'target_columns': 'col1, col2',
+        'load_mode': 'bulk',
+        # COPY only reads back escaped back slashes and quotes
+        'serializer_settings': {'escapes': frozenset(['\\', '"'])}
     }
 }
 
 
 SERIALIZER_SETTINGS = {
             'utf8_sanitize': True,
-            'null_value': '',
+            'null_value': '\\N', # how LOAD DATA spells NULL
             'separator': ',',
             'escapes': frozenset(['\\', '"', '\t', '\n']),
             'quotes': '"',
@@ -83,9 +110,40 @@ MISC = {
     'quit_signal': signal.SIGTERM,
     'tmp_dir':'/mnt/c/Temp/',
     'import_log_table': 'import_log',
-    'pull_row_limit': 1000
-}
-
-SQL_CMDS = {
-    'import_log_sql': "INSERT INTO import_log(source_file,target_host,target_db,target_table,total_row_count,chunk_row_count, comments) VALUES('%(source_file)s','%(target_host)s','%(target_db)s','%(target_table)s',%(total_row_count)s,%(chunk_row_count)s,'%(comments)s')"
+    'import_log_columns': 'source_file, target_host, target_db, target_table, total_row_count, chunk_row_count, comments, '\
+        'count_ms, fetch_ms, decode_ms, encode_ms, insert_ms, commit_ms, rows_per_sec, bytes, page_size',
+    'import_log_flush_seconds': 5,
+    'import_log_flush_rows': 100,
+    # app token sent to socrata endpoints, a topic's source_app_token overrides it
+    'socrata_app_token': os.environ.get('SOCRATA_APP_TOKEN'),
+    # throttled (429), failed (5xx) and timed out source requests are retried with jittered backoff
+    'source_connect_timeout': 10,
+    'source_read_timeout': 120,
+    'source_retry_attempts': 6,
+    'source_backoff_seconds': 1,
+    'source_backoff_max_seconds': 60,
+    'pull_row_limit': 1000,
+    # pages start at pull_row_limit and adapt to the source's latency and rows/s,
+    # kept under page_memory_mb of decoded pages in flight
+    'page_size_min': 500,
+    'page_size_max': 50000,
+    'page_target_seconds': 2,
+    'page_memory_mb': 512,
+    'fetch_concurrency': 4,
+    'fetch_queue_depth': 8,
+    'target_queue_depth': 2,
+    'metrics_dir': '/mnt/c/Temp/',
+    'checkpoint_table': 'import_checkpoint',
+    # compressed source pages, keyed by dataset version and query, 0 to disable
+    'page_cache_max_mb': 2048,
+    'page_cache_ttl_hours': 72,
+    # snapshots of --stage, segment files are closed at staging_segment_mb
+    'staging_dir': '/mnt/c/Temp/staging/',
+    'staging_segment_mb': 256,
+    'staging_keep': 2,
+    # topics with source_type 'file' are parsed in spans of file_span_mb on file_processes processes
+    'file_span_mb': 16,
+    'file_processes': 4,
+    'topic_concurrency': 4,
+    'topic_concurrency_per_target': 2
 }
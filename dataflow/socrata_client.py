@@ -0,0 +1,177 @@
+"""
+Utilities to fetch from a Socrata (SODA) endpoint
+"""
+import json
+import logging
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ContentDecodingError
+from sodapy import Socrata
+
+class SocrataClient:
+    """
+    A sodapy Socrata client for one domain, sending the app token (if any)
+    with every request to get past the throttling of anonymous requests.
+    Its session keeps the connection alive between pages and asks for gzip
+    compressed responses; a client is used by one thread at a time.
+
+    Requests time out after connect_timeout seconds connecting and read_timeout
+    seconds without data. Throttled (429), failed (5xx), timed out and broken
+    requests are retried up to retry_attempts times; retry n waits between half
+    and all of backoff_base * 2 ** (n - 1) seconds, at most backoff_max, or the
+    server's Retry-After. Other errors are raised as requests.HTTPError.
+    """
+    RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(self, logger, domain, app_token=None, scheme='https', connect_timeout=10, read_timeout=120,\
+            retry_attempts=5, backoff_base=1.0, backoff_max=60):
+        """
+            @param logger - logger to warn about retries with
+            @param domain - host (and port) of the endpoint, ex. data.seattle.gov
+            @param app_token - Socrata application token, None for anonymous requests
+            @param scheme - https, or http for local stand-ins (see soda_standin.py)
+        """
+        self.logger = logger
+        # a single pooled connection, kept alive; retries are done here, not by urllib3
+        self.socrata = Socrata(domain, app_token, timeout=read_timeout, session_adapter={\
+            'prefix': scheme + '://', 'adapter': HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)})
+        self.session = self.socrata.session
+        self.session.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+        self.uri_prefix = self.socrata.uri_prefix
+        self.domain = domain
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry_attempts = retry_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def get(self, path, params=None):
+        """
+        Returns the (decompressed) body of a GET of path on the domain, retrying
+        throttled and failed requests
+            @param path - ex. /resource/jguv-t9rb.json
+            @param params - query parameters, ex. {'$query': soql}
+        """
+        url = "%s%s%s" % (self.uri_prefix, self.domain, path)
+        failure = 0
+        while True:
+            wait = None
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                if response.status_code not in self.RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response.content
+                error = requests.HTTPError("%s %s for %s" % (response.status_code, response.reason, url),\
+                    response=response)
+                wait = self.retry_after(response)
+            except (requests.ConnectionError, requests.Timeout, ChunkedEncodingError, ContentDecodingError), e:
+                error = e
+            failure += 1
+            if failure > self.retry_attempts:
+                raise error
+            if wait is None:
+                wait = self.backoff(failure)
+            self.logger.warning("GET %s failed (attempt %s), retrying in %.1fs: %s" % (path, failure, wait, error))
+            time.sleep(wait)
+
+    def backoff(self, failure):
+        """
+        Returns the seconds to wait before retry number failure, jittered so
+        the fetch threads of a throttled run do not retry in lockstep
+        """
+        bound = min(self.backoff_base * 2.0 ** (failure - 1), self.backoff_max)
+        return bound / 2 + random.uniform(0, bound / 2)
+
+    def retry_after(self, response):
+        """
+        Returns the seconds a 429 or 503 response asks to wait, at most backoff_max, or None
+        """
+        try:
+            return min(float(response.headers['Retry-After']), self.backoff_max)
+        except (KeyError, ValueError):
+            return None
+
+    def close(self):
+        self.session.close()
+
+
+# Unit test stuff
+class Test():
+    """ Conducts unit tests against the local SODA stand-in, see soda_standin.py. """
+    QUERY = {'$query': 'select * limit 5'}
+
+    def verify(self, result, case):
+        """
+        Utility to verify a test case
+        """
+        if result != case[1]:
+            print ("Error: input: %s expected %s actual %s" % (case[0], case[1], result))
+
+    def serve(self, faults):
+        from soda_standin import SodaStandin, SyntheticDataset
+        return SodaStandin(SyntheticDataset(10), faults=faults).start()
+
+    def client(self, server, **options):
+        logger = logging.getLogger('socrata_client.test')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        return SocrataClient(logger, server.domain(), app_token='test-token', scheme='http', **options)
+
+    def test_retries(self):
+        """
+        A page arrives after throttled and failed requests, waiting as long as
+        Retry-After asks rather than the (much longer) backoff
+        """
+        from soda_standin import Faults
+        server = self.serve(Faults(statuses=(429, 503), retry_after=0.2, fail_first=3))
+        client = self.client(server, retry_attempts=3, backoff_base=30)
+        try:
+            start = time.time()
+            rows = json.loads(client.get('/resource/test-rows.json', self.QUERY))
+            elapsed = time.time() - start
+            self.verify(len(rows), ['rows after 3 retries', 5])
+            self.verify(server.requests, ['requests after 3 retries', 4])
+            self.verify(sum(server.faults.injected.values()), ['injected errors', 3])
+            self.verify(0.6 <= elapsed < 5, ['waited 3 Retry-After of 0.2s', True])
+        finally:
+            client.close()
+            server.stop()
+
+    def test_backoff(self):
+        """
+        Errors without Retry-After wait the backoff
+        """
+        from soda_standin import Faults
+        server = self.serve(Faults(statuses=(500, 502), fail_first=2))
+        client = self.client(server, retry_attempts=2, backoff_base=0.01)
+        try:
+            rows = json.loads(client.get('/resource/test-rows.json', self.QUERY))
+            self.verify(len(rows), ['rows after 2 retries', 5])
+            self.verify(server.requests, ['requests after 2 retries', 3])
+        finally:
+            client.close()
+            server.stop()
+
+    def test_give_up(self):
+        """
+        The error is raised once retry_attempts retries failed
+        """
+        from soda_standin import Faults
+        server = self.serve(Faults(error_rate=1.0, statuses=(429, 503), retry_after=0))
+        client = self.client(server, retry_attempts=2)
+        try:
+            try:
+                client.get('/resource/test-rows.json', self.QUERY)
+                print "Error: input: every request failing expected requests.HTTPError"
+            except requests.HTTPError, e:
+                self.verify(e.response.status_code in (429, 503), ['status of the last error', True])
+            self.verify(server.requests, ['requests before giving up', 3])
+        finally:
+            client.close()
+            server.stop()
+
+if __name__ == '__main__':
+    Test().test_retries()
+    Test().test_backoff()
+    Test().test_give_up()
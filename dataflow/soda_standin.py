@@ -0,0 +1,444 @@
+#!/usr/bin/python
+"""
+@package soda_standin
+
+ Local stand-in for the SODA endpoints socrata_pull uses, so the pipeline
+ can be run and benchmarked without data.seattle.gov.
+
+ Serves GET /resource/<dataset>.json?$query=<SoQL> for the SoQL this
+ package sends: select COUNT(*) (and count(distinct field)) / * / :id, * /
+ column lists, optionally cast (field::text, ::number or ::floating_timestamp)
+ and renamed (as), where conditions joined by 'and', order by, limit and
+ offset, and aggregates
+ (count, min, max over date_trunc_ym or column groups) with group by.
+ GET /api/views/<dataset>.json answers the dataset's metadata with
+ rowsUpdatedAt, the version pages are cached by. Responses are gzipped
+ for clients that accept it.
+
+ Faults can be injected into /resource responses to test the retries of
+ SocrataClient: a share of the requests answered with 429/5xx errors and
+ a share answered slowly (longer than a read timeout, to time them out).
+
+ The dataset is either synthetic (fixtures.pet_license_row, generated per
+ page so 10M rows cost no memory) or an NDJSON fixture file loaded in memory.
+
+ Usage: soda_standin.py [-h] [--port PORT] [-n ROWS] [--seed SEED] [--fixture FIXTURE]
+                        [--error_rate ERROR_RATE] [--slow_rate SLOW_RATE]
+                        [--slow_seconds SLOW_SECONDS]
+"""
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+from cStringIO import StringIO
+from bisect import bisect_right
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from urlparse import urlparse, parse_qs
+
+from fixtures import pet_license_row
+
+CLAUSE_PATTERN = re.compile(r"\b(select|where|group\s+by|order\s+by|limit|offset)\b", re.I)
+CONDITION_PATTERN = re.compile(r"([:\w]+)\s*(>=|<=|!=|=|>|<)\s*'((?:[^']|'')*)'")
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+SELECT_PATTERN = re.compile(r"^(?:(\w+)\s*\(\s*(distinct\s+)?([:\w*]+)\s*\)|([:\w*]+))(?:\s+as\s+(\w+))?$", re.I)
+AGGREGATES = {
+    'count': lambda values: str(len([value for value in values if value is not None])),
+    'count distinct': lambda values: str(len(set([value for value in values if value is not None]))),
+    'min': lambda values: min([value for value in values if value is not None] or [None]),
+    'max': lambda values: max([value for value in values if value is not None] or [None])
+}
+DISTINCT_PATTERN = re.compile(r"^count\s*\(\s*distinct\s+([:\w]+)\s*\)(?:\s+as\s+(\w+))?$", re.I)
+PROJECTION_PATTERN = re.compile(r"^(:?\w+)(?:\s*::\s*(\w+))?(?:\s+as\s+(\w+))?$", re.I)
+CASTS = {
+    'text': lambda value: value if isinstance(value, basestring) else str(value),
+    'number': lambda value: ('%r' % float(value)).rstrip('0').rstrip('.'),
+    'floating_timestamp': lambda value: comparable(value)
+}
+TRANSFORMS = {
+    'date_trunc_ym': lambda value: value and value[:7] + '-01T00:00:00.000'
+}
+COMPARE = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b
+}
+
+
+class SyntheticDataset:
+    """
+    count rows of fixtures.pet_license_row, sorted by :id
+    """
+    def __init__(self, count, seed=0):
+        self.count = count
+        self.seed = seed
+
+    def row(self, number):
+        return pet_license_row(number, self.seed)
+
+    def index_after(self, row_id):
+        """ Index of the first row with :id greater than row_id """
+        try:
+            return max(0, min(self.count, int(row_id.split('-', 1)[1], 16) + 1))
+        except (IndexError, ValueError):
+            return 0 if row_id < 'row-' else self.count
+
+
+class FixtureDataset:
+    """
+    Rows of an NDJSON fixture file, held in memory sorted by :id
+    """
+    def __init__(self, path):
+        with open(path) as fixture:
+            self.rows = [json.loads(line) for line in fixture if line.strip()]
+        self.rows.sort(key=lambda row: row[':id'])
+        self.ids = [row[':id'] for row in self.rows]
+        self.count = len(self.rows)
+
+    def row(self, number):
+        return self.rows[number]
+
+    def index_after(self, row_id):
+        return bisect_right(self.ids, row_id)
+
+
+def parse_soql(query):
+    """
+    Split a SoQL query into its clauses
+        @return dict of clause name (select, where, group by, order by, limit, offset) to text
+    """
+    clauses = {}
+    matches = list(CLAUSE_PATTERN.finditer(query))
+    for position, match in enumerate(matches):
+        end = matches[position + 1].start() if position + 1 < len(matches) else len(query)
+        clauses[re.sub(r'\s+', ' ', match.group(1).lower())] = query[match.end():end].strip()
+    return clauses
+
+
+def comparable(value):
+    """
+    Dates in conditions are compared like the floating timestamps they filter
+    """
+    if DATE_PATTERN.match(value):
+        return value + 'T00:00:00.000'
+    return value
+
+
+def run_query(dataset, query):
+    """
+    Returns the JSON-ready result of a SoQL query against a dataset
+    """
+    clauses = parse_soql(query)
+    conditions = [(column, operator, comparable(value.replace("''", "'")))\
+        for column, operator, value in CONDITION_PATTERN.findall(clauses.get('where', ''))]
+    order = clauses.get('order by', ':id').split()[0]
+    limit = int(clauses['limit']) if 'limit' in clauses else None
+    offset = int(clauses.get('offset', 0))
+    select = [column.strip() for column in clauses.get('select', '*').split(',')]
+
+    if 'group by' in clauses:
+        return aggregate(dataset, conditions, select, clauses)
+    if [column for column in select if column.upper() == 'COUNT(*)']:
+        counts = {'COUNT': str(count_rows(dataset, conditions))}
+        for column in select:
+            match = DISTINCT_PATTERN.match(column)
+            if match:
+                field, alias = match.groups()
+                counts[alias or 'count_distinct_' + field] = str(len(set([row[field] for row in scan(dataset)\
+                    if row.get(field) is not None and matches(row, conditions)])))
+        return [counts]
+
+    # rows are stored in :id order, so :id conditions and order are index arithmetic
+    if order == ':id' and all([column == ':id' and operator in ('>', '>=') for column, operator, _ in conditions]):
+        start = 0
+        for _, operator, value in conditions:
+            after = dataset.index_after(value)
+            if operator == '>=' and after > 0 and dataset.row(after - 1)[':id'] == value:
+                after -= 1
+            start = max(start, after)
+        start += offset
+        stop = dataset.count if limit is None else min(dataset.count, start + limit)
+        rows = [dataset.row(number) for number in xrange(start, stop)]
+    else:
+        rows = [row for row in scan(dataset) if matches(row, conditions)]
+        rows.sort(key=lambda row: row.get(order))
+        rows = rows[offset:] if limit is None else rows[offset:offset + limit]
+
+    projection = projection_of(select)
+    return [project(row, projection) for row in rows]
+
+
+def aggregate(dataset, conditions, select, clauses):
+    """
+    Group the matching rows by the group by expressions and compute
+    the select list per group: count(*), count/min/max(column),
+    count(distinct column), date_trunc_ym(column) or a column, each
+    optionally 'as alias'
+    """
+    expressions = []
+    for item in select:
+        match = SELECT_PATTERN.match(item)
+        if not match:
+            raise ValueError("unsupported select expression %s" % item)
+        function, distinct, argument, column, alias = match.groups()
+        if function:
+            # unaliased results are named like SODA names them: count(*) is count, min(x) min_x
+            name = alias or (function if argument == '*' else '%s_%s' % (function, argument))
+            function = function.lower() + (' distinct' if distinct else '')
+            if function not in AGGREGATES and function not in TRANSFORMS:
+                raise ValueError("unsupported function %s" % function)
+            expressions.append((name, function, argument))
+        else:
+            expressions.append((alias or column, None, column))
+
+    def value_of(row, function, argument):
+        if function in TRANSFORMS:
+            return TRANSFORMS[function](row.get(argument))
+        return row.get(argument)
+
+    # group by entries name a select alias or repeat a select expression
+    by_name = dict([(name, (function, argument)) for name, function, argument in expressions])
+    group_by = []
+    for item in [item.strip() for item in clauses['group by'].split(',')]:
+        if item in by_name:
+            group_by.append(by_name[item])
+        else:
+            function, _, argument, column, _ = SELECT_PATTERN.match(item).groups()
+            group_by.append((function and function.lower(), argument or column))
+
+    groups = {}
+    for row in scan(dataset):
+        if matches(row, conditions):
+            key = tuple([value_of(row, function, argument) for function, argument in group_by])
+            groups.setdefault(key, []).append(row)
+
+    result = []
+    for key, rows in groups.iteritems():
+        values = {}
+        for name, function, argument in expressions:
+            if function in AGGREGATES:
+                if argument == '*':
+                    values[name] = str(len(rows))
+                else:
+                    values[name] = AGGREGATES[function]([row.get(argument) for row in rows])
+            else:
+                values[name] = value_of(rows[0], function, argument)
+        # like SODA, nulls are left out
+        result.append(dict([(name, value) for name, value in values.iteritems() if value is not None]))
+
+    order = clauses.get('order by', expressions[0][0]).split()[0]
+    result.sort(key=lambda values: values.get(order))
+    offset = int(clauses.get('offset', 0))
+    limit = int(clauses['limit']) if 'limit' in clauses else None
+    return result[offset:] if limit is None else result[offset:offset + limit]
+
+
+def scan(dataset):
+    for number in xrange(dataset.count):
+        yield dataset.row(number)
+
+
+def matches(row, conditions):
+    for column, operator, value in conditions:
+        if row.get(column) is None or not COMPARE[operator](row[column], value):
+            return False
+    return True
+
+
+def count_rows(dataset, conditions):
+    if not conditions:
+        return dataset.count
+    return sum([1 for row in scan(dataset) if matches(row, conditions)])
+
+
+def projection_of(select):
+    """
+    Parse a select list into (field, cast, name) entries, cast None if the field is not cast
+    """
+    projection = []
+    for item in select:
+        if item == '*':
+            projection.append(('*', None, '*'))
+            continue
+        match = PROJECTION_PATTERN.match(item)
+        if not match:
+            raise ValueError("unsupported select expression %s" % item)
+        field, cast, alias = match.groups()
+        if cast and cast.lower() not in CASTS:
+            raise ValueError("unsupported cast %s" % cast)
+        projection.append((field, cast and CASTS[cast.lower()], alias or field))
+    return projection
+
+
+def project(row, projection):
+    """
+    Apply a parsed select list: * is every non-system field, other entries
+    are fields, cast and renamed. Like SODA, nulls are left out.
+    """
+    result = {}
+    for field, cast, name in projection:
+        if field == '*':
+            result.update([(key, value) for key, value in row.iteritems() if not key.startswith(':')])
+        elif row.get(field) is not None:
+            result[name] = cast(row[field]) if cast else row[field]
+    return result
+
+
+class Faults:
+    """
+    Errors and delays to inject into responses: error_rate of the requests
+    are answered with one of statuses (429 and 503 with Retry-After, if set),
+    slow_rate of them after slow_seconds. The first fail_first requests are
+    always answered with an error, for tests that count the retries.
+    """
+    def __init__(self, error_rate=0.0, statuses=(429, 500, 502, 503), slow_rate=0.0, slow_seconds=0.0,\
+            retry_after=None, seed=0, fail_first=0):
+        self.error_rate = error_rate
+        self.fail_first = fail_first
+        self.drawn = 0
+        self.statuses = statuses
+        self.slow_rate = slow_rate
+        self.slow_seconds = slow_seconds
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # {status or 'slow': requests it was injected into}
+        self.injected = {}
+
+    def draw(self):
+        """
+        Returns (error status or None, seconds to delay the response) of the next request
+        """
+        with self.lock:
+            status, delay = None, 0.0
+            self.drawn += 1
+            if self.random.random() < self.slow_rate:
+                delay = self.slow_seconds
+                self.injected['slow'] = self.injected.get('slow', 0) + 1
+            if self.random.random() < self.error_rate or self.drawn <= self.fail_first:
+                status = self.random.choice(self.statuses)
+                self.injected[status] = self.injected.get(status, 0) + 1
+            return status, delay
+
+
+class SodaRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers /resource/<dataset>.json from the server's dataset
+    and /api/views/<dataset>.json with its metadata
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        match = re.match(r'^/api/views/([\w-]+)\.json$', url.path)
+        if match:
+            self.send_json({'id': match.group(1), 'rowsUpdatedAt': self.server.rows_updated_at})
+            return
+        match = re.match(r'^/resource/([\w-]+)\.json$', url.path)
+        if not match:
+            self.send_error(404, "Unknown resource %s" % url.path)
+            return
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.app_tokens.add(self.headers.get('X-App-Token'))
+        if self.server.faults:
+            status, delay = self.server.faults.draw()
+            time.sleep(delay)
+            if status:
+                self.send_json({'error': True, 'message': 'injected fault'}, status)
+                return
+        params = parse_qs(url.query)
+        try:
+            result = run_query(self.server.dataset, params.get('$query', [''])[0])
+        except Exception, e:
+            self.send_error(400, "Could not run query: %s" % e)
+            return
+        self.send_json(result)
+
+    def send_json(self, result, status=200):
+        body = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            compressed = StringIO()
+            with gzip.GzipFile(fileobj=compressed, mode='wb', compresslevel=1) as gzip_file:
+                gzip_file.write(body)
+            body = compressed.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        if status in (429, 503) and self.server.faults and self.server.faults.retry_after is not None:
+            self.send_header('Retry-After', str(self.server.faults.retry_after))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class SodaStandin(ThreadingMixIn, HTTPServer):
+    """
+    Threaded HTTP server for one dataset.
+    Port 0 picks a free port, see domain for the host:port to pull from.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, dataset, host='127.0.0.1', port=0, verbose=False, rows_updated_at=1546300800, faults=None):
+        """
+            @param faults - Faults to inject into /resource responses, if any
+        """
+        HTTPServer.__init__(self, (host, port), SodaRequestHandler)
+        self.dataset = dataset
+        self.verbose = verbose
+        self.faults = faults
+        self.lock = threading.Lock()
+        # /resource requests served and the app tokens they were sent with
+        self.requests = 0
+        self.app_tokens = set()
+        # dataset version in the metadata, change it to invalidate cached pages
+        self.rows_updated_at = rows_updated_at
+        self.thread = None
+
+    def domain(self):
+        return '%s:%s' % self.server_address[:2]
+
+    def start(self):
+        """
+        Serve on a background thread
+        """
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='serve a pet_license dataset on a local SODA stand-in')
+    PARSER.add_argument("--port", type=int, default=8080, help="port to listen on")
+    PARSER.add_argument("-n", "--rows", type=int, default=10000, help="synthetic dataset row count")
+    PARSER.add_argument("--seed", type=int, default=0, help="synthetic dataset random seed")
+    PARSER.add_argument("--fixture", help="serve this NDJSON fixture file instead of synthetic rows")
+    PARSER.add_argument("--error_rate", type=float, default=0.0, help="share of requests answered with 429/5xx")
+    PARSER.add_argument("--slow_rate", type=float, default=0.0, help="share of requests answered slowly")
+    PARSER.add_argument("--slow_seconds", type=float, default=0.0, help="delay of the slow responses")
+    OPTIONS = PARSER.parse_args()
+
+    DATASET = FixtureDataset(OPTIONS.fixture) if OPTIONS.fixture else SyntheticDataset(OPTIONS.rows, OPTIONS.seed)
+    FAULTS = None
+    if OPTIONS.error_rate or OPTIONS.slow_rate:
+        FAULTS = Faults(OPTIONS.error_rate, slow_rate=OPTIONS.slow_rate, slow_seconds=OPTIONS.slow_seconds,\
+            retry_after=1, seed=OPTIONS.seed)
+    SERVER = SodaStandin(DATASET, port=OPTIONS.port, verbose=True, faults=FAULTS)
+    print "Serving %s rows on http://%s/resource/<dataset>.json" % (DATASET.count, SERVER.domain())
+    SERVER.serve_forever()
@@ -0,0 +1,185 @@
+"""
+Utilities to stage source pages in local segment files and load them later
+"""
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+
+MANIFEST = 'manifest.json'
+# each record is its compressed length followed by the zlib compressed JSON page
+RECORD_HEADER = struct.Struct('>I')
+
+
+def write_manifest(directory, manifest):
+    """
+    Replace the manifest of a snapshot atomically
+    """
+    handle, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.rename(tmp_path, os.path.join(directory, MANIFEST))
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as manifest_file:
+        return json.load(manifest_file)
+
+
+def latest_snapshot(staging_dir, topic):
+    """
+    Returns the directory of the topic's newest snapshot, or None
+    """
+    topic_dir = os.path.join(staging_dir, topic)
+    if not os.path.isdir(topic_dir):
+        return None
+    snapshots = sorted([name for name in os.listdir(topic_dir)\
+        if os.path.isfile(os.path.join(topic_dir, name, MANIFEST))])
+    return os.path.join(topic_dir, snapshots[-1]) if snapshots else None
+
+
+class SegmentWriter:
+    """
+    Appends the pages of a pull to segment files of a new snapshot directory,
+    <staging_dir>/<topic>/<YYYYmmddTHHMMSS-pid>. A page is one record: its length
+    and the zlib compressed JSON of its offset, paging key and source rows.
+    A segment is closed once it holds segment_bytes and the next one started.
+
+    The manifest lists the segments with the bytes and rows committed to each,
+    and is replaced after every page, so a loader running at the same time
+    only reads whole records.
+    """
+    def __init__(self, staging_dir, topic, description, segment_bytes, compress_level=1):
+        """
+            @param staging_dir - directory holding the snapshots of every topic
+            @param topic - import topic
+            @param description - what the pages are, written to the manifest:
+                dataset_name, initialize, filter_value, paging, paging_key, total_row_count, key_count
+            @param segment_bytes - size a segment is closed at
+            @param compress_level - zlib level, 1 (fast) to 9 (small)
+        """
+        self.directory = os.path.join(staging_dir, topic, '%s-%s' % (time.strftime('%Y%m%dT%H%M%S'), os.getpid()))
+        os.makedirs(self.directory)
+        self.segment_bytes = segment_bytes
+        self.compress_level = compress_level
+        self.manifest = dict(description, topic=topic, status='fetching', segments=[])
+        self.segment = None
+        write_manifest(self.directory, self.manifest)
+
+    def append(self, offset, page_key, rows):
+        """
+        Append a page as one record and commit it to the manifest
+            @return bytes of the page before compression
+        """
+        page = json.dumps({'offset': offset, 'page_key': page_key, 'rows': rows})
+        record = zlib.compress(page, self.compress_level)
+        if self.segment is None or self.manifest['segments'][-1]['bytes'] >= self.segment_bytes:
+            self.next_segment()
+        self.segment.write(RECORD_HEADER.pack(len(record)))
+        self.segment.write(record)
+        self.segment.flush()
+
+        entry = self.manifest['segments'][-1]
+        entry['bytes'] += RECORD_HEADER.size + len(record)
+        entry['records'] += 1
+        entry['rows'] += len(rows)
+        write_manifest(self.directory, self.manifest)
+        return len(page)
+
+    def next_segment(self):
+        if self.segment:
+            self.segment.close()
+        name = 'segment-%05d.seg' % len(self.manifest['segments'])
+        self.segment = open(os.path.join(self.directory, name), 'ab')
+        self.manifest['segments'].append({'file': name, 'bytes': 0, 'records': 0, 'rows': 0})
+
+    def finish(self, status='complete'):
+        """
+        Close the last segment and mark the snapshot complete (or failed)
+        """
+        if self.segment:
+            self.segment.close()
+            self.segment = None
+        self.manifest['status'] = status
+        write_manifest(self.directory, self.manifest)
+
+    def remove_older(self, keep):
+        """
+        Remove all but the keep newest complete snapshots of the topic,
+        the newest one (just staged, to be loaded) is always kept
+        """
+        topic_dir = os.path.dirname(self.directory)
+        snapshots = sorted(os.listdir(topic_dir))
+        complete = [name for name in snapshots if self.status_of(os.path.join(topic_dir, name)) == 'complete']
+        for name in complete[:-max(keep, 1)]:
+            shutil.rmtree(os.path.join(topic_dir, name), ignore_errors=True)
+
+    def status_of(self, directory):
+        try:
+            return read_manifest(directory)['status']
+        except (IOError, ValueError):
+            return None
+
+
+class SegmentReader:
+    """
+    Reads the pages of a snapshot back in the order they were staged.
+    Segments are memory-mapped and the records decompressed one at a time.
+    While the snapshot is still being fetched, pages waits for the manifest
+    to commit more records.
+    """
+    def __init__(self, directory, poll_seconds=1.0):
+        """
+            @param directory - snapshot directory written by SegmentWriter
+            @param poll_seconds - how often to look for new records while fetching
+        """
+        self.directory = directory
+        self.poll_seconds = poll_seconds
+        self.manifest = read_manifest(directory)
+
+    def pages(self, metrics=None):
+        """
+        Generate (offset, page_key, rows, page stats) pages, like the pagers
+        of GatherAndStore. Reading and decompressing a record is timed as fetch
+        and the JSON decode as decode.
+            @param metrics - PipelineMetrics for the page stats, or None
+        """
+        segment, position = 0, 0
+        while True:
+            manifest = read_manifest(self.directory)
+            segments = manifest['segments']
+            if segment < len(segments) and position < segments[segment]['bytes']:
+                for position, page in self.read_segment(segments[segment], position, metrics):
+                    yield page
+            elif segment + 1 < len(segments):
+                segment, position = segment + 1, 0
+            elif manifest['status'] == 'complete':
+                return
+            elif manifest['status'] != 'fetching':
+                raise ValueError("snapshot %s was not staged completely (%s)" % (self.directory, manifest['status']))
+            else:
+                time.sleep(self.poll_seconds)
+
+    def read_segment(self, entry, position, metrics):
+        """
+        Generate (position after the record, page) for the committed records of a segment after position
+        """
+        with open(os.path.join(self.directory, entry['file']), 'rb') as segment_file:
+            segment_map = mmap.mmap(segment_file.fileno(), entry['bytes'], access=mmap.ACCESS_READ)
+            try:
+                while position < entry['bytes']:
+                    start = time.time()
+                    length = RECORD_HEADER.unpack_from(segment_map, position)[0]
+                    position += RECORD_HEADER.size
+                    page = zlib.decompress(segment_map[position:position + length])
+                    position += length
+                    read = time.time()
+                    record = json.loads(page)
+                    stats = metrics.page_stats(read - start, time.time() - read, len(page)) if metrics else None
+                    yield position, (record['offset'], record['page_key'], record['rows'], stats)
+            finally:
+                segment_map.close()
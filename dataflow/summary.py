@@ -0,0 +1,143 @@
+"""
+Utilities to keep a summary table of row counts up to date as chunks are written
+"""
+from collections import defaultdict
+
+# upsert keys looked up per statement when counting the rows a chunk replaces
+KEY_BATCH_SIZE = 1000
+
+
+class SummaryDelta:
+    """
+    The summary groups of one encoded chunk. With an upsert key, a key seen
+    twice counts once, in the group of its last row, like the write keeps it.
+    """
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.keys = {}
+
+    def groups(self):
+        """
+        Returns {(value, year): rows of the chunk in the group}
+        """
+        if not self.keys:
+            return dict(self.counts)
+        counts = defaultdict(int)
+        for group in self.keys.itervalues():
+            counts[group] += 1
+        return dict(counts)
+
+
+class SummaryTable:
+    """
+    Row counts of a target table per value of one column and year of a date
+    column, ex. pet_license rows per species and license_issue_date year.
+    The summary table has the columns <column>, <date_column>_year and
+    row_count, with a primary key on the first two; rows missing either
+    value are not counted.
+
+    Each chunk changes the counts of its own groups in the transaction that
+    writes it: the rows it replaces on the upsert key are subtracted from
+    their groups, then the chunk's rows added, so a dashboard reads the
+    counts without scanning the target table.
+    """
+    def __init__(self, table, column, date_column, columns, upsert_key=None):
+        """
+            @param table - summary table
+            @param column - column counted by, ex. species
+            @param date_column - date column counted by year, ex. license_issue_date
+            @param columns - columns of the encoded rows, from the topic's RowCodec
+            @param upsert_key - columns of the key chunks upsert on, if any
+        """
+        missing = [name for name in [column, date_column] + list(upsert_key or []) if name not in columns]
+        if missing:
+            raise ValueError("summary %s needs columns %s, which are not written" % (table, ','.join(missing)))
+        self.table = table
+        self.column = column
+        self.date_column = date_column
+        self.year_column = date_column + '_year'
+        self.upsert_key = list(upsert_key or [])
+        self.column_index = columns.index(column)
+        self.date_index = columns.index(date_column)
+        self.key_indexes = [columns.index(name) for name in self.upsert_key]
+
+    def tally(self, rows, delta):
+        """
+        Generate the encoded rows, counting each in delta
+            @param rows - encoded tuples, ex. from RowCodec.encode_rows
+            @param delta - SummaryDelta of the chunk
+        """
+        column_index, date_index, key_indexes = self.column_index, self.date_index, self.key_indexes
+        for values in rows:
+            value, date = values[column_index], values[date_index]
+            if value is not None and date:
+                group = (value, int(date[:4]))
+                if key_indexes:
+                    delta.keys[tuple([values[index] for index in key_indexes])] = group
+                else:
+                    delta.counts[group] += 1
+            yield values
+
+    def chunk_queries(self, client, table, delta):
+        """
+        Returns (before, after), the queries to run in the transaction writing
+        a chunk to table: before counts the rows the chunk replaces, after
+        applies the difference to the summary
+            @param client - TargetClient of the target
+            @param table - table the chunk is written to
+            @param delta - SummaryDelta of the chunk
+        """
+        replaced = defaultdict(int)
+        keys = delta.keys.keys()
+
+        def count_replaced(cursor):
+            # runs again when the transaction is retried
+            replaced.clear()
+            for start in xrange(0, len(keys), KEY_BATCH_SIZE):
+                batch = keys[start:start + KEY_BATCH_SIZE]
+                if len(self.upsert_key) == 1:
+                    key_match = "%s IN (%s)" % (self.upsert_key[0], ','.join(['%s'] * len(batch)))
+                else:
+                    key_match = "(%s) IN (%s)" % (','.join(self.upsert_key),\
+                        ','.join(['(%s)' % ','.join(['%s'] * len(self.upsert_key))] * len(batch)))
+                cursor.execute("SELECT %s, EXTRACT(YEAR FROM %s), COUNT(*) FROM %s WHERE %s AND %s IS NOT NULL"\
+                    " AND %s IS NOT NULL GROUP BY 1, 2" % (self.column, self.date_column, table, key_match,\
+                    self.column, self.date_column), [value for key in batch for value in key])
+                for value, year, count in cursor.fetchall():
+                    if isinstance(value, unicode):
+                        value = value.encode('utf-8')
+                    replaced[(value, int(year))] += int(count)
+
+        def apply_counts(cursor):
+            counts = delta.groups()
+            for group, count in replaced.iteritems():
+                counts[group] = counts.get(group, 0) - count
+            changes = [(value, year, count) for (value, year), count in sorted(counts.iteritems()) if count]
+            if changes:
+                summary = client.qualified_table(self.table)
+                cursor.execute("INSERT INTO %s (%s, %s, row_count) VALUES %s %s" % (summary, self.column,\
+                    self.year_column, ','.join(['(%s,%s,%s)'] * len(changes)),\
+                    client.increment_clause(summary, [self.column, self.year_column], 'row_count')),\
+                    [value for change in changes for value in change])
+
+        return ([count_replaced] if keys else []), [apply_counts]
+
+    def refresh_queries(self, client, table, years=None):
+        """
+        Returns the queries recounting the summary from table, for some years or all of them
+            @param client - TargetClient of the target
+            @param table - table the summary counts
+            @param years - years to recount, None for the whole summary
+        """
+        summary = client.qualified_table(self.table)
+        delete = "DELETE FROM %s" % summary
+        where = "%s IS NOT NULL AND %s IS NOT NULL" % (self.column, self.date_column)
+        if years is not None:
+            if not years:
+                return []
+            delete = delete + " WHERE %s IN (%s)" % (self.year_column, ','.join([str(year) for year in years]))
+            where = where + " AND (%s)" % ' OR '.join(["(%s >= '%s-01-01' AND %s < '%s-01-01')"\
+                % (self.date_column, year, self.date_column, year + 1) for year in years])
+        return [delete, "INSERT INTO %s (%s, %s, row_count) SELECT %s, EXTRACT(YEAR FROM %s), COUNT(*) FROM %s"\
+            " WHERE %s GROUP BY 1, 2" % (summary, self.column, self.year_column, self.column, self.date_column,\
+            table, where)]
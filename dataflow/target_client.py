@@ -0,0 +1,403 @@
+"""
+Utilities shared by the target database clients
+"""
+import datetime
+import threading
+import time
+
+class ConnectionPool:
+    """
+    Idle connections keyed by client type, host/port/db/user (and connect options).
+    A connection is checked out by one client at a time, so topics and
+    writer threads in a process can share the pool. Idle connections are
+    health checked before they are handed out again.
+    """
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def checkout(self, key, connect):
+        """
+        Returns a healthy idle connection for key or a new one from connect()
+        """
+        while True:
+            with self.lock:
+                conns = self.idle.get(key)
+                conn = conns.pop() if conns else None
+            if conn is None:
+                return connect()
+            if self.healthy(conn):
+                return conn
+            self.discard(conn)
+
+    def checkin(self, key, conn):
+        """
+        Returns a connection to the pool, closing it if the pool is full
+        """
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        self.discard(conn)
+
+    def healthy(self, conn):
+        """
+        MySQLdb connections answer ping, other DB-API connections a SELECT 1
+        """
+        try:
+            if hasattr(conn, 'ping'):
+                conn.ping()
+            else:
+                conn.rollback()
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+                conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+POOL = ConnectionPool()
+
+
+class TargetClient:
+    """
+    A DB-API connection to a target database, checked out of POOL.
+    Statements are retried with exponential backoff on a healthy or fresh
+    connection; with metrics set, statements are timed as insert and commits
+    as commit.
+
+    Only the errors retryable() accepts (lost connections, deadlocks and the
+    like) are retried, other errors are raised at once.
+
+    Subclasses connect to their database and provide its dialect:
+    connect, set_autocommit, retryable, max_statement_size, qualified_table,
+    upsert_clause, increment_clause, literal, month_expression, create_table_like,
+    secondary_indexes, drop_indexes, create_indexes, copy_grants,
+    swap_tables, load_options and bulk_load.
+    """
+    MAX_RETRY_ATTEMPTS = 5
+    # seconds to wait before retry n: BACKOFF_BASE * 2 ** (n - 1), at most BACKOFF_MAX
+    BACKOFF_BASE = 0.5
+    BACKOFF_MAX = 30
+
+    def __init__(self, logger, host, port, user, password, db, autocommit=False, silent_mode=False, local_infile=False):
+        self.logger = logger
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.db = db
+        self.conn = None
+        self.failure = 0
+        self.autocommit = autocommit
+        self.silent_mode = silent_mode
+        self.local_infile = local_infile
+        self.pool_key = (self.__class__.__name__, host, port, db, user, bool(local_infile))
+        # optional PipelineMetrics, statements are timed as insert and commits as commit
+        self.metrics = None
+        self.init()
+
+    def init(self):
+        if self.conn:
+            self.close()
+        self.conn = POOL.checkout(self.pool_key, self.connect)
+        self.set_autocommit(self.conn, self.autocommit)
+
+    def connect(self):
+        raise NotImplementedError
+
+    def set_autocommit(self, conn, autocommit):
+        raise NotImplementedError
+
+    def retryable(self, e):
+        """
+        Returns True if the statement that raised e may succeed when run again,
+        ex. after the connection was lost; not for SQL, privilege or data errors
+        """
+        raise NotImplementedError
+
+    def recover(self, failure):
+        """
+        Back off exponentially after a failed attempt, then keep the connection
+        (rolled back) if it is still healthy or swap it for another one
+            @param failure - number of consecutive failed attempts
+        """
+        time.sleep(min(self.BACKOFF_BASE * 2 ** (failure - 1), self.BACKOFF_MAX))
+        if POOL.healthy(self.conn):
+            try:
+                self.conn.rollback()
+                return
+            except Exception:
+                pass
+        POOL.discard(self.conn)
+        self.conn = None
+        self.init()
+
+    def abort(self):
+        """
+        Roll back a failed transaction before raising its error, so the
+        connection can run the next statement
+        """
+        try:
+            self.conn.rollback()
+        except Exception:
+            pass
+
+    def transaction(self, queries):
+        """
+        Run the queries in a single transaction and commit once.
+        On a retryable failure the transaction is rolled back and the whole list
+        is retried. A failed commit is raised, the server may have committed.
+            @param queries - list of query strings, (query, args) tuples
+                or functions called with the cursor
+        """
+        if self.autocommit:
+            self.logger.error("no transaction with autocommit")
+            return
+        failure = 0
+        while True:
+            committing = False
+            try:
+                cursor = self.conn.cursor()
+                start = time.time()
+                for query in queries:
+                    if isinstance(query, tuple):
+                        cursor.execute(*query)
+                    elif callable(query):
+                        query(cursor)
+                    else:
+                        cursor.execute(query)
+                start = self.timed('insert', start)
+                committing = True
+                self.conn.commit()
+                self.timed('commit', start)
+                return
+            except Exception, e:
+                failure += 1
+                self.logger.exception("transaction of %s queries failed (attempt %s)"
+                                      % (len(queries), failure))
+                # replaying a transaction the server committed would apply it twice
+                if committing or not self.retryable(e) or failure > self.MAX_RETRY_ATTEMPTS:
+                    self.abort()
+                    raise e
+                self.recover(failure)
+
+    def timed(self, stage, start):
+        """
+        Add the time since start to a stage of the metrics, if any
+            @return the current time, to start the next stage
+        """
+        now = time.time()
+        if self.metrics:
+            self.metrics.add(stage, now - start)
+        return now
+
+    def max_statement_size(self):
+        """
+        Returns the largest statement in bytes the server accepts
+        """
+        raise NotImplementedError
+
+    def insert_many(self, table, columns, rows, on_duplicate=None, before=None, after=None):
+        """
+        Insert rows with parameterized multi-row INSERT statements, each kept
+        under max_statement_size, and commit them as one transaction
+            @param table - target table, optionally qualified with the db
+            @param columns - target columns
+            @param rows - iterable of value tuples ordered like columns
+            @param on_duplicate - upsert clause from upsert_clause, if any
+            @param before - queries to run first in the transaction, as for transaction
+            @param after - queries to run last in the transaction
+        """
+        queries = self.insert_statements(table, columns, rows, on_duplicate)
+        if queries:
+            self.transaction(list(before or []) + queries + list(after or []))
+            if self.silent_mode != True:
+                self.logger.info("inserted %s rows into %s with %s statements"
+                                 % (sum([len(args) for _, args in queries]) / len(columns), table, len(queries)))
+
+    def insert_statements(self, table, columns, rows, on_duplicate=None):
+        """
+        Returns the (query, args) multi-row INSERT statements for rows,
+        each kept under max_statement_size, to run with transaction
+            @param table - target table, optionally qualified with the db
+            @param columns - target columns
+            @param rows - iterable of value tuples ordered like columns
+            @param on_duplicate - upsert clause from upsert_clause, if any
+        """
+        prefix = "INSERT INTO %s (%s) VALUES " % (table, ','.join(columns))
+        suffix = ' ' + on_duplicate if on_duplicate else ''
+        placeholders = '(' + ','.join(['%s'] * len(columns)) + ')'
+        # leave room for the statement text and escaping
+        packet_limit = self.max_statement_size() / 2 - len(prefix) - len(suffix)
+
+        queries, batch, batch_size = [], [], 0
+        for row in rows:
+            row_size = len(placeholders) + 1 + sum(
+                [len(value) if isinstance(value, basestring) else 20 for value in row])
+            if batch and batch_size + row_size > packet_limit:
+                queries.append(self._insert_statement(prefix, placeholders, batch, suffix))
+                batch, batch_size = [], 0
+            batch.append(row)
+            batch_size += row_size
+        if batch:
+            queries.append(self._insert_statement(prefix, placeholders, batch, suffix))
+        return queries
+
+    def _insert_statement(self, prefix, placeholders, batch, suffix=''):
+        args = []
+        for row in batch:
+            args.extend(row)
+        return (prefix + ','.join([placeholders] * len(batch)) + suffix, args)
+
+    def execute(self, query, ret=False, args=None):
+        while True:
+            try:
+                cursor = self.conn.cursor()
+                start = time.time()
+                cursor.execute(query, args)
+                self.timed('insert', start)
+                if self.silent_mode != True:
+                    self.logger.info("query:%s" % query)
+                rows = cursor.fetchall() if ret else None
+                if not self.autocommit:
+                    start = time.time()
+                    self.conn.commit()
+                    self.timed('commit', start)
+                # Reset failure counter as the execution succeeded.
+                self.failure = 0
+                return rows
+            except Exception, e:
+                self.failure += 1
+                self.logger.exception("query %s failed" % (query))
+                if not self.retryable(e) or self.failure > self.MAX_RETRY_ATTEMPTS:
+                    self.abort()
+                    raise e
+                self.recover(self.failure)
+
+    def watermark(self, query, datatype):
+        """
+        Returns the value of a topic's filter_sql, formatted for its filter_soql,
+        or None when the target table is empty
+            @param query - single value query, ex. SELECT MAX(license_issue_date) FROM pet_license
+            @param datatype - datetime, integer or anything else to use the value as is
+        """
+        rows = self.execute(query, ret=True)
+        value = rows[0][0] if rows else None
+        if not value:
+            return None
+        if datatype == "datetime":
+            return value.strftime("%Y-%m-%d")
+        if datatype == "integer":
+            return int(value)
+        return value
+
+    def qualified_table(self, table):
+        """
+        Returns the name to write table as, qualified with the db where the dialect allows
+        """
+        raise NotImplementedError
+
+    def upsert_clause(self, columns, upsert_key):
+        """
+        Returns the clause appended to an INSERT so rows colliding on upsert_key
+        update the existing row
+        """
+        raise NotImplementedError
+
+    def increment_clause(self, table, key, counter):
+        """
+        Returns the clause appended to an INSERT into table so a row colliding
+        on key adds its counter to the existing row's
+        """
+        raise NotImplementedError
+
+    def literal(self, value):
+        """
+        Returns an encoded value as an SQL literal, None as DEFAULT
+        """
+        raise NotImplementedError
+
+    def month_expression(self, column):
+        """
+        Returns an expression formatting a date column as 'YYYY-MM'
+        """
+        raise NotImplementedError
+
+    def create_table_like(self, table, template):
+        """
+        Create table with the columns and indexes of template, unless it exists
+        """
+        raise NotImplementedError
+
+    def drop_table(self, table):
+        self.execute("DROP TABLE IF EXISTS %s" % table)
+
+    def row_count(self, table):
+        return int(self.execute("SELECT COUNT(*) FROM %s" % table, ret=True)[0][0])
+
+    def secondary_indexes(self, table):
+        """
+        Returns [(name, definition)] of the non-unique indexes of table, definitions
+        create_indexes can build on another table with the same columns
+        """
+        raise NotImplementedError
+
+    def drop_indexes(self, table, names):
+        raise NotImplementedError
+
+    def create_indexes(self, table, indexes):
+        """
+        Build indexes from secondary_indexes on table
+        """
+        raise NotImplementedError
+
+    def copy_grants(self, source, table):
+        """
+        Grant on table what is granted on source, where grants do not follow the table name
+        """
+        raise NotImplementedError
+
+    def swap_tables(self, table, staging, retired):
+        """
+        Replace table with staging in one atomic rename, then drop the old table
+            @param retired - name the old table is renamed to before it is dropped
+        """
+        raise NotImplementedError
+
+    def load_options(self, serializer):
+        """
+        Returns the options bulk_load reads files written by serializer with
+            @raise ValueError - when the serializer's output cannot be read back exactly
+        """
+        raise NotImplementedError
+
+    def bulk_load(self, path, table, columns, options, upsert_key=None, before=None, after=None):
+        """
+        Load a file written by CsvSerializer.serialize_rows in one statement
+            @param path - file written by CsvSerializer
+            @param table - target table, from qualified_table
+            @param columns - target columns in the order they appear in the file
+            @param options - from load_options
+            @param upsert_key - columns of the unique key rows already in the target are replaced on, if any
+            @param before - queries to run in the load's transaction before it, as for transaction
+            @param after - queries to run in the load's transaction after it
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Return the connection to the pool
+        """
+        if self.conn:
+            POOL.checkin(self.pool_key, self.conn)
+            self.conn = None
@@ -0,0 +1,295 @@
+"""
+Utilities to write a topic's chunks to each of its targets
+"""
+import os
+import threading
+from Queue import Queue
+
+from checkpoint import ImportCheckpoint
+from mysql_wrapper import MySQLWrapper
+from postgres_wrapper import PostgresWrapper
+
+# target client of each target_type
+TARGET_CLIENTS = {
+    'mysql': MySQLWrapper,
+    'postgres': PostgresWrapper
+}
+# an initialize by swap loads <table>_initialize, and <table>_retired is the table it replaced
+STAGING_SUFFIX = '_initialize'
+RETIRED_SUFFIX = '_retired'
+
+class Chunk:
+    """
+    A page of source rows, encoded once for every target.
+    For bulk loads the rows are serialized to a file under tmp_dir, which is
+    removed once every target has released the chunk; otherwise they are
+    kept as a list of encoded tuples.
+    """
+    def __init__(self, offset, page_key, last_key, row_count, comments, rows=None, path=None,\
+            stats=None, checkpoint=False, summary=None):
+        """
+            @param offset - rows of the import before this chunk
+            @param page_key - paging key the chunk started after, for keyset paging
+            @param last_key - paging key of the chunk's last row
+            @param row_count - rows in the chunk
+            @param comments - import_log comments for the chunk
+            @param rows - encoded tuples, ordered like the codec's columns
+            @param path - file the rows were serialized to, for bulk loads
+            @param stats - stage times and bytes of fetching and encoding the chunk
+            @param checkpoint - whether targets checkpoint after writing the chunk
+            @param summary - SummaryDelta of the rows, when the topic keeps a summary table
+        """
+        self.offset = offset
+        self.page_key = page_key
+        self.last_key = last_key
+        self.row_count = row_count
+        self.comments = comments
+        self.rows = rows
+        self.path = path
+        self.stats = stats
+        self.checkpoint = checkpoint
+        self.summary = summary
+        self.users = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.users += 1
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            done = self.users == 0
+        if done:
+            self.rows = None
+            if self.path:
+                os.remove(self.path)
+
+
+class TargetWriter(threading.Thread):
+    """
+    Writes a topic's chunks, in order, to one of its targets from its own thread.
+    At most queue_depth chunks wait for the target, so a slow target holds the
+    others back only once its queue is full. After each chunk it writes the
+    chunk's import_log row for this target and, for paged imports, its checkpoint.
+
+    A failed write is kept in error and the chunks after it are skipped,
+    so the topic never blocks on a target that stopped writing.
+
+    For an initialize by swap, see start_swap, the chunks go to a staging copy
+    of the target table that swap_in renames over it once it is loaded.
+
+    When the topic keeps a summary table, each chunk updates the counts of its
+    groups in the transaction that writes it, see SummaryTable.
+    """
+    def __init__(self, gather, conn_name, queue_depth):
+        """
+            @param gather - the GatherAndStore whose chunks this writes
+            @param conn_name - TARGET_CONN entry of the target
+            @param queue_depth - number of chunks that can wait for the target
+        """
+        threading.Thread.__init__(self, name='target_writer_%s' % conn_name)
+        self.daemon = True
+        self.gather = gather
+        self.logger = gather.logger
+        self.metrics = gather.metrics
+        self.load_mode = gather.load_mode
+        self.conn_name = conn_name
+        connection = gather.settings.TARGET_CONN[conn_name]
+        self.conn = dict([(key, connection[key]) for key in ['host', 'port', 'user', 'password', 'db']])
+        self.label = "%s.%s (%s)" % (self.conn['db'], gather.target_table, conn_name)
+
+        self.queue = Queue(max(1, queue_depth))
+        self.error = None
+        self.finished = False
+        self.resume_offset = None
+        self.staging_table = None
+        self.indexes = []
+
+        # use different connection method based upon target_type, the
+        # TARGET_CONN entry's own or else the topic's
+        self.target_type = connection.get('target_type', gather.target_type)
+        if self.target_type not in TARGET_CLIENTS:
+            raise ValueError("Could not find connection method for target_type %s" % self.target_type)
+        self.client = TARGET_CLIENTS[self.target_type](self.logger,\
+            local_infile=(self.load_mode == 'bulk'), **self.conn)
+        self.client.metrics = self.metrics
+        self.codec = gather.new_codec(self.client.qualified_table(gather.target_table), dialect=self.client)
+        if self.load_mode == 'bulk':
+            # refuse a serializer the target cannot read back before anything is pulled
+            self.load_options = self.client.load_options(gather.serializer)
+
+        # checkpoints are written next to the import log, after every committed chunk
+        self.checkpoint = ImportCheckpoint(MySQLWrapper(self.logger, silent_mode=True,\
+            **gather.logging_conn), gather.checkpoint_table, gather.import_topic,\
+            conn_name, self.conn['db'], gather.target_table)
+
+    def start_swap(self, resume=False):
+        """
+        Write the chunks to a staging copy of the target table instead, created
+        like it and without its non-unique indexes, which swap_in builds once
+        the rows are loaded. Readers keep the target table until then.
+        Call before the first chunk is queued.
+            @param resume - keep the rows an interrupted initialize loaded
+        """
+        table = self.gather.target_table
+        self.staging_table = table + STAGING_SUFFIX
+        staging = self.client.qualified_table(self.staging_table)
+        if not resume:
+            self.client.drop_table(staging)
+        self.client.create_table_like(staging, self.client.qualified_table(table))
+        self.indexes = self.client.secondary_indexes(table)
+        self.client.drop_indexes(staging, [name for name, _ in self.client.secondary_indexes(self.staging_table)])
+        self.codec = self.gather.new_codec(staging, dialect=self.client)
+        self.gather.log_msg("Loading %s into %s, then swapping it in." % (self.label, staging))
+
+    def check_swap(self, row_count, key_count=None):
+        """
+        Raise a ValueError unless the staging table holds the rows the source
+        counted. Rows with the same key are merged into one, so with key_count
+        it holds a row per key, without it at most row_count rows.
+            @param row_count - rows the source counted
+            @param key_count - distinct upsert_key values the source counted, None if not counted
+        """
+        loaded = self.client.row_count(self.codec.table)
+        if key_count is not None:
+            if loaded != key_count:
+                raise ValueError("%s holds %s rows but the source counted %s keys, %s was not replaced"\
+                    % (self.codec.table, loaded, key_count, self.label))
+        elif loaded > row_count:
+            raise ValueError("%s holds %s rows but the source counted %s, %s was not replaced"\
+                % (self.codec.table, loaded, row_count, self.label))
+        elif loaded < row_count:
+            self.gather.log_msg("%s holds %s rows, %s of the %s the source counted were merged by key."\
+                % (self.codec.table, loaded, row_count - loaded, row_count))
+
+    def swap_in(self):
+        """
+        Build the indexes of the staging table and rename it over the target table
+        """
+        table = self.client.qualified_table(self.gather.target_table)
+        self.client.create_indexes(self.codec.table, self.indexes)
+        self.client.copy_grants(self.gather.target_table, self.staging_table)
+        self.client.swap_tables(table, self.codec.table,\
+            self.client.qualified_table(self.gather.target_table + RETIRED_SUFFIX))
+        self.gather.log_msg("Swapped %s in for %s." % (self.codec.table, self.label))
+        if self.gather.summary:
+            self.client.transaction(self.gather.summary.refresh_queries(self.client, table))
+        self.codec = self.gather.new_codec(table, dialect=self.client)
+        self.staging_table = None
+
+    def import_log_record(self, values):
+        """
+        Returns an import_log record of values for this target
+        """
+        record = dict(values)
+        record['target_host'] = self.conn['host']
+        record['target_db'] = self.conn['db']
+        return record
+
+    def put(self, chunk):
+        """
+        Queue a chunk, waiting while the queue is full
+        """
+        chunk.acquire()
+        if self.error:
+            chunk.release()
+            return
+        self.queue.put(chunk)
+
+    def finish(self):
+        """
+        Wait for the queued chunks to be written and stop the thread
+            @return the error that stopped the writes, or None
+        """
+        if not self.finished:
+            self.finished = True
+            self.queue.put(None)
+        if self.is_alive():
+            self.join()
+        return self.error
+
+    def run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            try:
+                if not self.error:
+                    self.write_chunk(chunk)
+            except Exception, e:
+                self.error = e
+                self.logger.exception("Could not write chunk (offset=%s) to %s" % (chunk.offset, self.label))
+            finally:
+                chunk.release()
+
+    def write_chunk(self, chunk):
+        """
+        Write a chunk to the target, then log and checkpoint it
+        """
+        if self.resume_offset and chunk.offset + chunk.row_count <= self.resume_offset:
+            # a resumed import of several targets restarts from the one furthest behind
+            return
+
+        # summary counts change with the chunk, except in a staging table whose summary swap_in counts
+        before, after = [], []
+        if chunk.summary and not self.staging_table:
+            before, after = self.gather.summary.chunk_queries(self.client, self.codec.table, chunk.summary)
+
+        self.metrics.start_chunk(chunk.stats)
+        if self.load_mode == 'bulk':
+            self.bulk_load(chunk.path, before, after)
+        elif self.load_mode == 'batch':
+            self.batch_insert(chunk.rows, before, after)
+        elif after:
+            # rows and summary counts commit together
+            self.client.transaction(before + [self.codec.insert_statement(values) for values in chunk.rows] + after)
+        else:
+            for values in chunk.rows:
+                self.write_row(values)
+        chunk_metrics = self.metrics.end_chunk(chunk.row_count)
+
+        self.gather.log_msg("Successfully wrote %s rows to %s." % (chunk.row_count, self.label))
+        if chunk.row_count:
+            record = self.import_log_record(self.gather.implog_row_values)
+            record['chunk_row_count'] = chunk.row_count
+            record['comments'] = chunk.comments
+            record.update(chunk_metrics)
+            self.gather.implog_writer.write(record)
+
+        if chunk.checkpoint and chunk.row_count:
+            # the chunk is committed, a resumed import starts after it
+            self.checkpoint.save(chunk.offset + chunk.row_count, chunk.last_key)
+
+    def write_row(self, values):
+        """
+        Write a single row of data
+            @param values: The row encoded by the topic's row codec
+        """
+        self.client.execute(self.codec.insert_statement(values))
+
+    def bulk_load(self, path, before=None, after=None):
+        """
+        Load a file written by CsvSerializer.serialize_rows into the target in
+        one statement; with an upsert key, rows already in the target are replaced
+            @param before, after - queries to run in the load's transaction
+        """
+        self.client.bulk_load(path, self.codec.table, self.codec.columns, self.load_options,\
+            upsert_key=self.codec.upsert_key, before=before, after=after)
+
+    def batch_insert(self, rows, before=None, after=None):
+        """
+        Write the rows with multi-row inserts committed as
+        a single transaction, for targets without LOAD DATA
+            @param rows - encoded tuples
+            @param before, after - queries to run in the same transaction
+        """
+        self.client.insert_many(self.codec.table, self.codec.columns, rows,\
+            on_duplicate=self.codec.on_duplicate, before=before, after=after)
+
+    def close(self):
+        """
+        Return the connections to the pool
+        """
+        self.client.close()
+        self.checkpoint.client.close()
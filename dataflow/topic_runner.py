@@ -0,0 +1,108 @@
+"""
+Utilities to run several import topics at once
+"""
+import copy
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from gather_and_store import GatherAndStore, init_logging
+
+def run_topic(settings, options, topic, log_file):
+    """
+    Run one topic in this process, logging to log_file.
+    Exits 0 when the topic completed or had nothing to pull, 1 when it failed.
+    """
+    init_logging(log_file)
+    options = copy.copy(options)
+    options.import_topic = topic
+    options.log_file = log_file
+    try:
+        GatherAndStore(settings, options).run()
+    except SystemExit, e:
+        sys.exit(e.code or 0)
+    except Exception:
+        logging.getLogger('gather_and_store').exception("Topic %s failed" % topic)
+        sys.exit(1)
+
+
+class TopicRunner:
+    """
+    Runs topics concurrently, each in its own process with its own log file.
+    At most MISC['topic_concurrency'] topics run at once, and at most
+    max_concurrent_topics per target connection (from its TARGET_CONN entry,
+    or MISC['topic_concurrency_per_target']) so one database is not saturated;
+    a topic writing to several targets counts against each of them.
+    Topics wait their turn in the order given.
+    """
+    POLL_SECONDS = 0.2
+
+    def __init__(self, settings, options, topics):
+        """
+            @param settings - settings module
+            @param options - parsed command line, shared by every topic
+            @param topics - names of the IMPORT_TOPICS to run
+        """
+        unknown = [topic for topic in topics if topic not in settings.IMPORT_TOPICS]
+        if unknown:
+            raise ValueError("unknown import topics: %s" % ', '.join(unknown))
+        self.settings = settings
+        self.options = options
+        self.topics = list(topics)
+        self.concurrency = settings.MISC.get('topic_concurrency', 4)
+        self.per_target = settings.MISC.get('topic_concurrency_per_target', 2)
+        self.log_dir = settings.LOGGING['directory'] or settings.MISC['tmp_dir']
+
+    def targets_of(self, topic):
+        targets = self.settings.IMPORT_TOPICS[topic].get('target_conn') or []
+        if isinstance(targets, basestring):
+            targets = [target.strip() for target in targets.split(',')]
+        return targets
+
+    def target_limit(self, target):
+        return self.settings.TARGET_CONN.get(target, {}).get('max_concurrent_topics', self.per_target)
+
+    def log_file(self, topic):
+        return os.path.join(self.log_dir, 'gather_and_store_%s.log' % topic)
+
+    def run(self):
+        """
+        Run every topic and wait for them
+            @return exit status: 0 if every topic succeeded, 1 otherwise
+        """
+        waiting = list(self.topics)
+        running = {}
+        results = []
+        while waiting or running:
+            # start every waiting topic whose target has room, in order
+            for topic in list(waiting):
+                if len(running) >= self.concurrency:
+                    break
+                targets = self.targets_of(topic)
+                if [target for target in targets if len([1 for other in running\
+                        if target in self.targets_of(other)]) >= self.target_limit(target)]:
+                    continue
+                worker = multiprocessing.Process(target=run_topic, name=topic,\
+                    args=(self.settings, self.options, topic, self.log_file(topic)))
+                worker.start()
+                running[topic] = (worker, time.time())
+                waiting.remove(topic)
+                print "INFO: Started topic %s (target %s), logging to %s" % (topic, ', '.join(targets),\
+                    self.log_file(topic))
+
+            time.sleep(self.POLL_SECONDS)
+            for topic, (worker, started) in running.items():
+                if not worker.is_alive():
+                    worker.join()
+                    del running[topic]
+                    results.append((topic, worker.exitcode, time.time() - started))
+                    print "INFO: Topic %s %s in %.1f s" % (topic,\
+                        "completed" if worker.exitcode == 0 else "FAILED (exit code %s)" % worker.exitcode,\
+                        time.time() - started)
+
+        failed = [topic for topic, exitcode, _ in results if exitcode != 0]
+        print "INFO: %s of %s topics completed.%s" % (len(results) - len(failed), len(results),\
+            " Failed: %s, see their logs." % ', '.join(failed) if failed else "")
+        return 1 if failed else 0